@@ -0,0 +1,212 @@
+# ==============================================================================
+# benchmarks/harness.py
+# Runs the real services and API in-process with injected models, plus a fake
+# voice feeder that drives the Discord sink without a Discord connection.
+# Import only after benchmarks.run has set the environment (settings load at import).
+# ==============================================================================
+import asyncio
+import logging
+import random
+import socket
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import uvicorn
+from penny_v2_api.config import settings
+from penny_v2_api.core.audio import DISCORD_CHANNELS, DISCORD_SAMPLE_RATE, parse_wav, wav_to_discord_pcm
+from penny_v2_api.core.event_bus import EventBus
+from penny_v2_api.core.events import LogEvent
+from penny_v2_api.api_server import ApiServer
+from penny_v2_api.services.discord_bot import AudioSink, DiscordBotService
+from penny_v2_api.services.memory import MemoryService
+from penny_v2_api.services.music import MusicGenerationService
+from penny_v2_api.services.transcription import TranscriptionService
+
+logger_bench = logging.getLogger("benchmarks")
+
+FRAME_MS = 20
+FRAME_BYTES = DISCORD_SAMPLE_RATE * FRAME_MS // 1000 * DISCORD_CHANNELS * 2
+OPUS_SILENCE_FRAME = b"\xf8\xff\xfe"
+
+class BenchApp:
+    """Services + ApiServer on one event bus, served by an in-process uvicorn on a free port."""
+    def __init__(self, whisper_factory=None, music_factory=None, embedding_factory=None):
+        self.event_bus = EventBus()
+        self.services = {
+            "memory": MemoryService(self.event_bus, settings, embedding_factory=embedding_factory),
+            "transcription": TranscriptionService(self.event_bus, model_factory=whisper_factory),
+            "music": MusicGenerationService(self.event_bus, model_factory=music_factory),
+        }
+        self.api = ApiServer(self.event_bus, self.services)
+        self.event_bus.subscribe_queued(LogEvent, self._log, maxsize=1000)
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._server: Optional[uvicorn.Server] = None
+        self._server_task: Optional[asyncio.Task] = None
+
+    async def _log(self, event: LogEvent):
+        logger_bench.debug(event.message)
+
+    async def start(self) -> Dict[str, float]:
+        """Start services concurrently and the HTTP server; returns per-service start seconds."""
+        timings: Dict[str, float] = {}
+
+        async def start_one(name, service):
+            started = time.perf_counter()
+            await service.start()
+            timings[name] = time.perf_counter() - started
+
+        await asyncio.gather(*(start_one(n, s) for n, s in self.services.items()))
+        config = uvicorn.Config(self.api.get_app(), host="127.0.0.1", port=self.port,
+                                log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._server_task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._server_task.done():
+                self._server_task.result()
+            await asyncio.sleep(0.05)
+        return timings
+
+    async def stop(self):
+        if self._server:
+            self._server.should_exit = True
+            await self._server_task
+        for service in reversed(list(self.services.values())):
+            await service.stop()
+        await self.event_bus.close()
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# --- voice input -----------------------------------------------------------------
+
+def synthetic_speaker(seconds: float, rng: random.Random, amplitude: float = 0.2) -> List[Optional[bytes]]:
+    """Per-frame PCM for one speaker: bursts of 1-4 s of voiced noise, None while silent.
+
+    Discord sends nothing while a user is quiet, so silence is absence of packets, not zeros.
+    """
+    frames: List[Optional[bytes]] = []
+    total = int(seconds * 1000 / FRAME_MS)
+    samples_per_frame = FRAME_BYTES // 2 // DISCORD_CHANNELS
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    while len(frames) < total:
+        talk = int(rng.uniform(1.0, 4.0) * 1000 / FRAME_MS)
+        pitch = rng.uniform(100, 250)
+        for i in range(talk):
+            t = (np.arange(samples_per_frame) + i * samples_per_frame) / DISCORD_SAMPLE_RATE
+            wave = amplitude * (np.sin(2 * np.pi * pitch * t) + 0.3 * np_rng.standard_normal(samples_per_frame))
+            stereo = np.repeat((np.clip(wave, -1, 1) * 32767).astype(np.int16)[:, None], DISCORD_CHANNELS, axis=1)
+            frames.append(stereo.tobytes())
+        frames.extend([None] * int(rng.uniform(0.5, 2.0) * 1000 / FRAME_MS))
+    return frames[:total]
+
+def recorded_speaker(path: Path) -> List[Optional[bytes]]:
+    """Per-frame PCM from a WAV file (any rate/channels), converted to the Discord receive format."""
+    info = parse_wav(path.read_bytes())
+    if info is None:
+        raise ValueError(f"{path} is not a PCM WAV file")
+    pcm = wav_to_discord_pcm(info)
+    return [pcm[i:i + FRAME_BYTES] for i in range(0, len(pcm) - FRAME_BYTES + 1, FRAME_BYTES)]
+
+def encode_opus(frames: List[Optional[bytes]]) -> List[Optional[bytes]]:
+    """The same speaker as Discord sends it in Opus passthrough mode: one packet per frame, plus the
+    five comfort-noise frames a client emits when it stops talking."""
+    from disnake import opus
+    encoder = opus.Encoder()
+    packets: List[Optional[bytes]] = []
+    silence_left = 0
+    for frame in frames:
+        if frame is not None:
+            packets.append(encoder.encode(frame, encoder.SAMPLES_PER_FRAME))
+            silence_left = 5
+        elif silence_left:
+            packets.append(OPUS_SILENCE_FRAME)
+            silence_left -= 1
+        else:
+            packets.append(None)
+    return packets
+
+class FakeUser:
+    """The parts of a disnake Member the sink reads."""
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeVoiceData:
+    """voice_recv.VoiceData stand-in: the packet as Opus or as decoded PCM, whichever the sink wants."""
+    def __init__(self, payload: bytes, opus: bool):
+        self.opus = payload if opus else None
+        self.pcm = None if opus else payload
+
+class FakeVoiceFeeder:
+    """Replays multi-speaker PCM into the real AudioSink / DiscordBotService utterance path.
+
+    Frames are written from a thread at real time (scaled by `speed`), like the voice-receive
+    thread would; utterances then flow through VAD, transcription and broadcast as in production.
+    When the sink wants Opus, the PCM is encoded up front so the feed itself stays real time.
+    """
+    def __init__(self, event_bus: EventBus, speakers: Dict[int, List[Optional[bytes]]], speed: float = 1.0):
+        self.speakers = speakers
+        self.speed = speed
+        self.discord = DiscordBotService(event_bus, settings)
+        self.sink: Optional[AudioSink] = None
+        self.frames_sent = 0
+
+    async def run(self):
+        self.discord._loop = asyncio.get_running_loop()
+        self.sink = AudioSink(self.discord.event_bus, settings, self.discord._on_utterance, self.discord._on_partial)
+        if self.sink.wants_opus():
+            loop = asyncio.get_running_loop()
+            encoded = await asyncio.gather(*(loop.run_in_executor(None, encode_opus, frames)
+                                             for frames in self.speakers.values()))
+            self.speakers = dict(zip(self.speakers, encoded))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._feed)
+            # Let the segmenter's hangover expire so trailing utterances are emitted.
+            await asyncio.sleep(settings.VAD_HANGOVER_MS / 1000 + 0.5)
+        finally:
+            self.sink.cleanup()
+
+    def _feed(self):
+        length = max(len(frames) for frames in self.speakers.values())
+        interval = FRAME_MS / 1000 / self.speed
+        opus = self.sink.wants_opus()
+        users = {user_id: FakeUser(user_id) for user_id in self.speakers}
+        next_tick = time.monotonic()
+        for index in range(length):
+            for user_id, frames in self.speakers.items():
+                if index < len(frames) and frames[index] is not None:
+                    self.sink.write(users[user_id], FakeVoiceData(frames[index], opus))
+                    self.frames_sent += 1
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+def build_speakers(count: int, seconds: float, pcm_dir: Optional[str], seed: int = 1) -> Dict[int, List[Optional[bytes]]]:
+    if pcm_dir:
+        files = sorted(Path(pcm_dir).glob("*.wav"))
+        if not files:
+            raise ValueError(f"No .wav files in {pcm_dir}")
+        return {1000 + i: recorded_speaker(path) for i, path in enumerate(files[:count] if count else files)}
+    rng = random.Random(seed)
+    return {1000 + i: synthetic_speaker(seconds, rng) for i in range(count)}
+
+def synthetic_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    """Mono s16 WAV of a tone + noise, for upload scenarios."""
+    from penny_v2_api.core.audio import float_to_pcm16, wav_header
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    wave = 0.2 * np.sin(2 * np.pi * 180 * t) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    pcm = float_to_pcm16(wave)
+    return wav_header(sample_rate, 1, data_size=len(pcm)) + pcm
+
+def stage_breakdown(traces) -> Tuple[List[float], Dict[str, List[float]]]:
+    """End-to-end latency and per-stage durations (seconds) from utterance traces."""
+    totals, stages = [], {}
+    for trace in traces:
+        totals.append(trace.duration)
+        for span in trace.spans:
+            stages.setdefault(span.name, []).append(span.end - span.start)
+    return totals, stages
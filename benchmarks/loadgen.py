@@ -0,0 +1,189 @@
+# ==============================================================================
+# benchmarks/loadgen.py
+# Closed-loop HTTP and WebSocket load generators and latency statistics.
+# ==============================================================================
+import asyncio
+import json
+import math
+import resource
+import sys
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List
+import httpx
+import websockets
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; NaN for no samples."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    return {"p50": percentile(seconds, 50) * 1000, "p95": percentile(seconds, 95) * 1000,
+            "p99": percentile(seconds, 99) * 1000, "max": (max(seconds) * 1000) if seconds else float("nan")}
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class LoadResult:
+    def __init__(self):
+        self.latencies: List[float] = []  # successful requests only
+        self.statuses: Counter = Counter()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def summary(self) -> dict:
+        ok = len(self.latencies)
+        return {"requests": sum(self.statuses.values()), "ok": ok,
+                "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+                "throughput_rps": ok / self.elapsed if self.elapsed else 0.0,
+                "latency_ms": latency_summary(self.latencies)}
+
+async def closed_loop(request: Callable[[int], Awaitable[int]], concurrency: int, duration_s: float) -> LoadResult:
+    """`concurrency` workers issue requests back to back for `duration_s`. `request` returns a status."""
+    result = LoadResult()
+    deadline = time.perf_counter() + duration_s
+    counter = iter(range(10 ** 9))
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await request(next(counter))
+            except Exception as e:
+                status = type(e).__name__
+            result.statuses[status] += 1
+            if status == 200:
+                result.latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - result.started
+    return result
+
+async def transcribe_load(base_url: str, wav: bytes, concurrency: int, duration_s: float) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        async def request(_):
+            response = await client.post("/transcribe/", files={"file": ("clip.wav", wav, "audio/wav")})
+            return response.status_code
+        return (await closed_loop(request, concurrency, duration_s)).summary()
+
+async def music_load(base_url: str, concurrency: int, duration_s: float, clip_s: int, repeat_ratio: float) -> dict:
+    """`repeat_ratio` of requests reuse one prompt, so the cache hit path is part of the mix."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        async def request(i):
+            repeated = (i * 7919 % 100) < repeat_ratio * 100
+            prompt = "bench repeated prompt" if repeated else f"bench prompt {i}"
+            response = await client.post("/generate_music/", json={"prompt": prompt, "duration": clip_s})
+            return response.status_code
+        return (await closed_loop(request, concurrency, duration_s)).summary()
+
+async def websocket_fanout(base_url: str, publish: Callable[[float], Awaitable[None]], clients: int,
+                           rate_hz: float, duration_s: float) -> dict:
+    """`clients` sockets on /ws while `publish(sent_at)` injects a broadcast at `rate_hz`.
+
+    Delivery latency is measured end to end: publish on the bus to receipt by each client.
+    """
+    url = base_url.replace("http://", "ws://") + "/ws"
+    latencies: List[float] = []
+    received = [0] * clients
+    disconnected = 0
+    sent = 0
+
+    async def client(index: int, stop: asyncio.Event):
+        nonlocal disconnected
+        try:
+            async with websockets.connect(url, max_queue=None) as ws:
+                while not stop.is_set():
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), 0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    payload = json.loads(message)
+                    if payload.get("type") == "transcription" and payload.get("username") == "bench":
+                        latencies.append(time.perf_counter() - float(payload["text"]))
+                        received[index] += 1
+        except websockets.ConnectionClosed:
+            disconnected += 1
+
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(client(i, stop)) for i in range(clients)]
+    await asyncio.sleep(0.5)  # let the sockets connect
+    started = time.perf_counter()
+    interval = 1 / rate_hz
+    while time.perf_counter() - started < duration_s:
+        await publish(time.perf_counter())
+        sent += 1
+        await asyncio.sleep(max(0.0, started + sent * interval - time.perf_counter()))
+    await asyncio.sleep(1.0)  # drain
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    expected = sent * clients
+    return {"messages_sent": sent, "clients": clients, "delivered": sum(received),
+            "delivery_ratio": sum(received) / expected if expected else 0.0,
+            "disconnected": disconnected,
+            "throughput_msgs_per_s": sum(received) / duration_s,
+            "latency_ms": latency_summary(latencies)}
+
+def _direction(where: str) -> int:
+    """+1 if a larger value of this metric is worse, -1 if a smaller one is, 0 if it is not judged."""
+    if "latency_ms" in where or "rss_mb" in where or "startup_s" in where:
+        return 1
+    if "throughput" in where or where.endswith("delivery_ratio"):
+        return -1
+    return 0
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta_ms: float = 10.0,
+            min_delta_startup_s: float = 0.5) -> List[str]:
+    """Regressions of `current` against `baseline`: latencies/RSS may not grow, throughput may not shrink,
+    by more than `tolerance` (a fraction). Latencies and startup times must also grow by more than
+    `min_delta_ms` / `min_delta_startup_s`, so short stages don't trip on scheduler noise. p99 and max
+    are a handful of samples in a run this short and are reported but not compared."""
+    problems = []
+
+    def walk(cur, base, path):
+        for key, base_value in base.items():
+            cur_value = cur.get(key) if isinstance(cur, dict) else None
+            where = f"{path}.{key}" if path else key
+            if isinstance(base_value, dict):
+                walk(cur_value or {}, base_value, where)
+                continue
+            if not isinstance(base_value, (int, float)) or not isinstance(cur_value, (int, float)):
+                continue
+            if math.isnan(base_value) or math.isnan(cur_value) or base_value == 0 or key in ("p99", "max"):
+                continue
+            if "latency_ms" in where and cur_value - base_value <= min_delta_ms:
+                continue
+            if "startup_s" in where and cur_value - base_value <= min_delta_startup_s:
+                continue
+            direction = _direction(where)
+            if direction > 0 and cur_value > base_value * (1 + tolerance):
+                problems.append(f"{where}: {cur_value:.2f} vs baseline {base_value:.2f}")
+            elif direction < 0 and cur_value < base_value * (1 - tolerance):
+                problems.append(f"{where}: {cur_value:.2f} vs baseline {base_value:.2f}")
+
+    walk(current, baseline, "")
+    return problems
+
+def widen(baseline: dict, report: dict) -> dict:
+    """Fold another run into a baseline, keeping the worse value of every judged metric, so the
+    baseline covers the run-to-run noise of its machine rather than one lucky run."""
+    def merge(base, cur, path):
+        merged = {}
+        for key, base_value in base.items():
+            cur_value = cur.get(key) if isinstance(cur, dict) else None
+            where = f"{path}.{key}" if path else key
+            if isinstance(base_value, dict):
+                merged[key] = merge(base_value, cur_value, where)
+            elif isinstance(base_value, (int, float)) and isinstance(cur_value, (int, float)):
+                direction = _direction(where)
+                merged[key] = max(base_value, cur_value) if direction > 0 else \
+                    min(base_value, cur_value) if direction < 0 else base_value
+            else:
+                merged[key] = base_value
+        return merged
+
+    return merge(baseline, report, "")
@@ -0,0 +1,180 @@
+# ==============================================================================
+# benchmarks/run.py
+# Offline end-to-end benchmark: no Discord connection or GPU needed.
+#
+#   python -m benchmarks.run                              # all scenarios, stub models
+#   python -m benchmarks.run --scenarios voice,ws --duration 60
+#   python -m benchmarks.run --whisper tiny --pcm-dir ./recordings
+#   python -m benchmarks.run --scenarios voice --speakers 24 --opus   # Opus passthrough sink
+#   python -m benchmarks.run --baseline benchmarks/baseline.json   # exit 1 on regression
+#   python -m benchmarks.run --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.run --widen-baseline benchmarks/baseline.json   # fold in another run
+#
+# Needs the service dependencies plus httpx and websockets. benchmarks/baseline.json holds
+# the defaults above (stub models, all scenarios): one --save-baseline run widened by five
+# --widen-baseline runs, i.e. the worst value of each metric over six runs. Baselines are
+# machine specific: regenerate it that way on the CI runner (or your machine), and again
+# whenever a change is expected to move the numbers. Check with the baseline's own settings
+# (no other options); differing settings are warned about.
+# ==============================================================================
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+SCENARIOS = ("voice", "transcribe", "music", "ws")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="HTTP workers for /transcribe/")
+    parser.add_argument("--speakers", type=int, default=4, help="simultaneous voice speakers")
+    parser.add_argument("--pcm-dir", help="replay these WAV files (one per speaker) instead of synthetic speech")
+    parser.add_argument("--speed", type=float, default=1.0, help="voice replay speed relative to real time")
+    parser.add_argument("--opus", action="store_true", help="feed the sink raw Opus (VOICE_OPUS_PASSTHROUGH)")
+    parser.add_argument("--clip-seconds", type=float, default=3.0, help="length of uploaded /transcribe/ clips")
+    parser.add_argument("--music-concurrency", type=int, default=2)
+    parser.add_argument("--music-seconds", type=int, default=5, help="duration of requested music")
+    parser.add_argument("--music-repeat", type=float, default=0.5, help="fraction of music requests that hit the cache")
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-rate", type=float, default=50.0, help="broadcasts per second")
+    parser.add_argument("--whisper", choices=("stub", "tiny"), default="stub")
+    parser.add_argument("--whisper-base-ms", type=float, default=40.0, help="stub cost per clip")
+    parser.add_argument("--whisper-ms-per-s", type=float, default=15.0, help="stub cost per second of audio")
+    parser.add_argument("--music", choices=("stub", "real"), default="stub")
+    parser.add_argument("--music-rtf", type=float, default=0.1, help="stub seconds of work per second of music")
+    parser.add_argument("--embeddings", choices=("stub", "default"), default="stub")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against this report; exit 1 on regression")
+    parser.add_argument("--save-baseline", help="write the report as a new baseline")
+    parser.add_argument("--widen-baseline", help="fold the report into this baseline, keeping worse values")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=10.0, help="latency growth always allowed")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="skip model warm-up at start")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+def configure_environment(workdir: str, args: argparse.Namespace):
+    """Settings are read at import time, so this must run before penny_v2_api is imported."""
+    os.environ.setdefault("DISCORD_BOT_TOKEN", "benchmark")
+    os.environ.setdefault("DISCORD_GUILD_ID", "0")
+    os.environ.setdefault("DISCORD_VOICE_CHANNEL_ID", "0")
+    os.environ["TRANSCRIPTION_DEVICE"] = "cpu"
+    os.environ["MUSIC_GEN_DEVICE"] = "cpu"
+    os.environ["MEMORY_PERSISTENT"] = "false"
+    os.environ["CHROMA_DB_DIR"] = os.path.join(workdir, "chroma")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    os.environ["MUSIC_CACHE_DIR"] = os.path.join(workdir, "music_cache")
+    os.environ["TRACE_SAMPLE_RATE"] = "1.0"
+    os.environ["TRACE_BUFFER_SIZE"] = "100000"
+    os.environ["WARMUP_MODELS"] = "true" if args.warmup else "false"
+    os.environ["VOICE_OPUS_PASSTHROUGH"] = "true" if args.opus else "false"
+
+async def _drain_utterances(tracer, settle_s: float = 1.0, timeout_s: float = 60.0) -> list:
+    """Wait until no more utterance traces complete for `settle_s`, i.e. the pipeline is empty."""
+    deadline = time.perf_counter() + timeout_s
+    traces, last_count = [], -1
+    while time.perf_counter() < deadline:
+        traces = [t for t in tracer.recent(limit=10 ** 6) if t.name == "utterance"]
+        if len(traces) == last_count:
+            break
+        last_count = len(traces)
+        await asyncio.sleep(settle_s)
+    return traces
+
+async def run(args: argparse.Namespace) -> dict:
+    from penny_v2_api.config import settings
+    from penny_v2_api.core.events import BroadcastTranscriptionEvent
+    from penny_v2_api.core.tracing import TRACER
+    from benchmarks import harness, loadgen, stubs
+
+    TRACER.configure(capacity=settings.TRACE_BUFFER_SIZE, sample_rate=1.0)
+    whisper_factory = (lambda: stubs.StubWhisperModel(args.whisper_base_ms, args.whisper_ms_per_s)) \
+        if args.whisper == "stub" else stubs.tiny_whisper_factory()
+    music_factory = (lambda: stubs.StubMusicGen(args.music_rtf)) if args.music == "stub" else None
+    embedding_factory = stubs.stub_embedding_factory() if args.embeddings == "stub" else None
+
+    app = harness.BenchApp(whisper_factory, music_factory, embedding_factory)
+    report = {"config": {k: v for k, v in vars(args).items()
+                         if k not in ("output", "baseline", "save_baseline", "widen_baseline", "tolerance",
+                                      "min_delta_ms", "verbose")}}
+    report["startup_s"] = await app.start()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    try:
+        if "voice" in scenarios:
+            speakers = harness.build_speakers(args.speakers, args.duration, args.pcm_dir)
+            feeder = harness.FakeVoiceFeeder(app.event_bus, speakers, args.speed)
+            started = time.perf_counter()
+            await feeder.run()
+            traces = await _drain_utterances(TRACER)
+            elapsed = time.perf_counter() - started
+            totals, stages = harness.stage_breakdown(traces)
+            report["voice"] = {
+                "speakers": len(speakers), "utterances": len(traces),
+                "throughput_utterances_per_s": len(traces) / elapsed,
+                "latency_ms": loadgen.latency_summary(totals),
+                "stages_latency_ms": {name: loadgen.latency_summary(values) for name, values in sorted(stages.items())},
+                "sink": {**feeder.sink.segmenter.stats(), "ignored_packets": feeder.sink.ignored_packets,
+                         "silence_packets": feeder.sink.silence_packets},
+            }
+        if "transcribe" in scenarios:
+            wav = harness.synthetic_wav(args.clip_seconds)
+            report["transcribe"] = await loadgen.transcribe_load(app.base_url, wav, args.concurrency, args.duration)
+        if "music" in scenarios:
+            report["music"] = await loadgen.music_load(app.base_url, args.music_concurrency, args.duration,
+                                                       args.music_seconds, args.music_repeat)
+        if "ws" in scenarios:
+            async def publish(sent_at: float):
+                await app.event_bus.publish(BroadcastTranscriptionEvent(username="bench", text=repr(sent_at)))
+            report["ws"] = await loadgen.websocket_fanout(app.base_url, publish, args.ws_clients,
+                                                          args.ws_rate, args.duration)
+    finally:
+        await app.stop()
+    report["process"] = {"peak_rss_mb": loadgen.peak_rss_mb()}
+    return report
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with tempfile.TemporaryDirectory(prefix="penny-bench-") as workdir:
+        configure_environment(workdir, args)
+        report = asyncio.run(run(args))
+    from benchmarks.loadgen import compare, widen
+
+    text = json.dumps(report, indent=2, default=float)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text)
+    if args.widen_baseline:
+        with open(args.widen_baseline) as f:
+            widened = widen(json.load(f), report)
+        with open(args.widen_baseline, "w") as f:
+            f.write(json.dumps(widened, indent=2, default=float))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        baseline_config = baseline.pop("config", {})
+        differing = sorted(k for k, v in baseline_config.items() if report["config"].get(k, v) != v)
+        if differing:
+            print(f"Warning: run settings differ from the baseline's: {', '.join(differing)}", file=sys.stderr)
+        problems = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if problems:
+            print(f"\n{len(problems)} regression(s) beyond {args.tolerance:.0%} of baseline:", file=sys.stderr)
+            for problem in problems:
+                print(f"  {problem}", file=sys.stderr)
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of baseline.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# ==============================================================================
+# benchmarks/stubs.py
+# Model stand-ins with a configurable, GIL-releasing cost, so the pipeline can
+# be measured without a GPU or model downloads.
+# ==============================================================================
+import hashlib
+import time
+from types import SimpleNamespace
+from typing import Callable, List
+import numpy as np
+
+class _Segment:
+    __slots__ = ("text",)
+    def __init__(self, text: str):
+        self.text = text
+
+class StubWhisperModel:
+    """Quacks like faster_whisper.WhisperModel for TranscriptionService.
+
+    Costs `base_ms + ms_per_audio_s * seconds` per clip. The batched path needs CTranslate2
+    internals, so it is disabled (n_samples=0) and every clip goes through `transcribe`.
+    """
+    def __init__(self, base_ms: float = 40.0, ms_per_audio_s: float = 15.0):
+        self.base_ms = base_ms
+        self.ms_per_audio_s = ms_per_audio_s
+        self.feature_extractor = SimpleNamespace(n_samples=0)
+
+    def transcribe(self, audio: np.ndarray, language=None, **options):
+        seconds = len(audio) / 16000
+        time.sleep((self.base_ms + self.ms_per_audio_s * seconds) / 1000)
+        return iter([_Segment(f"stub transcription of {seconds:.1f} seconds")]), None
+
+class StubMusicGen:
+    """Quacks like audiocraft's MusicGen: noise at `realtime_factor` seconds of work per second of audio."""
+    sample_rate = 32000
+
+    def __init__(self, realtime_factor: float = 0.1):
+        import torch
+        self.torch = torch
+        self.realtime_factor = realtime_factor
+        self.duration = 30.0
+        self.device = torch.device("cpu")
+        self.compression_model = torch.nn.Linear(1, 1)
+
+    def set_generation_params(self, duration: float = 30.0, **kwargs):
+        self.duration = duration
+
+    def _noise(self, batch: int, seconds: float):
+        time.sleep(seconds * self.realtime_factor)
+        return self.torch.randn(batch, 1, int(seconds * self.sample_rate)) * 0.1
+
+    def generate(self, descriptions: List[str]):
+        return self._noise(len(descriptions), self.duration)
+
+    def generate_continuation(self, prompt, prompt_sample_rate: int, descriptions: List[str]):
+        new = self._noise(len(descriptions), self.duration - prompt.shape[-1] / prompt_sample_rate)
+        return self.torch.cat([prompt.float().cpu(), new], dim=-1)
+
+def stub_embedding_factory(dim: int = 384, cost_ms: float = 1.0) -> Callable:
+    """Factory for MemoryService: deterministic hash embeddings, no model download."""
+    from chromadb.api.types import EmbeddingFunction
+
+    class StubEmbeddingFunction(EmbeddingFunction):
+        def __call__(self, input):
+            time.sleep(cost_ms * len(input) / 1000)
+            vectors = []
+            for text in input:
+                seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+                vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+                vectors.append((vector / np.linalg.norm(vector)).tolist())
+            return vectors
+
+    return lambda: (StubEmbeddingFunction(), f"stub:{dim}")
+
+def tiny_whisper_factory() -> Callable:
+    """Real faster-whisper `tiny` on CPU: slower, but exercises the batched decode path."""
+    from faster_whisper import WhisperModel
+    return lambda: WhisperModel("tiny", device="cpu", compute_type="int8")
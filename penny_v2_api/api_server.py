@@ -5,62 +5,339 @@
 import logging
 import asyncio
 import json
-from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
+from typing import Dict, List, Optional, Set
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from penny_v2_api.config import settings
 from penny_v2_api.core.event_bus import EventBus
-from penny_v2_api.core.events import TranscriptionRequest, MusicGenerationRequest, PlayAudioInDiscordEvent, BroadcastTranscriptionEvent
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.lifecycle import ServiceState
+from penny_v2_api.core.metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram
+from penny_v2_api.core.tracing import TRACER, now
+from penny_v2_api.uploads import AudioUpload, read_audio, spool_upload
+from penny_v2_api.core.events import (
+    TranscriptionRequest,
+    MusicGenerationRequest,
+    MusicJobSubmitRequest,
+    MusicJobLookupRequest,
+    MusicJobProgressEvent,
+    BulkAddMemoryRequest,
+    BulkQueryMemoryRequest,
+    BulkDeleteMemoryRequest,
+    PlayAudioInDiscordEvent,
+    BroadcastTranscriptionEvent,
+    BroadcastPartialTranscriptionEvent,
+)
 
 logger_api = logging.getLogger(__name__)
 
+WS_CLIENTS = Gauge("penny_ws_clients", "Connected WebSocket clients.")
+WS_MESSAGES = Counter("penny_ws_broadcast_messages_total", "Messages broadcast to WebSocket clients.")
+WS_EVICTED = Counter("penny_ws_clients_evicted_total", "WebSocket clients dropped by the broadcaster.", ["reason"])
+WS_SEND_SECONDS = Histogram("penny_ws_send_seconds", "Time to hand one message to a client socket.")
+
+class _WebSocketClient:
+    __slots__ = ("websocket", "queue", "task")
+    def __init__(self, websocket: WebSocket, maxsize: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: asyncio.Task = None
+
 class ConnectionManager:
-    def __init__(self): self.active_connections: list[WebSocket] = []
-    async def connect(self, websocket: WebSocket): await websocket.accept(); self.active_connections.append(websocket)
-    def disconnect(self, websocket: WebSocket): self.active_connections.remove(websocket)
+    """Fans messages out to WebSocket clients.
+
+    Every client has a bounded outbound queue drained by its own writer task, so
+    `broadcast` never waits on a socket. A client whose queue overflows, or whose send
+    errors or exceeds `send_timeout`, is disconnected.
+    """
+    def __init__(self, max_queue: int = 256, send_timeout: float = 5.0):
+        self.active_connections: dict[WebSocket, _WebSocketClient] = {}
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        # Close handshakes of evicted clients; referenced until done so they are not collected mid-flight.
+        self._closing: Set[asyncio.Task] = set()
+        WS_CLIENTS.set_function(lambda: len(self.active_connections))
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = _WebSocketClient(websocket, self.max_queue)
+        client.task = asyncio.create_task(self._writer(client))
+        self.active_connections[websocket] = client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(websocket, None)
+        if client and client.task is not asyncio.current_task():
+            client.task.cancel()
+
     async def broadcast(self, message: str):
-        for connection in self.active_connections: await connection.send_text(message)
+        # The payload is serialized once by the caller; every queue holds the same str.
+        WS_MESSAGES.inc()
+        for client in list(self.active_connections.values()):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._evict(client, "slow")
+
+    async def _writer(self, client: _WebSocketClient):
+        while True:
+            message = await client.queue.get()
+            try:
+                with WS_SEND_SECONDS.time():
+                    await asyncio.wait_for(client.websocket.send_text(message), self.send_timeout)
+            except asyncio.TimeoutError:
+                self._evict(client, "timeout")
+                return
+            except Exception as e:
+                logger_api.debug(f"WebSocket send failed: {e}")
+                self._evict(client, "error")
+                return
+
+    def _evict(self, client: _WebSocketClient, reason: str):
+        if self.active_connections.get(client.websocket) is not client:
+            return
+        WS_EVICTED.labels(reason).inc()
+        logger_api.warning(f"Dropping WebSocket client ({reason}).")
+        self.disconnect(client.websocket)
+        task = asyncio.create_task(self._close(client.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            # 1013: try again later
+            await asyncio.wait_for(websocket.close(code=1013), self.send_timeout)
+        except Exception:
+            pass
 
-class MusicRequest(BaseModel): prompt: str; duration: int = 30
+class MusicRequest(BaseModel):
+    prompt: str
+    duration: int = Field(30, gt=0, le=settings.MUSIC_MAX_DURATION_S)
+    # Optional MusicGen sampling overrides; part of the cache key.
+    temperature: Optional[float] = None
+    top_k: Optional[int] = None
+    top_p: Optional[float] = None
+    cfg_coef: Optional[float] = None
+
+    def generation_params(self) -> dict:
+        return self.model_dump(exclude={"prompt", "duration", "play_in_discord"}, exclude_none=True)
+
+class MusicJobRequest(MusicRequest):
+    # Queue each segment for playback in the voice channel as soon as it is generated.
+    play_in_discord: bool = False
+
+class MemoryItem(BaseModel):
+    text: str
+    metadata: Optional[dict] = None
+
+class BulkAddMemoryBody(BaseModel): items: List[MemoryItem] = Field(min_length=1)
+class BulkQueryMemoryBody(BaseModel): queries: List[str] = Field(min_length=1); n_results: int = Field(5, gt=0)
+class BulkDeleteMemoryBody(BaseModel): ids: List[str] = Field(min_length=1)
 
 class ApiServer:
-    def __init__(self, event_bus: EventBus):
+    def __init__(self, event_bus: EventBus, services: Optional[Dict[str, object]] = None, music_jobs: bool = True):
         self.event_bus = event_bus
+        # name -> service exposing status(), for /health and /ready
+        self.services = services or {}
+        # Music jobs are live objects in the music service, so only a node running it in-process offers them.
+        self.music_jobs = music_jobs
         self.fastapi_app = FastAPI()
-        self.ws_manager = ConnectionManager()
+        self.ws_manager = ConnectionManager(settings.WS_CLIENT_QUEUE_SIZE, settings.WS_SEND_TIMEOUT_S)
         self._setup_routes()
-        self.event_bus.subscribe_async(BroadcastTranscriptionEvent, self.handle_broadcast_transcription)
+        # Fan-out runs behind its own queues so a slow broadcast never stalls the voice pipeline.
+        self.event_bus.subscribe_queued(BroadcastTranscriptionEvent, self.handle_broadcast_transcription, maxsize=1000)
+        self.event_bus.subscribe_queued(BroadcastPartialTranscriptionEvent, self.handle_broadcast_partial, maxsize=50)
+        self.event_bus.subscribe_queued(MusicJobProgressEvent, self.handle_music_job_progress, maxsize=200)
 
     async def handle_broadcast_transcription(self, event: BroadcastTranscriptionEvent):
-        payload = json.dumps({"type": "transcription", "username": event.username, "text": event.text})
+        payload = json.dumps({"type": "transcription", "final": True, "utterance_id": event.utterance_id,
+                              "username": event.username, "text": event.text})
+        trace = TRACER.get(event.trace_id)
+        try:
+            await self.ws_manager.broadcast(payload)
+        finally:
+            if "broadcast.published" in trace.marks:
+                trace.add_span("broadcast.fanout", trace.marks["broadcast.published"], now(),
+                               clients=len(self.ws_manager.active_connections))
+                # The publisher handed the trace over with the event; fan-out is its last stage.
+                # (If this queue drops the event, the unfinished trace ages out of the tracer.)
+                TRACER.finish(trace)
+
+    async def handle_broadcast_partial(self, event: BroadcastPartialTranscriptionEvent):
+        payload = json.dumps({"type": "partial", "final": False, "utterance_id": event.utterance_id,
+                              "username": event.username, "stable": event.stable, "unstable": event.unstable})
+        await self.ws_manager.broadcast(payload)
+
+    async def handle_music_job_progress(self, event: MusicJobProgressEvent):
+        payload = json.dumps({"type": "music_job", "job_id": event.job_id, "status": event.status,
+                              "segments_done": event.segments_done, "segments_total": event.segments_total,
+                              "error": event.error})
         await self.ws_manager.broadcast(payload)
 
     def _setup_routes(self):
-        self.fastapi_app.post("/transcribe/", self.transcribe_audio)
-        self.fastapi_app.post("/generate_music/", self.generate_music)
-        self.fastapi_app.post("/play_in_discord/", self.play_in_discord)
-        self.fastapi_app.websocket("/ws")
+        self.fastapi_app.add_api_route("/transcribe/", self.transcribe_audio, methods=["POST"])
+        self.fastapi_app.add_api_route("/generate_music/", self.generate_music, methods=["POST"])
+        if self.music_jobs:
+            self.fastapi_app.add_api_route("/music/jobs", self.submit_music_job, methods=["POST"], status_code=202)
+            self.fastapi_app.add_api_route("/music/jobs/{job_id}", self.get_music_job, methods=["GET"])
+            self.fastapi_app.add_api_route("/music/jobs/{job_id}/stream", self.stream_music_job, methods=["GET"])
+            self.fastapi_app.add_api_route("/music/jobs/{job_id}/audio", self.get_music_job_audio, methods=["GET"])
+        else:
+            self.fastapi_app.add_api_route("/music/jobs", self.music_jobs_unavailable, methods=["POST"])
+            self.fastapi_app.add_api_route("/music/jobs/{rest:path}", self.music_jobs_unavailable, methods=["GET"])
+        self.fastapi_app.add_api_route("/play_in_discord/", self.play_in_discord, methods=["POST"])
+        self.fastapi_app.add_api_route("/memory/bulk_add", self.bulk_add_memory, methods=["POST"])
+        self.fastapi_app.add_api_route("/memory/bulk_query", self.bulk_query_memory, methods=["POST"])
+        self.fastapi_app.add_api_route("/memory/bulk_delete", self.bulk_delete_memory, methods=["POST"])
+        self.fastapi_app.add_api_route("/metrics", self.metrics, methods=["GET"])
+        self.fastapi_app.add_api_route("/health", self.health, methods=["GET"])
+        self.fastapi_app.add_api_route("/ready", self.ready, methods=["GET"])
+        self.fastapi_app.add_api_route("/traces", self.list_traces, methods=["GET"])
+        self.fastapi_app.add_api_route("/traces/chrome", self.chrome_traces, methods=["GET"])
+        self.fastapi_app.add_api_route("/traces/{trace_id}", self.get_trace, methods=["GET"])
+        self.fastapi_app.exception_handler(ServiceOverloadedError)(self.handle_overloaded)
+
+        @self.fastapi_app.websocket("/ws")
         async def websocket_endpoint(websocket: WebSocket):
             await self.ws_manager.connect(websocket)
             try:
                 while True: await websocket.receive_text()
-            except WebSocketDisconnect: self.ws_manager.disconnect(websocket)
+            except WebSocketDisconnect: pass
+            finally: self.ws_manager.disconnect(websocket)
 
-    async def transcribe_audio(self, file: UploadFile = File(...)):
-        if not file.content_type.startswith('audio/'): raise HTTPException(status_code=400, detail="Invalid audio file.")
-        future = asyncio.Future()
-        await self.event_bus.publish(TranscriptionRequest(audio_data=await file.read(), response_future=future))
-        return JSONResponse(content={"transcription": await future})
+    async def handle_overloaded(self, request: Request, exc: ServiceOverloadedError):
+        return JSONResponse(status_code=503, content={"detail": str(exc)},
+                            headers={"Retry-After": str(int(exc.retry_after) or 1)})
+
+    async def transcribe_audio(self, request: Request):
+        """Transcribe an uploaded file: multipart `file` field, or the raw body with an audio Content-Type.
+
+        PCM WAV is decoded as it arrives and sent for transcription in TRANSCRIPTION_UPLOAD_WINDOW_S
+        windows, so long uploads start transcribing before they finish; other formats are spooled
+        (to disk past UPLOAD_SPOOL_MEMORY_MB) and decoded whole. At most TRANSCRIPTION_UPLOAD_IN_FLIGHT
+        windows are pending at once: the upload is read only as fast as it is transcribed.
+        """
+        futures: List[asyncio.Future] = []
+        in_flight = asyncio.Semaphore(settings.TRANSCRIPTION_UPLOAD_IN_FLIGHT)
+
+        async def submit(audio):
+            await in_flight.acquire()
+            future = asyncio.Future()
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+            await self.event_bus.publish(TranscriptionRequest(audio_data=audio, response_future=future, bulk=True))
+
+        spool = None
+        try:
+            async with AudioUpload(request, settings.UPLOAD_MAX_MB * 1024 * 1024) as upload:
+                spool = await read_audio(upload, settings.TRANSCRIPTION_UPLOAD_WINDOW_S, submit,
+                                         settings.UPLOAD_SPOOL_MEMORY_MB * 1024 * 1024)
+            if spool is not None:
+                await submit(spool.reader())
+            texts = await asyncio.gather(*futures)
+        except BaseException:
+            for future in futures:
+                future.cancel()  # queued windows are skipped by the scheduler
+            raise
+        finally:
+            if spool is not None:
+                spool.close()
+        return JSONResponse(content={"transcription": " ".join(text for text in texts if text)})
 
     async def generate_music(self, request: MusicRequest):
         future = asyncio.Future()
-        await self.event_bus.publish(MusicGenerationRequest(prompt=request.prompt, duration=request.duration, response_future=future))
+        await self.event_bus.publish(MusicGenerationRequest(prompt=request.prompt, duration=request.duration,
+                                                            response_future=future, params=request.generation_params()))
         return FileResponse(path=await future, media_type='audio/wav', filename='generated_music.wav')
 
-    async def play_in_discord(self, file: UploadFile = File(...)):
-        if not file.content_type.startswith('audio/'): raise HTTPException(status_code=400, detail="Invalid audio file.")
+    async def submit_music_job(self, request: MusicJobRequest):
+        future = asyncio.Future()
+        await self.event_bus.publish(MusicJobSubmitRequest(prompt=request.prompt, duration=request.duration,
+                                                           response_future=future, params=request.generation_params(),
+                                                           play_in_discord=request.play_in_discord))
+        return (await future).to_dict()
+
+    async def _lookup_music_job(self, job_id: str):
         future = asyncio.Future()
-        await self.event_bus.publish(PlayAudioInDiscordEvent(audio_data=await file.read(), response_future=future))
-        await future
+        await self.event_bus.publish(MusicJobLookupRequest(job_id=job_id, response_future=future))
+        job = await future
+        if job is None: raise HTTPException(status_code=404, detail="Unknown music job.")
+        return job
+
+    async def get_music_job(self, job_id: str):
+        return (await self._lookup_music_job(job_id)).to_dict()
+
+    async def stream_music_job(self, job_id: str):
+        """Chunked WAV of the job's audio, sent segment by segment as it is generated."""
+        job = await self._lookup_music_job(job_id)
+        return StreamingResponse(job.wav_stream(), media_type="audio/wav")
+
+    async def music_jobs_unavailable(self):
+        raise HTTPException(status_code=501, detail="Music jobs need the music service in the API process "
+                                                    "(NODE_ROLE=all); use /generate_music/ on this node.")
+
+    async def get_music_job_audio(self, job_id: str):
+        job = await self._lookup_music_job(job_id)
+        if job.status != "done": raise HTTPException(status_code=409, detail=f"Music job is {job.status}.")
+        return FileResponse(path=str(job.result_path), media_type='audio/wav', filename='generated_music.wav')
+
+    async def play_in_discord(self, request: Request, interrupt: bool = False, overlay: bool = False):
+        """Play an uploaded file (multipart `file` field or raw audio body) in the voice channel."""
+        async with AudioUpload(request, settings.UPLOAD_MAX_MB * 1024 * 1024) as upload:
+            spool = await spool_upload(upload, settings.UPLOAD_SPOOL_MEMORY_MB * 1024 * 1024)
+        try:
+            future = asyncio.Future()
+            # The playback engine is done with the view once the future resolves.
+            await self.event_bus.publish(PlayAudioInDiscordEvent(audio_data=spool.view(), response_future=future,
+                                                                 interrupt=interrupt, overlay=overlay))
+            await future
+        finally:
+            spool.close()
         return JSONResponse(content={"status": "audio_playback_initiated"})
-    
+
+    async def bulk_add_memory(self, body: BulkAddMemoryBody):
+        future = asyncio.Future()
+        items = [item.model_dump(exclude_none=True) for item in body.items]
+        await self.event_bus.publish(BulkAddMemoryRequest(items=items, response_future=future))
+        return JSONResponse(content={"ids": await future})
+
+    async def bulk_query_memory(self, body: BulkQueryMemoryBody):
+        future = asyncio.Future()
+        await self.event_bus.publish(BulkQueryMemoryRequest(query_texts=body.queries, response_future=future,
+                                                            n_results=body.n_results))
+        return JSONResponse(content={"results": await future})
+
+    async def bulk_delete_memory(self, body: BulkDeleteMemoryBody):
+        future = asyncio.Future()
+        await self.event_bus.publish(BulkDeleteMemoryRequest(memory_ids=body.ids, response_future=future))
+        return JSONResponse(content={"deleted": await future})
+
+    async def metrics(self):
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    async def health(self):
+        """Liveness: the process is serving requests. Per-service state is informational."""
+        return {"status": "ok", "services": {name: s.status() for name, s in self.services.items()}}
+
+    async def ready(self):
+        """Readiness: 200 once every required service is ready, 503 until then."""
+        states = {name: s.status() for name, s in self.services.items()}
+        waiting = [name for name in settings.READY_REQUIRED_SERVICES
+                   if name in self.services and self.services[name].state is not ServiceState.READY]
+        return JSONResponse(status_code=503 if waiting else 200,
+                            content={"ready": not waiting, "waiting_on": waiting, "services": states})
+
+    async def list_traces(self, limit: int = 50, min_ms: float = 0.0):
+        return {"traces": [t.to_dict() for t in TRACER.recent(limit, min_ms / 1000)]}
+
+    async def get_trace(self, trace_id: str):
+        trace = TRACER.get(trace_id)
+        if trace.trace_id is None: raise HTTPException(status_code=404, detail="Unknown or expired trace.")
+        return trace.to_dict()
+
+    async def chrome_traces(self, limit: int = 500, min_ms: float = 0.0):
+        traces = TRACER.recent(limit, min_ms / 1000)
+        return JSONResponse(content=TRACER.chrome_trace(list(reversed(traces))),
+                            headers={"Content-Disposition": 'attachment; filename="penny_traces.json"'})
+
     def get_app(self): return self.fastapi_app
\ No newline at end of file
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class AppConfig(BaseSettings):
@@ -9,7 +10,77 @@ class AppConfig(BaseSettings):
     MUSIC_GEN_DEVICE: str = "cuda"
     WHISPER_MODEL_SIZE: str = "base"
     WHISPER_COMPUTE_TYPE: str = "int8"
+    WHISPER_LANGUAGE: Optional[str] = None
+    TRANSCRIPTION_WORKERS: int = 1
+    TRANSCRIPTION_QUEUE_SIZE: int = 32
+    # CPU only: transcribe in this many worker processes (0 = threads in the API process).
+    TRANSCRIPTION_PROCESS_WORKERS: int = 0
+    TRANSCRIPTION_PROCESS_THREADS: Optional[int] = None  # per worker; default cpu_count // workers
+    TRANSCRIPTION_BATCH_SIZE: int = 8
+    TRANSCRIPTION_BATCH_WINDOW_MS: int = 15
+    TRANSCRIPTION_PARTIALS: bool = True
+    TRANSCRIPTION_PARTIAL_INTERVAL_MS: int = 500
+    TRANSCRIPTION_PARTIAL_WINDOW_S: float = 10.0
+    # Uploaded files (/transcribe/, /play_in_discord/): hard cap, and how much is buffered in RAM before disk.
+    UPLOAD_MAX_MB: int = 100
+    UPLOAD_SPOOL_MEMORY_MB: int = 8
+    TRANSCRIPTION_UPLOAD_WINDOW_S: float = 30.0
+    # Windows of one upload awaiting transcription at once; the upload is read no further until one finishes.
+    TRANSCRIPTION_UPLOAD_IN_FLIGHT: int = 2
+    VAD_ENERGY_THRESHOLD_DB: float = -45.0
+    VAD_ONSET_FRAMES: int = 2
+    VAD_HANGOVER_MS: int = 300
+    VAD_PREROLL_MS: int = 200
+    VAD_MAX_UTTERANCE_S: float = 15.0
+    VAD_MIN_UTTERANCE_MS: int = 250
+    SINK_MEMORY_BUDGET_MB: int = 64
+    SINK_IDLE_EVICT_S: float = 30.0
+    SINK_RING_SECONDS: Optional[float] = None
+    # Take raw Opus from the voice-receive library and decode only finished utterances (see services/opus_receive.py).
+    VOICE_OPUS_PASSTHROUGH: bool = False
+    VOICE_OPUS_VOICED_MIN_BYTES: int = 16  # smaller packets count as silence for endpointing
+    VOICE_OPUS_DECODE_WORKERS: int = 2
+    # Never transcribed (bots and muted members are skipped automatically).
+    VOICE_IGNORED_USER_IDS: List[int] = []
+    WS_CLIENT_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_S: float = 5.0
+    CHROMA_DB_DIR: str = "./chroma_memory"
+    MEMORY_PERSISTENT: bool = True
+    # auto (openai when OPENAI_API_KEY is set, else default) | default (local ONNX) | openai | sentence_transformers
+    EMBEDDING_BACKEND: str = "auto"
+    EMBEDDING_MODEL: Optional[str] = None
+    EMBEDDING_CACHE_PATH: str = "./chroma_memory/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 100000
+    OPENAI_API_KEY: Optional[str] = None
+    MEMORY_FLUSH_INTERVAL_S: float = 1.0
+    MEMORY_BATCH_SIZE: int = 64
+    MEMORY_STORE_TRANSCRIPTS: bool = False
+    TRACE_ENABLED: bool = True
+    TRACE_SAMPLE_RATE: float = 0.1
+    TRACE_SLOW_MS: float = 2000.0
+    TRACE_BUFFER_SIZE: int = 512
+    PLAYBACK_CACHE_MB: int = 128
+    WARMUP_MODELS: bool = True
+    # Services that must be ready for /ready to pass; others are reported but optional.
+    READY_REQUIRED_SERVICES: List[str] = ["memory", "transcription", "discord", "bridge"]
     MUSIC_MODEL_SIZE: str = "facebook/musicgen-small"
+    MUSIC_CACHE_DIR: str = "./music_cache"
+    MUSIC_CACHE_MAX_MB: int = 2048
+    MUSIC_CACHE_MAX_ENTRIES: int = 500
+    MUSIC_SEGMENT_S: float = 10.0
+    MUSIC_CONTEXT_S: float = 5.0
+    # Longest take a request may ask for: a job holds all of its PCM until the take is written out.
+    MUSIC_MAX_DURATION_S: int = 300
+    MUSIC_JOB_QUEUE_SIZE: int = 16
+    MUSIC_JOB_RETENTION_S: float = 3600.0
+    MUSIC_JOB_MAX_RETAINED: int = 500  # finished jobs kept for lookup, oldest forgotten first
+    # all | frontend | worker | broker, see penny_v2_api/node.py
+    NODE_ROLE: str = "all"
+    NODE_NAME: Optional[str] = None
+    NODE_SERVICES: List[str] = ["transcription", "music"]  # what a worker node runs
+    BROKER_URL: str = "tcp://127.0.0.1:7600"  # or unix:///path/to/socket
+    BROKER_LISTEN: bool = False  # host the stand-in broker in this process
+    REMOTE_FILES_DIR: str = "./remote_files"  # a frontend's LRU of worker results (MUSIC_CACHE_MAX_* limits)
     DISCORD_BOT_TOKEN: str
     DISCORD_GUILD_ID: int
     DISCORD_VOICE_CHANNEL_ID: int
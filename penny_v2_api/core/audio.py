@@ -0,0 +1,262 @@
+# ==============================================================================
+# penny_v2_api/core/audio.py
+# Vectorized PCM helpers shared by the voice and upload paths.
+# ==============================================================================
+import struct
+from typing import List, Optional, Tuple, Union
+import numpy as np
+
+DISCORD_SAMPLE_RATE = 48000
+DISCORD_CHANNELS = 2
+WHISPER_SAMPLE_RATE = 16000
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+def _lowpass_taps(num_taps: int, cutoff: float) -> np.ndarray:
+    """Hann-windowed sinc low-pass, cutoff as a fraction of the input sample rate."""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hanning(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+# 48 kHz -> 16 kHz: pass band up to ~7.2 kHz, well clear of the 8 kHz Nyquist.
+_DECIMATION = DISCORD_SAMPLE_RATE // WHISPER_SAMPLE_RATE
+_DECIMATION_TAPS = _lowpass_taps(48, 7200 / DISCORD_SAMPLE_RATE)
+
+def _decimate_by_3(mono: np.ndarray) -> np.ndarray:
+    """Polyphase FIR decimation: only every third output sample is computed."""
+    pad = len(_DECIMATION_TAPS) // 2
+    padded = np.pad(mono, (pad, len(_DECIMATION_TAPS) - pad - 1))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(_DECIMATION_TAPS))[::_DECIMATION]
+    return windows @ _DECIMATION_TAPS
+
+def pcm_to_whisper(pcm: BytesLike) -> np.ndarray:
+    """48 kHz stereo s16 PCM (Discord receive format) -> 16 kHz mono float32 in [-1, 1]."""
+    samples = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // (2 * DISCORD_CHANNELS) * DISCORD_CHANNELS)
+    mono = samples.reshape(-1, DISCORD_CHANNELS).mean(axis=1, dtype=np.float32) * (1 / 32768)
+    return _decimate_by_3(mono)
+
+def to_float(samples: np.ndarray) -> np.ndarray:
+    """Integer/float samples -> float32 in [-1, 1], layout unchanged."""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128) * (1 / 128)
+    if samples.dtype.kind == "i":
+        return samples.astype(np.float32) * (1 / float(2 ** (8 * samples.dtype.itemsize - 1)))
+    return samples.astype(np.float32, copy=False)
+
+def to_mono_float(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Interleaved integer/float samples -> mono float32 in [-1, 1]."""
+    scaled = to_float(samples)
+    if channels > 1:
+        scaled = scaled[: len(scaled) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return scaled
+
+def resample(mono: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    if src_rate == dst_rate:
+        return mono
+    if src_rate == DISCORD_SAMPLE_RATE and dst_rate == WHISPER_SAMPLE_RATE:
+        return _decimate_by_3(mono)
+    n_out = int(round(len(mono) * dst_rate / src_rate))
+    positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
+
+class WavInfo:
+    __slots__ = ("sample_rate", "channels", "sample_width", "is_float", "data")
+    def __init__(self, sample_rate: int, channels: int, sample_width: int, is_float: bool, data: memoryview):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.is_float = is_float
+        self.data = data
+
+_WAV_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def _locate_wav_data(view: memoryview) -> Optional[Tuple[list, int, int]]:
+    """Walk the RIFF chunks up to the data chunk: (fmt fields, data offset, declared data size).
+
+    None if this is not a RIFF/WAVE stream or the header is not complete yet.
+    """
+    if len(view) < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        return None
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = struct.unpack_from("<I", view, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if body + 16 > len(view):
+                return None
+            fmt = list(struct.unpack_from("<HHIIHH", view, body))
+            if fmt[0] == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                if body + 26 > len(view):
+                    return None
+                # The real format code leads the SubFormat GUID.
+                fmt[0] = struct.unpack_from("<H", view, body + 24)[0]
+        elif chunk_id == b"data" and fmt is not None:
+            return fmt, body, chunk_size
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+def _wav_format(fmt: list) -> Optional[Tuple[int, int, int, bool]]:
+    """(sample_rate, channels, sample_width, is_float) for formats we decode, else None."""
+    audio_format, channels, sample_rate, _, _, bits = fmt
+    if audio_format not in (_WAVE_FORMAT_PCM, _WAVE_FORMAT_IEEE_FLOAT) or bits % 8 or not channels:
+        return None
+    is_float = audio_format == _WAVE_FORMAT_IEEE_FLOAT
+    if bits // 8 not in _WAV_DTYPES or (is_float and bits != 32):
+        return None
+    return sample_rate, channels, bits // 8, is_float
+
+def parse_wav(data: BytesLike) -> Optional[WavInfo]:
+    """Locate the fmt/data chunks of a PCM WAV without copying the payload. None if not a PCM WAV."""
+    view = memoryview(data)
+    located = _locate_wav_data(view)
+    if located is None:
+        return None
+    fmt, body, chunk_size = located
+    wav_format = _wav_format(fmt)
+    if wav_format is None:
+        return None
+    # Streaming writers leave the size at 0 / 0xFFFFFFFF; clamp to what we have.
+    end = min(body + chunk_size, len(view)) if 0 < chunk_size < 0xFFFFFFFF else len(view)
+    return WavInfo(*wav_format, view[body:end])
+
+def wav_samples(info: WavInfo) -> np.ndarray:
+    """Zero-copy view of the interleaved samples of a parsed WAV."""
+    dtype = np.float32 if info.is_float else _WAV_DTYPES[info.sample_width]
+    usable = info.data.nbytes // info.sample_width * info.sample_width
+    return np.frombuffer(info.data[:usable], dtype=dtype)
+
+def decode_wav_to_whisper(data: BytesLike) -> Optional[np.ndarray]:
+    """Decode an in-memory PCM WAV straight to 16 kHz mono float32, or None if it is not one."""
+    info = parse_wav(data)
+    if info is None:
+        return None
+    mono = to_mono_float(wav_samples(info), info.channels)
+    return resample(mono, info.sample_rate, WHISPER_SAMPLE_RATE)
+
+def _quietest_cut(samples: np.ndarray, end: int, search: int, frame: int) -> int:
+    """Index of the middle of the lowest-energy `frame` in samples[end - search:end], or `end`."""
+    frames = min(search, end) // frame
+    if frames < 2:
+        return end
+    start = end - frames * frame
+    energy = np.square(samples[start:end].reshape(frames, frame)).mean(axis=1)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+class WavStreamDecoder:
+    """Incremental PCM WAV -> 16 kHz mono float32 in windows of up to `window_s`, for uploads still arriving.
+
+    Each window ends at the quietest 20 ms frame of its last `cut_search_s` rather than at a hard
+    boundary, so words are not split between two transcriptions; the samples past the cut start
+    the next window. `feed` returns the windows a chunk completed and `finish` the remainder, so at
+    most one window of samples is held. `is_wav` stays None until the header has arrived and becomes False if the
+    stream is not a PCM WAV, in which case the caller has to decode the whole file another way.
+    """
+    MAX_HEADER_BYTES = 1 << 20
+
+    CUT_FRAME_S = 0.02
+
+    def __init__(self, window_s: float, cut_search_s: float = 5.0):
+        self.window_s = window_s
+        self.cut_search_s = min(cut_search_s, window_s / 2)
+        self.is_wav: Optional[bool] = None
+        self._head = bytearray()
+        self._format: Optional[Tuple[int, int, int, bool]] = None
+        self._remaining: Optional[int] = None  # data bytes still expected; None when the size is unknown
+        self._carry = b""  # trailing partial frame
+        self._pending: List[np.ndarray] = []
+        self._pending_len = 0
+
+    def feed(self, chunk: BytesLike) -> List[np.ndarray]:
+        if self.is_wav is False:
+            return []
+        if self.is_wav is None:
+            self._head += chunk
+            located = _locate_wav_data(memoryview(self._head))
+            if located is None:
+                if len(self._head) > self.MAX_HEADER_BYTES or (
+                        len(self._head) >= 12 and (self._head[0:4] != b"RIFF" or self._head[8:12] != b"WAVE")):
+                    self._reject()
+                return []
+            fmt, body, chunk_size = located
+            self._format = _wav_format(fmt)
+            if self._format is None:
+                self._reject()
+                return []
+            self.is_wav = True
+            self._remaining = chunk_size if 0 < chunk_size < WAV_UNKNOWN_SIZE else None
+            chunk = bytes(self._head[body:])
+            self._head = bytearray()
+        return self._decode(chunk)
+
+    def finish(self) -> Optional[np.ndarray]:
+        if not self.is_wav or not self._pending_len:
+            return None
+        tail = resample(np.concatenate(self._pending), self._format[0], WHISPER_SAMPLE_RATE)
+        self._pending, self._pending_len = [], 0
+        return tail
+
+    def _reject(self):
+        self.is_wav = False
+        self._head = bytearray()
+
+    def _decode(self, chunk: BytesLike) -> List[np.ndarray]:
+        sample_rate, channels, sample_width, is_float = self._format
+        if self._remaining is not None:
+            # Anything after the data chunk (LIST/id3 trailers) is not audio.
+            chunk = chunk[:self._remaining]
+            self._remaining -= len(chunk)
+        data = self._carry + bytes(chunk)
+        usable = len(data) // (channels * sample_width) * (channels * sample_width)
+        self._carry = data[usable:]
+        if usable:
+            dtype = np.float32 if is_float else _WAV_DTYPES[sample_width]
+            mono = to_mono_float(np.frombuffer(data, dtype=dtype, count=usable // sample_width), channels)
+            self._pending.append(mono)
+            self._pending_len += len(mono)
+        windows = []
+        window_len = int(self.window_s * sample_rate)
+        while self._pending_len >= window_len:
+            samples = np.concatenate(self._pending)
+            cut = _quietest_cut(samples, window_len, int(self.cut_search_s * sample_rate),
+                               max(1, int(self.CUT_FRAME_S * sample_rate)))
+            windows.append(resample(samples[:cut], sample_rate, WHISPER_SAMPLE_RATE))
+            rest = samples[cut:]
+            self._pending, self._pending_len = ([rest] if len(rest) else []), len(rest)
+        return windows
+
+def wav_to_discord_pcm(info: WavInfo) -> bytes:
+    """Parsed WAV -> 48 kHz stereo s16 PCM (Discord send format)."""
+    samples = wav_samples(info)
+    if (info.sample_rate == DISCORD_SAMPLE_RATE and info.channels == DISCORD_CHANNELS
+            and samples.dtype == np.int16):
+        return samples.tobytes()
+    frames = to_float(samples)
+    frames = frames[: len(frames) // info.channels * info.channels].reshape(-1, info.channels)
+    if info.channels == 1:
+        frames = np.repeat(frames, DISCORD_CHANNELS, axis=1)
+    elif info.channels > DISCORD_CHANNELS:
+        frames = frames[:, :DISCORD_CHANNELS]
+    if info.sample_rate != DISCORD_SAMPLE_RATE:
+        frames = np.stack([resample(frames[:, c], info.sample_rate, DISCORD_SAMPLE_RATE)
+                           for c in range(DISCORD_CHANNELS)], axis=1)
+    return float_to_pcm16(frames)
+
+def float_to_pcm16(samples: np.ndarray) -> bytes:
+    """Float samples in [-1, 1] (frames x channels, or mono) -> interleaved little-endian s16."""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+# Data size to advertise when the length is not known up front (streamed output).
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+def wav_header(sample_rate: int, channels: int, sample_width: int = 2, data_size: int = WAV_UNKNOWN_SIZE) -> bytes:
+    """44-byte PCM WAV header; pass WAV_UNKNOWN_SIZE when streaming."""
+    block_align = channels * sample_width
+    return (b"RIFF" + struct.pack("<I", min(36 + data_size, WAV_UNKNOWN_SIZE)) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, _WAVE_FORMAT_PCM, channels, sample_rate,
+                                    sample_rate * block_align, block_align, 8 * sample_width)
+            + b"data" + struct.pack("<I", data_size))
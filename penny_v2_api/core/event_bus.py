@@ -3,21 +3,164 @@
 # ==============================================================================
 import asyncio
 import logging
+import reprlib
+import time
 from collections import defaultdict
-from typing import Callable, Type, TypeVar, DefaultDict, List
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Optional, Type, TypeVar, DefaultDict, List, Tuple
+from penny_v2_api.core.metrics import Counter, Gauge, Histogram
 
 logger_event_bus = logging.getLogger(__name__)
 T_Event = TypeVar("T_Event")
 
+# (exception, event, callback) -> None
+ErrorHandler = Callable[[BaseException, object, Callable], None]
+
+class OverflowPolicy(str, Enum):
+    BLOCK = "block"              # publisher waits for room
+    DROP_OLDEST = "drop_oldest"  # evict the oldest queued event
+    DROP_NEWEST = "drop_newest"  # discard the event being published
+
+EVENTS_PUBLISHED = Counter("penny_events_published_total", "Events published, by event type.", ["event"])
+HANDLER_SECONDS = Histogram("penny_event_handler_seconds", "Time spent in event subscribers.", ["event", "handler"])
+HANDLERS_IN_FLIGHT = Gauge("penny_event_handlers_in_flight", "Event subscribers currently running.", ["event"])
+HANDLER_ERRORS = Counter("penny_event_handler_errors_total", "Exceptions raised by event subscribers.", ["event", "handler"])
+QUEUE_DEPTH = Gauge("penny_event_queue_depth", "Events waiting in a queued subscriber.", ["handler"])
+QUEUE_DROPPED = Counter("penny_event_queue_dropped_total", "Events dropped by a full queued subscriber.", ["handler"])
+
+# Events can carry whole audio clips; keep error logs readable.
+_event_repr = reprlib.Repr()
+_event_repr.maxother = 200
+
+def _callback_name(callback: Callable) -> str:
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+class _QueuedSubscriber:
+    """One subscriber fed through its own bounded queue and worker task."""
+    def __init__(self, bus: "EventBus", callback: Callable[[T_Event], Awaitable], maxsize: int, overflow: OverflowPolicy):
+        self.bus = bus
+        self.callback = callback
+        self.overflow = OverflowPolicy(overflow)
+        self.maxsize = maxsize
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.name = _callback_name(callback)
+        self._dropped_metric = QUEUE_DROPPED.labels(self.name)
+        QUEUE_DEPTH.labels(self.name).set_function(lambda: self.queue.qsize() if self.queue else 0)
+
+    def ensure_started(self):
+        if self.task is None or self.task.done():
+            self.queue = self.queue or asyncio.Queue(maxsize=self.maxsize)
+            self.task = asyncio.create_task(self._run(), name=f"event-subscriber:{self.name}")
+
+    async def put(self, event):
+        self.ensure_started()
+        if self.overflow is OverflowPolicy.BLOCK:
+            await self.queue.put(event)
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._dropped_metric.inc()
+            if self.overflow is OverflowPolicy.DROP_NEWEST:
+                return
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait(event)
+
+    async def _run(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.bus._invoke(self.callback, event)
+            finally:
+                self.queue.task_done()
+
 class EventBus:
-    def __init__(self):
+    """In-process pub/sub.
+
+    Subscribers registered with `subscribe_async` are awaited by `publish` (the publisher
+    waits for all of them). Subscribers registered with `subscribe_queued` each run in their
+    own worker task behind a bounded queue, so `publish` only pays for the enqueue.
+
+    A subscription to a type also receives its subclasses. Handler exceptions go to
+    `error_handler`, or are logged together with the failing event.
+    """
+    def __init__(self, error_handler: Optional[ErrorHandler] = None):
         self._async_subscribers: DefaultDict[Type, List[Callable]] = defaultdict(list)
+        self._queued_subscribers: DefaultDict[Type, List[_QueuedSubscriber]] = defaultdict(list)
+        # concrete event type -> (awaited callbacks, queued subscribers), built on first publish
+        self._dispatch_table: Dict[Type, Tuple[List[Callable], List[_QueuedSubscriber]]] = {}
+        self.error_handler = error_handler
 
     def subscribe_async(self, event_type: Type[T_Event], coro_callback: Callable[[T_Event], asyncio.Future]):
         self._async_subscribers[event_type].append(coro_callback)
+        self._dispatch_table.clear()
+
+    def subscribe_queued(self, event_type: Type[T_Event], coro_callback: Callable[[T_Event], Awaitable],
+                         maxsize: int = 100, overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        """Deliver events through a bounded queue drained by a dedicated worker task.
+
+        Not for request events carrying a response future: a dropped event would leave it unresolved.
+        """
+        self._queued_subscribers[event_type].append(_QueuedSubscriber(self, coro_callback, maxsize, overflow))
+        self._dispatch_table.clear()
+
+    def _dispatch(self, event_type: Type) -> Tuple[List[Callable], List[_QueuedSubscriber]]:
+        entry = self._dispatch_table.get(event_type)
+        if entry is None:
+            direct, queued = [], []
+            for cls in event_type.__mro__:
+                direct.extend(self._async_subscribers.get(cls, ()))
+                queued.extend(self._queued_subscribers.get(cls, ()))
+            entry = self._dispatch_table[event_type] = (direct, queued)
+        return entry
 
     async def publish(self, event: T_Event):
         event_type = type(event)
-        if self._async_subscribers[event_type]:
-            tasks = [cb(event) for cb in self._async_subscribers[event_type]]
-            await asyncio.gather(*tasks, return_exceptions=True)
\ No newline at end of file
+        EVENTS_PUBLISHED.labels(event_type.__name__).inc()
+        direct, queued = self._dispatch(event_type)
+        for subscriber in queued:
+            await subscriber.put(event)
+        if len(direct) == 1:
+            await self._invoke(direct[0], event)
+        elif direct:
+            await asyncio.gather(*[self._invoke(cb, event) for cb in direct])
+
+    async def _invoke(self, callback: Callable, event):
+        event_name = type(event).__name__
+        in_flight = HANDLERS_IN_FLIGHT.labels(event_name)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await callback(event)
+        except Exception as e:
+            HANDLER_ERRORS.labels(event_name, _callback_name(callback)).inc()
+            self._report(e, event, callback)
+        finally:
+            HANDLER_SECONDS.labels(event_name, _callback_name(callback)).observe(time.perf_counter() - start)
+            in_flight.dec()
+
+    async def close(self, timeout: float = 2.0):
+        """Give queued subscribers a moment to drain, then stop their workers."""
+        subscribers = [s for subs in self._queued_subscribers.values() for s in subs if s.task]
+        if subscribers:
+            drains = [asyncio.ensure_future(s.queue.join()) for s in subscribers]
+            _, pending = await asyncio.wait(drains, timeout=timeout)
+            for drain in pending:
+                drain.cancel()
+        for subscriber in subscribers:
+            subscriber.task.cancel()
+        await asyncio.gather(*[s.task for s in subscribers], return_exceptions=True)
+
+    def _report(self, exc: BaseException, event, callback: Callable):
+        if self.error_handler is not None:
+            try:
+                self.error_handler(exc, event, callback)
+                return
+            except Exception as handler_exc:
+                logger_event_bus.error(f"Event bus error handler failed: {handler_exc}", exc_info=True)
+        logger_event_bus.error(f"Subscriber {_callback_name(callback)} failed on {_event_repr.repr(event)}: {exc}",
+                               exc_info=(type(exc), exc, exc.__traceback__))
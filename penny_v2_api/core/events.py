@@ -1,20 +1,50 @@
 # ==============================================================================
 # penny_v2_api/core/events.py
 # ==============================================================================
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, BinaryIO, List, Optional, Union
 import asyncio
 
+if TYPE_CHECKING:
+    import numpy as np
+
 @dataclass
-class BaseEvent: pass
+class BaseEvent:
+    # Correlates the events of one unit of work in core.tracing; keyword-only so subclasses keep positional fields.
+    trace_id: Optional[str] = field(default=None, kw_only=True)
 @dataclass
 class AppShutdownEvent(BaseEvent): pass
 @dataclass
 class LogEvent(BaseEvent): message: str; level: str = "INFO"
 @dataclass
-class TranscriptionRequest(BaseEvent): audio_data: bytes; response_future: asyncio.Future
+class TranscriptionRequest(BaseEvent): audio_data: Union[bytes, memoryview, "np.ndarray", BinaryIO]; response_future: asyncio.Future; partial: bool = False; bulk: bool = False
+@dataclass
+class MusicGenerationRequest(BaseEvent): prompt: str; duration: int; response_future: asyncio.Future; params: Optional[dict] = None
+@dataclass
+class MusicJobSubmitRequest(BaseEvent): prompt: str; duration: int; response_future: asyncio.Future; params: Optional[dict] = None; play_in_discord: bool = False
+@dataclass
+class MusicJobLookupRequest(BaseEvent): job_id: str; response_future: asyncio.Future
+@dataclass
+class MusicJobProgressEvent(BaseEvent): job_id: str; status: str; segments_done: int; segments_total: int; error: Optional[str] = None
+@dataclass
+class PlayAudioInDiscordEvent(BaseEvent):
+    audio_data: Union[bytes, memoryview]
+    response_future: asyncio.Future
+    interrupt: bool = False  # drop the play queue and start this clip now
+    overlay: bool = False    # mix on top of whatever is playing (sound effects)
+@dataclass
+class AddMemoryRequest(BaseEvent): text: str; response_future: asyncio.Future; metadata: Optional[dict] = None
+@dataclass
+class QueryMemoryRequest(BaseEvent): query_text: str; response_future: asyncio.Future; n_results: int = 5
+@dataclass
+class DeleteMemoryRequest(BaseEvent): memory_id: str; response_future: asyncio.Future
+@dataclass
+class BulkAddMemoryRequest(BaseEvent): items: List[dict]; response_future: asyncio.Future  # [{"text", "metadata"?}]
+@dataclass
+class BulkQueryMemoryRequest(BaseEvent): query_texts: List[str]; response_future: asyncio.Future; n_results: int = 5
 @dataclass
-class MusicGenerationRequest(BaseEvent): prompt: str; duration: int; response_future: asyncio.Future
+class BulkDeleteMemoryRequest(BaseEvent): memory_ids: List[str]; response_future: asyncio.Future
 @dataclass
-class PlayAudioInDiscordEvent(BaseEvent): audio_data: bytes; response_future: asyncio.Future
+class BroadcastTranscriptionEvent(BaseEvent): username: str; text: str; utterance_id: Optional[int] = None
 @dataclass
-class BroadcastTranscriptionEvent(BaseEvent): username: str; text: str
\ No newline at end of file
+class BroadcastPartialTranscriptionEvent(BaseEvent): username: str; utterance_id: int; stable: str; unstable: str
\ No newline at end of file
@@ -0,0 +1,10 @@
+# ==============================================================================
+# penny_v2_api/core/exceptions.py
+# ==============================================================================
+
+class ServiceOverloadedError(Exception):
+    """Raised when a service sheds a request because its work queue is full."""
+    def __init__(self, service: str, retry_after: float = 1.0):
+        super().__init__(f"{service} is overloaded, retry later.")
+        self.service = service
+        self.retry_after = retry_after
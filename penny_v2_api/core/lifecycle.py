@@ -0,0 +1,33 @@
+# ==============================================================================
+# penny_v2_api/core/lifecycle.py
+# Per-service lifecycle state, reported by the /health and /ready routes.
+# ==============================================================================
+import logging
+import time
+from enum import Enum
+from typing import Optional
+
+logger_lifecycle = logging.getLogger(__name__)
+
+class ServiceState(str, Enum):
+    STOPPED = "stopped"
+    STARTING = "starting"      # loading models / connecting
+    WARMING_UP = "warming_up"  # running a throwaway inference
+    READY = "ready"
+    FAILED = "failed"
+
+class ServiceStatus:
+    """Mixin giving a service a reportable state. Set from the event loop only."""
+    state: ServiceState = ServiceState.STOPPED
+    state_detail: Optional[str] = None
+    state_changed_at: float = 0.0
+
+    def set_state(self, state: ServiceState, detail: Optional[str] = None):
+        self.state = state
+        self.state_detail = detail
+        self.state_changed_at = time.time()
+        log = logger_lifecycle.error if state is ServiceState.FAILED else logger_lifecycle.info
+        log(f"{type(self).__name__}: {state.value}{f' ({detail})' if detail else ''}")
+
+    def status(self) -> dict:
+        return {"state": self.state.value, "detail": self.state_detail, "since": self.state_changed_at or None}
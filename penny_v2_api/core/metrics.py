@@ -0,0 +1,165 @@
+# ==============================================================================
+# penny_v2_api/core/metrics.py
+# Minimal Prometheus-compatible metrics: counters, gauges and histograms with
+# labels, rendered in the text exposition format for the /metrics route.
+# ==============================================================================
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[str]:
+        for key, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, key)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+class _ValueChild:
+    __slots__ = ("value", "function", "_lock")
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value at scrape time, e.g. from a component's own counters."""
+        self.function = function
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, key):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float("nan")
+        yield f"{name}{_format_labels(labelnames, key)} {_format_value(value) if value == value else 'NaN'}"
+
+class Counter(_Metric):
+    type_name = "counter"
+    def _new_child(self): return _ValueChild()
+    def inc(self, amount: float = 1.0): self.labels().inc(amount)
+    def set_function(self, function: Callable[[], float]): self.labels().set_function(function)
+
+class _GaugeChild(_ValueChild):
+    __slots__ = ()
+    def set(self, value: float): self.value = value
+    def dec(self, amount: float = 1.0): self.inc(-amount)
+
+class Gauge(_Metric):
+    type_name = "gauge"
+    def _new_child(self): return _GaugeChild()
+    def set(self, value: float): self.labels().set(value)
+    def inc(self, amount: float = 1.0): self.labels().inc(amount)
+    def dec(self, amount: float = 1.0): self.labels().dec(amount)
+    def set_function(self, function: Callable[[], float]): self.labels().set_function(function)
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labelnames, key):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            yield f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}"
+        yield f"{name}_sum{_format_labels(labelnames, key)} {_format_value(self.sum)}"
+        yield f"{name}_count{_format_labels(labelnames, key)} {cumulative}"
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self): return _HistogramChild(self.buckets)
+    def observe(self, value: float): self.labels().observe(value)
+    def time(self): return self.labels().time()
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
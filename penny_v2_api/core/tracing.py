@@ -0,0 +1,159 @@
+# ==============================================================================
+# penny_v2_api/core/tracing.py
+# Lightweight per-request tracing: stage spans keyed by a trace ID that rides
+# along on events, kept in a ring buffer and exportable as Chrome trace JSON.
+# ==============================================================================
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional
+
+def now() -> float:
+    """Clock used for all span timestamps."""
+    return time.perf_counter()
+
+def from_monotonic(timestamp: float) -> float:
+    """Convert a time.monotonic() reading (e.g. from the voice segmenter) to the span clock."""
+    return timestamp + (time.perf_counter() - time.monotonic())
+
+class Span:
+    __slots__ = ("name", "start", "end", "attributes")
+    def __init__(self, name: str, start: float, end: float, attributes: dict):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attributes = attributes
+
+class Trace:
+    """Spans recorded for one unit of work, e.g. a single utterance."""
+    def __init__(self, name: str, attributes: dict, started_at: Optional[float] = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started_at = now() if started_at is None else started_at
+        self.finished_at: Optional[float] = None
+        self.spans: List[Span] = []
+        self.marks: Dict[str, float] = {}
+
+    def add_span(self, name: str, start: float, end: float, **attributes):
+        # list.append is atomic, so executor threads may record spans too.
+        self.spans.append(Span(name, start, end, attributes))
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[None]:
+        start = now()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, now(), **attributes)
+
+    def mark(self, name: str):
+        """Remember a point in time for a stage that another component will close."""
+        self.marks[name] = now()
+
+    @property
+    def duration(self) -> float:
+        """Latency from `started_at`; spans recorded before it (e.g. the user speaking) don't count."""
+        end = max([self.finished_at or now()] + [s.end for s in self.spans])
+        return end - self.started_at
+
+    def to_dict(self) -> dict:
+        base = min([self.started_at] + [s.start for s in self.spans])
+        return {"trace_id": self.trace_id, "name": self.name, "attributes": self.attributes,
+                "duration_ms": round(self.duration * 1000, 3),
+                "spans": [{"name": s.name, "offset_ms": round((s.start - base) * 1000, 3),
+                           "duration_ms": round((s.end - s.start) * 1000, 3), **s.attributes}
+                          for s in sorted(self.spans, key=lambda s: s.start)]}
+
+class _NullTrace:
+    """Stands in when tracing is disabled so call sites need no checks."""
+    trace_id = None
+    marks: Dict[str, float] = {}
+    def add_span(self, name, start, end, **attributes): pass
+    @contextmanager
+    def span(self, name, **attributes): yield
+    def mark(self, name): pass
+
+NULL_TRACE = _NullTrace()
+
+class Tracer:
+    """Keeps recent traces in a ring buffer.
+
+    Every trace is recorded while in flight (it is only a handful of spans); on `finish` it is
+    retained with probability `sample_rate`, or always when it took at least `slow_threshold_s`,
+    so slow outliers are never sampled away.
+    """
+    def __init__(self, capacity: int = 512, sample_rate: float = 1.0, slow_threshold_s: Optional[float] = None,
+                 enabled: bool = True):
+        self._lock = threading.Lock()
+        self.configure(capacity, sample_rate, slow_threshold_s, enabled)
+
+    def configure(self, capacity: int, sample_rate: float, slow_threshold_s: Optional[float] = None,
+                  enabled: bool = True):
+        with self._lock:
+            self.enabled = enabled
+            self.sample_rate = sample_rate
+            self.slow_threshold_s = slow_threshold_s
+            self._retained: Deque[Trace] = deque(maxlen=capacity)
+            self._by_id: Dict[str, Trace] = {}
+            # Traces whose owner never finished them (e.g. a cancelled task) age out of here.
+            self._active: "OrderedDict[str, Trace]" = OrderedDict()
+            self._max_active = max(capacity, 64) * 4
+
+    def start(self, name: str, started_at: Optional[float] = None, **attributes):
+        if not self.enabled:
+            return NULL_TRACE
+        trace = Trace(name, attributes, started_at)
+        with self._lock:
+            self._active[trace.trace_id] = trace
+            while len(self._active) > self._max_active:
+                self._active.popitem(last=False)
+        return trace
+
+    def get(self, trace_id: Optional[str]):
+        """The live or retained trace for `trace_id`, or the no-op trace."""
+        if trace_id is None:
+            return NULL_TRACE
+        with self._lock:
+            return self._active.get(trace_id) or self._by_id.get(trace_id) or NULL_TRACE
+
+    def finish(self, trace):
+        if trace is NULL_TRACE or trace.finished_at is not None:
+            return
+        trace.finished_at = now()
+        slow = self.slow_threshold_s is not None and trace.duration >= self.slow_threshold_s
+        with self._lock:
+            self._active.pop(trace.trace_id, None)
+            if not slow and random.random() >= self.sample_rate:
+                return
+            if len(self._retained) == self._retained.maxlen:
+                self._by_id.pop(self._retained[0].trace_id, None)
+            self._retained.append(trace)
+            self._by_id[trace.trace_id] = trace
+
+    def recent(self, limit: int = 50, min_duration_s: float = 0.0) -> List[Trace]:
+        with self._lock:
+            traces = list(self._retained)
+        traces = [t for t in reversed(traces) if t.duration >= min_duration_s]
+        return traces[:limit]
+
+    def chrome_trace(self, traces: Optional[List[Trace]] = None) -> dict:
+        """Trace Event Format, loadable in chrome://tracing or Perfetto. One row per trace."""
+        if traces is None:
+            with self._lock:
+                traces = list(self._retained)
+        events = []
+        for tid, trace in zip(itertools.count(1), traces):
+            label = " ".join([trace.name] + [f"{k}={v}" for k, v in trace.attributes.items()])
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": label}})
+            for span in trace.spans:
+                events.append({"name": span.name, "cat": trace.name, "ph": "X", "pid": 1, "tid": tid,
+                               "ts": span.start * 1e6, "dur": (span.end - span.start) * 1e6,
+                               "args": {"trace_id": trace.trace_id, **span.attributes}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+TRACER = Tracer()
@@ -0,0 +1,711 @@
+# ==============================================================================
+# penny_v2_api/core/transport.py
+# Cross-process EventBus transport: a compact wire format for events, request/
+# reply by correlation ID instead of live futures, socket / multiprocessing /
+# in-process transports, a stand-in broker and the bridge tying a bus to it.
+# ==============================================================================
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import (Awaitable, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple,
+                    Type, Union)
+import numpy as np
+from penny_v2_api.core.event_bus import EventBus
+from penny_v2_api.core.events import BaseEvent
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.lifecycle import ServiceState, ServiceStatus
+from penny_v2_api.core.metrics import Counter, Gauge, Histogram
+
+logger_transport = logging.getLogger(__name__)
+
+BRIDGE_MESSAGES = Counter("penny_bridge_messages_total", "Messages through the event bridge.", ["direction", "kind"])
+BRIDGE_BYTES = Counter("penny_bridge_bytes_total", "Wire bytes through the event bridge.", ["direction"])
+BRIDGE_PENDING = Gauge("penny_bridge_pending_requests", "Remote requests awaiting a reply.")
+BRIDGE_REQUEST_SECONDS = Histogram("penny_bridge_request_seconds", "Remote request round trip.", ["event"])
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# --- wire format -------------------------------------------------------------------
+#
+# One message: <u32 header length> <header JSON> <attachment 0> ... <attachment n-1>
+#
+# Header keys: "k" kind (hello | event | request | reply | error), "c" correlation ID,
+# "t" event type name, "v" encoded value (event fields, reply value or error), "n" attachment
+# lengths. Binary values (audio bytes, numpy arrays, result files) never go through JSON: the
+# value holds {"$b": i} / {"$nd": i, ...} / {"$file": i, ...} and the bytes follow the header.
+# Files (spooled uploads, result files) are attached unread and copied out in CHUNK_BYTES pieces.
+
+MAX_MESSAGE_BYTES = 1 << 30
+CHUNK_BYTES = 1 << 20
+_HEADER = struct.Struct("<I")
+
+KIND_HELLO = "hello"
+KIND_EVENT = "event"
+KIND_REQUEST = "request"
+KIND_REPLY = "reply"
+KIND_ERROR = "error"
+
+class RemoteError(Exception):
+    """A remote handler failed; carries the remote exception type and message."""
+    def __init__(self, error_type: str, message: str):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+_event_types: Dict[str, Type[BaseEvent]] = {}
+
+def event_type(name: str) -> Type[BaseEvent]:
+    """Event class by name; every BaseEvent subclass is known without registration."""
+    cls = _event_types.get(name)
+    if cls is None:
+        pending = [BaseEvent]
+        while pending:
+            known = pending.pop()
+            _event_types[known.__name__] = known
+            pending.extend(known.__subclasses__())
+        cls = _event_types.get(name)
+        if cls is None:
+            raise KeyError(f"Unknown event type {name!r}")
+    return cls
+
+class FileAttachment:
+    """An attachment still in its file, so a spooled upload or result file is never held in memory
+    whole. Socket transports stream it in CHUNK_BYTES pieces; message-at-once transports (pipe,
+    in-process) read it in one go.
+
+    A path is opened right away, so the file can be evicted and unlinked before it is sent.
+    """
+    __slots__ = ("file", "nbytes", "owned")
+    def __init__(self, source: Union[Path, BinaryIO]):
+        self.owned = isinstance(source, Path)
+        self.file: BinaryIO = open(source, "rb") if self.owned else source
+        self.nbytes = self.file.seek(0, os.SEEK_END)
+        if self.nbytes > MAX_MESSAGE_BYTES:
+            self.close()
+            raise ValueError(f"File of {self.nbytes} bytes exceeds the message limit")
+
+    def chunks(self) -> Iterator[bytes]:
+        """Blocking reads; consume it off the event loop."""
+        try:
+            self.file.seek(0)
+            remaining = self.nbytes
+            while remaining:
+                chunk = self.file.read(min(CHUNK_BYTES, remaining))
+                if not chunk:
+                    raise OSError("File attachment shrank while being sent")
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def read(self) -> bytes:
+        return b"".join(self.chunks())
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+Part = Union[BytesLike, FileAttachment]
+
+def part_size(part: Part) -> int:
+    return part.nbytes if isinstance(part, FileAttachment) else memoryview(part).nbytes
+
+def join_parts(parts: Sequence[Part]) -> bytes:
+    """The whole message in one buffer (reads file attachments; blocking)."""
+    return b"".join(part.read() if isinstance(part, FileAttachment) else part for part in parts)
+
+class _Encoder:
+    def __init__(self):
+        self.attachments: List[Part] = []
+
+    def _attach(self, data: Union[BytesLike, FileAttachment]) -> int:
+        self.attachments.append(data if isinstance(data, FileAttachment) else memoryview(data).cast("B"))
+        return len(self.attachments) - 1
+
+    def encode(self, value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return {"$b": self._attach(value)}
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            return {"$nd": self._attach(array), "dtype": array.dtype.str, "shape": list(array.shape)}
+        if isinstance(value, Path):
+            return {"$file": self._attach(FileAttachment(value)), "name": value.name}
+        if hasattr(value, "read"):
+            # Spooled uploads: the receiving node cannot see our temp files.
+            return {"$b": self._attach(FileAttachment(value))}
+        if isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        if isinstance(value, dict):
+            encoded = {str(k): self.encode(v) for k, v in value.items()}
+            return {"$d": encoded} if any(k.startswith("$") for k in encoded) else encoded
+        raise TypeError(f"Cannot send {type(value).__name__} over the event transport")
+
+class ShippedFile:
+    """A result file received over the wire; the bytes still point into the receive buffer."""
+    __slots__ = ("name", "data")
+    def __init__(self, name: str, data: memoryview):
+        self.name = name
+        self.data = data
+
+    def write_to(self, path: Path):
+        path.write_bytes(self.data)
+
+class _Decoder:
+    def __init__(self, attachments: List[memoryview]):
+        self.attachments = attachments
+
+    def decode(self, value):
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if "$b" in value:
+            return bytes(self.attachments[value["$b"]])
+        if "$nd" in value:
+            # Copy out of the receive buffer so the message can be freed independently.
+            return np.frombuffer(self.attachments[value["$nd"]], dtype=np.dtype(value["dtype"])) \
+                .reshape(value["shape"]).copy()
+        if "$file" in value:
+            # Same name as on the sender, e.g. a content hash; where it is kept is up to the receiver.
+            return ShippedFile(Path(value["name"]).name, self.attachments[value["$file"]])
+        if "$d" in value:
+            value = value["$d"]
+        return {k: self.decode(v) for k, v in value.items()}
+
+def encode_message(kind: str, value=None, event_name: Optional[str] = None, correlation_id: Optional[str] = None,
+                   **header) -> List[Part]:
+    """Serialize one message into buffers for a vectored write (attachments are not copied)."""
+    encoder = _Encoder()
+    header.update(k=kind, c=correlation_id, t=event_name, v=encoder.encode(value),
+                  n=[part_size(a) for a in encoder.attachments])
+    body = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return [_HEADER.pack(len(body)), body, *encoder.attachments]
+
+def encode_event(kind: str, event: BaseEvent, correlation_id: Optional[str] = None) -> List[Part]:
+    # response_future is the local end of request/reply; on the wire the correlation ID replaces it.
+    fields = {f.name: getattr(event, f.name) for f in dataclasses.fields(event) if f.name != "response_future"}
+    return encode_message(kind, fields, type(event).__name__, correlation_id)
+
+def read_header(data: BytesLike) -> Tuple[dict, memoryview]:
+    """Header and the attachment region, without decoding any values (enough for routing)."""
+    view = memoryview(data)
+    (length,) = _HEADER.unpack_from(view, 0)
+    header = json.loads(bytes(view[_HEADER.size:_HEADER.size + length]))
+    return header, view[_HEADER.size + length:]
+
+def decode_value(header: dict, payload: memoryview):
+    attachments, offset = [], 0
+    for size in header.get("n", ()):
+        attachments.append(payload[offset:offset + size])
+        offset += size
+    return _Decoder(attachments).decode(header.get("v"))
+
+def decode_event(header: dict, payload: memoryview) -> BaseEvent:
+    """Rebuild the event; request types get response_future=None for the receiver to fill in."""
+    cls = event_type(header["t"])
+    fields = decode_value(header, payload)
+    if any(f.name == "response_future" for f in dataclasses.fields(cls)):
+        fields["response_future"] = None
+    return cls(**fields)
+
+def encode_error(exc: BaseException, correlation_id: str) -> List[BytesLike]:
+    error = {"type": type(exc).__name__, "message": str(exc)}
+    if isinstance(exc, ServiceOverloadedError):
+        error.update(service=exc.service, retry_after=exc.retry_after)
+    return encode_message(KIND_ERROR, error, correlation_id=correlation_id)
+
+def decode_error(error: dict) -> Exception:
+    if error.get("type") == ServiceOverloadedError.__name__:
+        # Keeps load shedding end to end: the API still answers 503 + Retry-After.
+        return ServiceOverloadedError(error.get("service", "remote"), error.get("retry_after", 1.0))
+    return RemoteError(error.get("type", "Exception"), error.get("message", ""))
+
+# --- transports ----------------------------------------------------------------------
+
+class Transport:
+    """A bidirectional, message-oriented, ordered channel. `recv` raises ConnectionError once closed."""
+    async def send(self, parts: Sequence[Part]): raise NotImplementedError
+    async def recv(self) -> bytes: raise NotImplementedError
+    async def close(self): raise NotImplementedError
+
+class StreamTransport(Transport):
+    """Length-prefixed messages over an asyncio stream (TCP or Unix socket)."""
+    _LENGTH = struct.Struct("<Q")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # A message with a file attachment is written over several awaits; keep others out of it.
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, parts: Sequence[Part]):
+        loop = asyncio.get_running_loop()
+        async with self._send_lock:
+            self.writer.write(self._LENGTH.pack(sum(part_size(p) for p in parts)))
+            try:
+                for part in parts:
+                    if not isinstance(part, FileAttachment):
+                        self.writer.write(part)
+                        continue
+                    chunks = part.chunks()
+                    try:
+                        while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                            self.writer.write(chunk)
+                            await self.writer.drain()
+                    finally:
+                        chunks.close()
+                await self.writer.drain()
+            except OSError as e:
+                # Half a message is on the wire; the stream cannot be used any more.
+                self.writer.close()
+                raise ConnectionError(str(e)) from e
+
+    async def recv(self) -> bytes:
+        try:
+            (size,) = self._LENGTH.unpack(await self.reader.readexactly(self._LENGTH.size))
+            if size > MAX_MESSAGE_BYTES:
+                raise ConnectionError(f"Message of {size} bytes exceeds the limit")
+            return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionError("Connection closed") from e
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+class PipeTransport(Transport):
+    """Messages over a multiprocessing Connection, e.g. to a node spawned as a child process.
+
+    Connections block, so sends go through one dedicated thread (keeping order) and a reader
+    thread feeds `recv`.
+    """
+    _CLOSED = object()
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self._loop = asyncio.get_running_loop()
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipe-transport")
+        threading.Thread(target=self._read, name="pipe-transport-reader", daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                message = self.conn.recv_bytes()
+            except (EOFError, OSError):
+                self._loop.call_soon_threadsafe(self._inbox.put_nowait, self._CLOSED)
+                return
+            self._loop.call_soon_threadsafe(self._inbox.put_nowait, message)
+
+    async def send(self, parts: Sequence[Part]):
+        try:
+            await self._loop.run_in_executor(self._sender, lambda: self.conn.send_bytes(join_parts(parts)))
+        except OSError as e:
+            raise ConnectionError(str(e)) from e
+
+    async def recv(self) -> bytes:
+        message = await self._inbox.get()
+        if message is self._CLOSED:
+            self._inbox.put_nowait(self._CLOSED)
+            raise ConnectionError("Pipe closed")
+        return message
+
+    async def close(self):
+        self.conn.close()
+        self._sender.shutdown(wait=False)
+
+class _QueueTransport(Transport):
+    _CLOSED = object()
+
+    def __init__(self, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        self._inbox = inbox
+        self._outbox = outbox
+
+    async def send(self, parts: Sequence[Part]):
+        # Copied, as a socket would: the sender may reuse its buffers.
+        await self._outbox.put(join_parts(parts))
+
+    async def recv(self) -> bytes:
+        message = await self._inbox.get()
+        if message is self._CLOSED:
+            self._inbox.put_nowait(self._CLOSED)
+            raise ConnectionError("Transport closed")
+        return message
+
+    async def close(self):
+        self._outbox.put_nowait(self._CLOSED)
+        self._inbox.put_nowait(self._CLOSED)
+
+def local_pair() -> Tuple[Transport, Transport]:
+    """Two connected in-process transports, for running several nodes in one process."""
+    a, b = asyncio.Queue(), asyncio.Queue()
+    return _QueueTransport(a, b), _QueueTransport(b, a)
+
+def _parse_url(url: str) -> Tuple[str, str]:
+    scheme, _, rest = url.partition("://")
+    if scheme not in ("tcp", "unix") or not rest:
+        raise ValueError(f"Unsupported transport URL {url!r} (expected tcp://host:port or unix:///path)")
+    return scheme, rest
+
+async def connect(url: str) -> Transport:
+    scheme, rest = _parse_url(url)
+    if scheme == "unix":
+        return StreamTransport(*await asyncio.open_unix_connection(rest))
+    host, _, port = rest.rpartition(":")
+    return StreamTransport(*await asyncio.open_connection(host, int(port)))
+
+async def listen(url: str, on_connect: Callable[[Transport], Awaitable[None]]) -> asyncio.AbstractServer:
+    scheme, rest = _parse_url(url)
+
+    async def handle(reader, writer):
+        await on_connect(StreamTransport(reader, writer))
+
+    if scheme == "unix":
+        if os.path.exists(rest):
+            os.unlink(rest)  # stale socket from a previous run
+        return await asyncio.start_unix_server(handle, rest)
+    host, _, port = rest.rpartition(":")
+    return await asyncio.start_server(handle, host, int(port))
+
+# --- broker ------------------------------------------------------------------------
+
+class _BrokerNode:
+    __slots__ = ("transport", "name", "serves", "subscribes", "outstanding")
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        self.name = "?"
+        self.serves: Set[str] = set()
+        self.subscribes: Set[str] = set()
+        self.outstanding = 0
+
+class LocalBroker:
+    """Stand-in message broker for one machine and for tests.
+
+    Nodes announce the request types they serve and the event types they want. Requests go to
+    the serving node with the fewest outstanding requests, replies back to the requester by
+    correlation ID, events to every subscribed node. Messages are routed on the header alone
+    and forwarded as received.
+    """
+    def __init__(self):
+        self._nodes: Dict[Transport, _BrokerNode] = {}
+        self._pending: Dict[str, Tuple[_BrokerNode, _BrokerNode]] = {}  # correlation ID -> (requester, server)
+        self._tasks: Set[asyncio.Task] = set()
+        self._servers: List[asyncio.AbstractServer] = []
+
+    async def listen(self, url: str):
+        self._servers.append(await listen(url, self.serve_node))
+        logger_transport.info(f"Broker listening on {url}")
+
+    def attach(self, transport: Transport) -> asyncio.Task:
+        """Serve a node on an already-connected transport (pipe or local pair)."""
+        task = asyncio.create_task(self.serve_node(transport))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        for node in list(self._nodes.values()):
+            await node.transport.close()
+
+    async def serve_node(self, transport: Transport):
+        node = self._nodes[transport] = _BrokerNode(transport)
+        try:
+            while True:
+                data = await transport.recv()
+                header, _ = read_header(data)
+                await self._route(node, header, data)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger_transport.error(f"Broker dropping node {node.name}: {e}", exc_info=True)
+        finally:
+            await self._drop(node)
+
+    async def _route(self, node: _BrokerNode, header: dict, data: bytes):
+        kind = header["k"]
+        if kind == KIND_HELLO:
+            node.name = header.get("name") or node.name
+            node.serves, node.subscribes = set(header.get("serves", ())), set(header.get("subscribes", ()))
+            logger_transport.info(f"Node {node.name} joined: serves {sorted(node.serves)}, "
+                                  f"subscribes {sorted(node.subscribes)}")
+        elif kind == KIND_REQUEST:
+            servers = [n for n in self._nodes.values() if header["t"] in n.serves and n is not node]
+            if not servers:
+                error = ServiceOverloadedError(f"{header['t']} (no node serves it)", retry_after=5.0)
+                await self._send(node, encode_error(error, header["c"]))
+                return
+            server = min(servers, key=lambda n: n.outstanding)
+            server.outstanding += 1
+            self._pending[header["c"]] = (node, server)
+            await self._send(server, [data])
+        elif kind in (KIND_REPLY, KIND_ERROR):
+            entry = self._pending.pop(header["c"], None)
+            if entry is None:
+                return  # the requester left
+            requester, server = entry
+            server.outstanding -= 1
+            await self._send(requester, [data])
+        elif kind == KIND_EVENT:
+            for other in list(self._nodes.values()):
+                if other is not node and header["t"] in other.subscribes:
+                    await self._send(other, [data])
+
+    async def _send(self, node: _BrokerNode, parts: Sequence[Part]):
+        try:
+            await node.transport.send(parts)
+        except ConnectionError:
+            pass  # its serve_node loop notices and cleans up
+
+    async def _drop(self, node: _BrokerNode):
+        self._nodes.pop(node.transport, None)
+        for correlation_id, (requester, server) in list(self._pending.items()):
+            if requester is node:
+                self._pending.pop(correlation_id)
+                server.outstanding -= 1
+            elif server is node:
+                self._pending.pop(correlation_id)
+                await self._send(requester, encode_error(ConnectionError(f"node {node.name} disconnected"),
+                                                         correlation_id))
+        logger_transport.info(f"Node {node.name} left.")
+
+# --- bridge ------------------------------------------------------------------------
+
+class EventBridge(ServiceStatus):
+    """Connects a local EventBus to a broker.
+
+    remote:   request types handled elsewhere. Publishing one locally sends it out; its
+              response_future is resolved from the reply with the same correlation ID.
+    serve:    request types handled here for other nodes. They are published locally with a fresh
+              future, whose result (or exception) goes back as the reply.
+    outbound: plain events published locally that other nodes may want.
+    inbound:  plain events from other nodes to publish locally.
+    file_results: served request types whose result is a file path; the file itself is shipped
+              and kept in `file_store` on the requesting node (anything with MusicResultCache's
+              `get_or_create(key, produce)`, keyed by the file's stem, so the directory stays bounded).
+    """
+    def __init__(self, event_bus: EventBus, connect_to: Union[str, Callable[[], Awaitable[Transport]]],
+                 name: Optional[str] = None, remote: Iterable[Type[BaseEvent]] = (),
+                 serve: Iterable[Type[BaseEvent]] = (), outbound: Iterable[Type[BaseEvent]] = (),
+                 inbound: Iterable[Type[BaseEvent]] = (), file_results: Iterable[Type[BaseEvent]] = (),
+                 file_store=None, reconnect_delay_s: float = 1.0):
+        self.event_bus = event_bus
+        self._connect = (lambda: connect(connect_to)) if isinstance(connect_to, str) else connect_to
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.remote = list(remote)
+        self.serve = list(serve)
+        self.outbound = list(outbound)
+        self.inbound = {cls.__name__ for cls in inbound}
+        self.file_results = {cls.__name__ for cls in file_results}
+        self.file_store = file_store
+        self.reconnect_delay_s = reconnect_delay_s
+        self._transport: Optional[Transport] = None
+        self._connected = asyncio.Event()
+        self._pending: Dict[str, Tuple[asyncio.Future, str, float]] = {}
+        self._inbound_events: Set[int] = set()  # ids of events we are republishing, not to echo back
+        self._reader: Optional[asyncio.Task] = None
+        self._serving: Set[asyncio.Task] = set()
+        self._running = False
+        BRIDGE_PENDING.set_function(lambda: len(self._pending))
+
+    async def start(self):
+        if self._running:
+            return
+        self.set_state(ServiceState.STARTING)
+        for cls in self.remote:
+            self.event_bus.subscribe_async(cls, self._send_request)
+        for cls in self.outbound:
+            self.event_bus.subscribe_async(cls, self._send_event)
+        self._running = True
+        try:
+            await self._open()
+        except (ConnectionError, OSError) as e:
+            # Nodes may start before the broker; keep retrying in the background.
+            logger_transport.warning(f"Broker unreachable ({e}), will retry.")
+            self.set_state(ServiceState.STARTING, "waiting for broker")
+        self._reader = asyncio.create_task(self._read_loop(), name="event-bridge")
+
+    async def stop(self):
+        self._running = False
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        for task in list(self._serving):
+            task.cancel()
+        if self._transport:
+            await self._transport.close()
+        self._fail_pending(ConnectionError("Event bridge stopped"))
+        self.set_state(ServiceState.STOPPED)
+
+    async def _open(self):
+        self._transport = await self._connect()
+        await self._transport.send(encode_message(
+            KIND_HELLO, name=self.name, serves=[cls.__name__ for cls in self.serve], subscribes=sorted(self.inbound)))
+        self._connected.set()
+        self.set_state(ServiceState.READY)
+
+    async def _read_loop(self):
+        while self._running:
+            if not self._connected.is_set():
+                await self._reconnect()
+                continue
+            try:
+                data = await self._transport.recv()
+            except ConnectionError:
+                self._connected.clear()
+                self._fail_pending(ConnectionError("Lost connection to the broker"))
+                self.set_state(ServiceState.STARTING, "reconnecting to broker")
+                continue
+            BRIDGE_BYTES.labels("in").inc(len(data))
+            try:
+                self._dispatch(data)
+            except Exception as e:
+                logger_transport.error(f"Bad message from broker: {e}", exc_info=True)
+
+    async def _reconnect(self):
+        delay = self.reconnect_delay_s
+        while self._running:
+            await asyncio.sleep(delay)
+            try:
+                await self._open()
+                logger_transport.info("Reconnected to broker.")
+                return
+            except (ConnectionError, OSError) as e:
+                logger_transport.warning(f"Broker unreachable ({e}), retrying in {delay:.0f}s.")
+                delay = min(delay * 2, 30.0)
+
+    def _dispatch(self, data: bytes):
+        header, payload = read_header(data)
+        kind = header["k"]
+        BRIDGE_MESSAGES.labels("in", kind).inc()
+        if kind in (KIND_REPLY, KIND_ERROR):
+            entry = self._pending.pop(header["c"], None)
+            if entry is None:
+                return  # the requester gave up
+            future, event_name, sent_at = entry
+            BRIDGE_REQUEST_SECONDS.labels(event_name).observe(asyncio.get_running_loop().time() - sent_at)
+            if future.done():
+                return
+            if kind == KIND_ERROR:
+                future.set_exception(decode_error(decode_value(header, payload)))
+            else:
+                try:
+                    result = decode_value(header, payload)
+                except Exception as e:
+                    future.set_exception(e)
+                    return
+                if isinstance(result, ShippedFile):
+                    self._spawn(self._store_file(future, result))
+                else:
+                    future.set_result(result)
+        elif kind == KIND_REQUEST:
+            self._spawn(self._serve_request(header, decode_event(header, payload)))
+        elif kind == KIND_EVENT and header["t"] in self.inbound:
+            self._spawn(self._publish_inbound(decode_event(header, payload)))
+
+    async def _store_file(self, future: asyncio.Future, shipped: ShippedFile):
+        loop = asyncio.get_running_loop()
+
+        async def produce(stem: Path) -> Path:
+            # Results can be tens of MB; write them off the event loop.
+            await loop.run_in_executor(None, shipped.write_to, stem)
+            return stem
+
+        try:
+            if self.file_store is None:
+                raise ValueError("Received a file but no file store is configured")
+            path = await self.file_store.get_or_create(Path(shipped.name).stem, produce)
+            if not future.done():
+                future.set_result(str(path))
+        except asyncio.CancelledError:
+            if not future.done():
+                future.set_exception(ConnectionError("Event bridge stopped"))
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._serving.add(task)
+        task.add_done_callback(self._serving.discard)
+
+    async def _send(self, parts: List[Part], kind: str):
+        if not self._connected.is_set():
+            raise ConnectionError("Not connected to the broker")
+        await self._transport.send(parts)
+        BRIDGE_MESSAGES.labels("out", kind).inc()
+        BRIDGE_BYTES.labels("out").inc(sum(part_size(p) for p in parts))
+
+    async def _send_request(self, event: BaseEvent):
+        future = event.response_future
+        correlation_id = uuid.uuid4().hex
+        self._pending[correlation_id] = (future, type(event).__name__, asyncio.get_running_loop().time())
+        # A caller that gives up (timeout, disconnect) should not keep the entry around.
+        future.add_done_callback(lambda _: self._pending.pop(correlation_id, None))
+        try:
+            # Audio payloads can be large; serialize them off the event loop.
+            parts = await asyncio.get_running_loop().run_in_executor(
+                None, encode_event, KIND_REQUEST, event, correlation_id)
+            await self._send(parts, KIND_REQUEST)
+        except Exception as e:
+            self._pending.pop(correlation_id, None)
+            if not future.done():
+                future.set_exception(e)
+
+    async def _send_event(self, event: BaseEvent):
+        if id(event) in self._inbound_events or not self._connected.is_set():
+            return
+        try:
+            await self._send(encode_event(KIND_EVENT, event), KIND_EVENT)
+        except ConnectionError:
+            pass  # events are best effort
+
+    async def _publish_inbound(self, event: BaseEvent):
+        self._inbound_events.add(id(event))
+        try:
+            await self.event_bus.publish(event)
+        finally:
+            self._inbound_events.discard(id(event))
+
+    async def _serve_request(self, header: dict, event: BaseEvent):
+        event.response_future = asyncio.get_running_loop().create_future()
+        try:
+            await self.event_bus.publish(event)
+            result = await event.response_future
+            if header["t"] in self.file_results and result is not None:
+                result = Path(result)
+            loop = asyncio.get_running_loop()
+            parts = await loop.run_in_executor(None, lambda: encode_message(KIND_REPLY, result,
+                                                                            correlation_id=header["c"]))
+            kind = KIND_REPLY
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            parts, kind = encode_error(e, header["c"]), KIND_ERROR
+        try:
+            await self._send(parts, kind)
+        except ConnectionError:
+            logger_transport.warning(f"Could not reply to {header['t']}: broker connection lost.")
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        for future, _, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
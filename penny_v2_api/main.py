@@ -1,4 +1,6 @@
 import asyncio
+import logging
+import time
 import uvicorn
 from contextlib import asynccontextmanager
 
@@ -6,36 +8,72 @@ from fastapi import FastAPI
 from penny_v2_api.config import AppConfig
 from penny_v2_api.core.event_bus import EventBus
 from penny_v2_api.core.events import LogEvent
+from penny_v2_api.core.tracing import TRACER
 from penny_v2_api.services.discord_bot import DiscordBotService
 from penny_v2_api.services.transcription import TranscriptionService
 from penny_v2_api.services.memory import MemoryService
+from penny_v2_api.services.music import MusicGenerationService
 from penny_v2_api.api_server import ApiServer
+from penny_v2_api.core.transport import LocalBroker
+from penny_v2_api.node import ROLES, frontend_bridge
 
 # Configuration and Event System
 settings = AppConfig()
 event_bus = EventBus()
+TRACER.configure(capacity=settings.TRACE_BUFFER_SIZE, sample_rate=settings.TRACE_SAMPLE_RATE,
+                 slow_threshold_s=settings.TRACE_SLOW_MS / 1000, enabled=settings.TRACE_ENABLED)
 
-# Services
-discord_service = DiscordBotService(event_bus, settings)
-transcription_service = TranscriptionService(event_bus)
-memory_service = MemoryService(event_bus, settings)
+async def log_event_handler(event: LogEvent):
+    logging.getLogger("penny_v2_api").log(logging.getLevelName(event.level.upper()), event.message)
+
+event_bus.subscribe_queued(LogEvent, log_event_handler, maxsize=1000)
+
+# Services. As a frontend node, transcription and music run on worker nodes behind the broker.
+if settings.NODE_ROLE not in ("all", "frontend"):
+    raise ValueError(f"main.py runs the API (NODE_ROLE all or frontend), got {settings.NODE_ROLE!r} of {ROLES}; "
+                     f"start other roles with `python -m penny_v2_api.node`.")
+services = {}
+if settings.NODE_ROLE == "frontend":
+    services["bridge"] = frontend_bridge(event_bus, ["transcription", "music"])
+services["memory"] = MemoryService(event_bus, settings)
+if settings.NODE_ROLE == "all":
+    services["transcription"] = TranscriptionService(event_bus)
+    services["music"] = MusicGenerationService(event_bus)
+services["discord"] = DiscordBotService(event_bus, settings)
+# Optional in-process stand-in broker, for running frontend and workers on one machine.
+broker = LocalBroker() if settings.BROKER_LISTEN else None
 
 # API
-api_server = ApiServer(event_bus)
+api_server = ApiServer(event_bus, services, music_jobs=settings.NODE_ROLE == "all")
 app = api_server.get_app()
 
 # Lifespan replaces deprecated on_event startup/shutdown
+async def start_service(name: str, service):
+    started = time.perf_counter()
+    try:
+        await service.start()
+        logging.getLogger("penny_v2_api").info(f"{name} started in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logging.getLogger("penny_v2_api").error(f"{name} failed to start: {e}", exc_info=True)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        await memory_service.start()
-        await transcription_service.start()
-        await discord_service.start()
-        await event_bus.publish(LogEvent("All services started."))
+        # Model loads run on executors, so startup takes as long as the slowest service.
+        started = time.perf_counter()
+        if broker:
+            await broker.listen(settings.BROKER_URL)
+        await asyncio.gather(*(start_service(name, service) for name, service in services.items()))
+        await event_bus.publish(LogEvent(f"All services started in {time.perf_counter() - started:.2f}s."))
         yield
     finally:
-        await discord_service.stop()
+        # Discord first so no new utterances arrive; the bridge last so remote replies can land.
+        for service in reversed(list(services.values())):
+            await service.stop()
+        if broker:
+            await broker.close()
         await event_bus.publish(LogEvent("Services shut down."))
+        await event_bus.close()
 
 # Attach lifespan to app
 app.router.lifespan_context = lifespan
@@ -0,0 +1,122 @@
+# ==============================================================================
+# penny_v2_api/node.py
+# Node roles for splitting the deployment across processes or machines:
+#   all       everything in one process, no transport (default)
+#   frontend  API + Discord + memory (main.py); transcription/music requests go to the broker,
+#             /music/jobs* answer 501 (jobs need the music service in-process)
+#   worker    runs NODE_SERVICES and serves their requests:  python -m penny_v2_api.node
+#   broker    only the stand-in broker:                       python -m penny_v2_api.node --role broker
+# ==============================================================================
+import argparse
+import asyncio
+import logging
+import signal
+from typing import Dict, List
+from penny_v2_api.config import settings
+from penny_v2_api.core.event_bus import EventBus
+from penny_v2_api.core.events import (
+    LogEvent,
+    MusicGenerationRequest,
+    TranscriptionRequest,
+)
+from penny_v2_api.core.transport import EventBridge, LocalBroker
+from penny_v2_api.services.music_cache import MusicResultCache
+
+logger_node = logging.getLogger(__name__)
+
+ROLES = ("all", "frontend", "worker", "broker")
+# Request types each remotable service handles.
+SERVICE_REQUESTS = {
+    "transcription": [TranscriptionRequest],
+    "music": [MusicGenerationRequest],
+}
+# Served requests whose result is a local file path: the file travels with the reply.
+FILE_RESULTS = [MusicGenerationRequest]
+# Plain events workers pass back to the frontend.
+WORKER_EVENTS = [LogEvent]
+
+def frontend_bridge(event_bus: EventBus, remote_services: List[str]) -> EventBridge:
+    """Bridge for a frontend: requests of `remote_services` go out, worker logs come in.
+
+    Music jobs are live objects (progress futures, streamed segments) and stay in-process; a
+    frontend's API does not offer them (ApiServer(music_jobs=False)).
+    """
+    return EventBridge(event_bus, settings.BROKER_URL, name=settings.NODE_NAME,
+                       remote=[cls for name in remote_services for cls in SERVICE_REQUESTS[name]],
+                       inbound=WORKER_EVENTS, file_store=remote_files_cache())
+
+def remote_files_cache() -> MusicResultCache:
+    """Music results shipped by workers, under the same LRU limits as a worker's own cache."""
+    return MusicResultCache(settings.REMOTE_FILES_DIR, settings.MUSIC_CACHE_MAX_MB * 1024 * 1024,
+                            settings.MUSIC_CACHE_MAX_ENTRIES)
+
+def build_worker_services(event_bus: EventBus, names: List[str]) -> Dict[str, object]:
+    services = {}
+    if "transcription" in names:
+        from penny_v2_api.services.transcription import TranscriptionService
+        services["transcription"] = TranscriptionService(event_bus)
+    if "music" in names:
+        from penny_v2_api.services.music import MusicGenerationService
+        services["music"] = MusicGenerationService(event_bus)
+    unknown = set(names) - set(SERVICE_REQUESTS)
+    if unknown:
+        raise ValueError(f"NODE_SERVICES can only contain {sorted(SERVICE_REQUESTS)}, got {sorted(unknown)}")
+    return services
+
+async def _wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+async def run_worker(with_broker: bool):
+    broker = None
+    if with_broker:
+        broker = LocalBroker()
+        await broker.listen(settings.BROKER_URL)
+    event_bus = EventBus()
+
+    async def log_event_handler(event: LogEvent):
+        logging.getLogger("penny_v2_api").log(logging.getLevelName(event.level.upper()), event.message)
+
+    event_bus.subscribe_queued(LogEvent, log_event_handler, maxsize=1000)
+    services = build_worker_services(event_bus, settings.NODE_SERVICES)
+    # Load models before announcing ourselves, so the broker never routes to a cold worker.
+    await asyncio.gather(*(service.start() for service in services.values()))
+    bridge = EventBridge(event_bus, settings.BROKER_URL, name=settings.NODE_NAME,
+                         serve=[cls for name in services for cls in SERVICE_REQUESTS[name]],
+                         outbound=WORKER_EVENTS, file_results=FILE_RESULTS)
+    await bridge.start()
+    logger_node.info(f"Worker serving {sorted(services)} via {settings.BROKER_URL}")
+    try:
+        await _wait_for_signal()
+    finally:
+        await bridge.stop()
+        for service in reversed(list(services.values())):
+            await service.stop()
+        await event_bus.close()
+        if broker:
+            await broker.close()
+
+async def run_broker():
+    broker = LocalBroker()
+    await broker.listen(settings.BROKER_URL)
+    try:
+        await _wait_for_signal()
+    finally:
+        await broker.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a penny worker or broker node.")
+    parser.add_argument("--role", choices=("worker", "broker"), default=None,
+                        help="defaults to NODE_ROLE when that is worker or broker, else worker")
+    parser.add_argument("--with-broker", action="store_true",
+                        help="also host the broker in this process (single-machine setups)")
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    role = args.role or (settings.NODE_ROLE if settings.NODE_ROLE in ("worker", "broker") else "worker")
+    asyncio.run(run_broker() if role == "broker" else run_worker(args.with_broker))
+
+if __name__ == "__main__":
+    main()
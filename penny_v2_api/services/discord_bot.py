@@ -1,38 +1,105 @@
 import logging
 import asyncio
-import io
-import wave
+from typing import Dict, Optional, Set, Tuple
 import disnake
 from disnake.ext import commands
 from discord.ext import voice_recv
-from collections import defaultdict
 from penny_v2_api.config import AppConfig
+from penny_v2_api.core.audio import DISCORD_CHANNELS, DISCORD_SAMPLE_RATE, pcm_to_whisper
 from penny_v2_api.core.event_bus import EventBus
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.lifecycle import ServiceState, ServiceStatus
+from penny_v2_api.core.metrics import Counter, Gauge
+from penny_v2_api.core.tracing import TRACER, from_monotonic, now
 from penny_v2_api.core.events import (
     PlayAudioInDiscordEvent,
     LogEvent,
     BroadcastTranscriptionEvent,
+    BroadcastPartialTranscriptionEvent,
     TranscriptionRequest,
 )
+from penny_v2_api.services.opus_receive import OPUS_SILENCE_MAX_BYTES, OpusUtteranceSegmenter
+from penny_v2_api.services.partials import StablePrefixTracker
+from penny_v2_api.services.playback import PlaybackEngine
+from penny_v2_api.services.voice_activity import PartialCallback, UtteranceCallback, UtteranceSegmenter
 
 logger = logging.getLogger(__name__)
 
+SINK_SPEAKERS = Gauge("penny_voice_sink_speakers", "Speakers currently tracked by the voice sink.")
+SINK_BUFFER_BYTES = Gauge("penny_voice_sink_buffer_bytes", "Audio buffer memory held by the voice sink.")
+SINK_DROPPED_BYTES = Counter("penny_voice_sink_dropped_bytes_total", "Audio dropped because the sink was out of budget.")
+SINK_OVERWRITTEN_BYTES = Counter("penny_voice_sink_overwritten_bytes_total", "Utterance PCM overwritten in a full ring.")
+SINK_EVICTED_SPEAKERS = Counter("penny_voice_sink_evicted_speakers_total", "Idle speakers whose buffer was reclaimed.")
+SINK_SKIPPED_PACKETS = Counter("penny_voice_sink_skipped_packets_total",
+                               "Packets discarded on the voice-receive thread.", ["reason"])
+SINK_OPUS_DECODE_ERRORS = Counter("penny_voice_sink_opus_decode_errors_total", "Opus packets that failed to decode.")
+
 class AudioSink(voice_recv.AudioSink):
-    def __init__(self, event_bus: EventBus):
+    """Feeds received voice into the utterance segmenter.
+
+    By default the voice-receive library decodes every speaker to PCM before `write`. With
+    `VOICE_OPUS_PASSTHROUGH` it hands over the raw Opus packets instead, and decoding is
+    deferred to OpusUtteranceSegmenter's pool. Either way, packets from `ignored_users` (and in
+    Opus mode, comfort-noise frames) are dropped here before anything else is done with them.
+    """
+    def __init__(self, event_bus: EventBus, settings: AppConfig, on_utterance: UtteranceCallback,
+                 on_partial: Optional[PartialCallback] = None, ignored_users: Optional[Set[int]] = None):
         super().__init__()
         self.event_bus = event_bus
-        self.user_audio_data = defaultdict(io.BytesIO)
+        self.opus = settings.VOICE_OPUS_PASSTHROUGH
+        # Shared with DiscordBotService, which updates it as members mute or unmute.
+        self.ignored_users = ignored_users if ignored_users is not None else set(settings.VOICE_IGNORED_USER_IDS)
+        self.ignored_packets = 0
+        self.silence_packets = 0
+        segmenter_options = dict(
+            onset_frames=settings.VAD_ONSET_FRAMES,
+            hangover_ms=settings.VAD_HANGOVER_MS,
+            preroll_ms=settings.VAD_PREROLL_MS,
+            max_utterance_s=settings.VAD_MAX_UTTERANCE_S,
+            min_utterance_ms=settings.VAD_MIN_UTTERANCE_MS,
+            on_partial=on_partial if settings.TRANSCRIPTION_PARTIALS else None,
+            partial_interval_ms=settings.TRANSCRIPTION_PARTIAL_INTERVAL_MS,
+            partial_window_s=settings.TRANSCRIPTION_PARTIAL_WINDOW_S,
+            memory_budget_bytes=settings.SINK_MEMORY_BUDGET_MB * 1024 * 1024,
+            idle_evict_s=settings.SINK_IDLE_EVICT_S,
+        )
+        if self.opus:
+            self.segmenter = OpusUtteranceSegmenter(
+                on_utterance,
+                voiced_min_bytes=settings.VOICE_OPUS_VOICED_MIN_BYTES,
+                decode_workers=settings.VOICE_OPUS_DECODE_WORKERS,
+                **segmenter_options,
+            )
+        else:
+            self.segmenter = UtteranceSegmenter(
+                on_utterance,
+                threshold_db=settings.VAD_ENERGY_THRESHOLD_DB,
+                ring_s=settings.SINK_RING_SECONDS,
+                **segmenter_options,
+            )
+        self.segmenter.start()
 
-    def write(self, user_id: int, pcm_data: bytes):
-        self.user_audio_data[user_id].write(pcm_data)
+    def write(self, user: Optional[disnake.abc.User], data: voice_recv.VoiceData):
+        # Runs on the voice-receive thread: filter, hand off and return immediately.
+        if user is None:
+            # SSRC not yet mapped to a member; nothing to key the speaker on.
+            return
+        if user.id in self.ignored_users:
+            self.ignored_packets += 1
+            return
+        payload = data.opus if self.opus else data.pcm
+        if not payload or (self.opus and len(payload) <= OPUS_SILENCE_MAX_BYTES):
+            self.silence_packets += 1
+            return
+        self.segmenter.feed(user.id, payload)
 
     def wants_opus(self):
-        return False
+        return self.opus
 
     def cleanup(self):
-        return
+        self.segmenter.stop()
 
-class DiscordBotService:
+class DiscordBotService(ServiceStatus):
     def __init__(self, event_bus: EventBus, settings: AppConfig):
         self.event_bus = event_bus
         self.settings = settings
@@ -43,6 +110,15 @@ class DiscordBotService:
         self.bot = commands.Bot(command_prefix="!", intents=intents)
         self.voice_client: disnake.VoiceClient = None
         self.sink: AudioSink = None
+        self._loop: asyncio.AbstractEventLoop = None
+        # user_id -> (utterance_id, tracker) for the speaker's latest utterance with interim results.
+        # Keyed per speaker so an utterance dropped before its final (too short, speaker evicted)
+        # is replaced by the next one instead of being kept forever.
+        self._partial_trackers: Dict[int, Tuple[int, StablePrefixTracker]] = {}
+        self._partials_in_flight: Set[int] = set()
+        # Users whose voice packets the sink discards: configured ids, bots and muted members.
+        self._ignored_users: Set[int] = set(settings.VOICE_IGNORED_USER_IDS)
+        self.playback = PlaybackEngine(settings.PLAYBACK_CACHE_MB * 1024 * 1024)
         self._running = False
         self._task = None
 
@@ -53,74 +129,177 @@ class DiscordBotService:
         @self.bot.event
         async def on_ready():
             await self.event_bus.publish(LogEvent(f"Discord Bot logged in as {self.bot.user}"))
+            self._ignored_users.add(self.bot.user.id)
+            # on_ready fires again after every gateway reconnect; the voice connection survives those.
+            in_voice = self.voice_client is not None and self.voice_client.is_connected()
             guild = self.bot.get_guild(self.settings.DISCORD_GUILD_ID)
-            if guild:
+            if guild and not in_voice:
                 channel = guild.get_channel(self.settings.DISCORD_VOICE_CHANNEL_ID)
                 if isinstance(channel, disnake.VoiceChannel):
                     await self.join_voice_channel(channel)
+            if self.state is not ServiceState.FAILED:
+                self.set_state(ServiceState.READY, None if self.voice_client else "logged in, not in a voice channel")
+
+        @self.bot.event
+        async def on_voice_state_update(member: disnake.Member, before: disnake.VoiceState, after: disnake.VoiceState):
+            self._update_ignored(member, after)
+
+    def _update_ignored(self, member: disnake.Member, voice: Optional[disnake.VoiceState]):
+        # Read by the voice-receive thread without a lock; single set add/discard is atomic.
+        muted = voice is not None and (voice.mute or voice.self_mute)
+        if member.bot or muted or member.id in self.settings.VOICE_IGNORED_USER_IDS:
+            self._ignored_users.add(member.id)
+        else:
+            self._ignored_users.discard(member.id)
 
     async def start(self):
         if self._running:
             return
         self._running = True
+        self.set_state(ServiceState.STARTING, "connecting to Discord")
+        # Login continues in the background; the service reports ready from on_ready.
         self._task = asyncio.create_task(self.bot.start(self.settings.DISCORD_BOT_TOKEN))
+        self._task.add_done_callback(self._on_bot_exit)
+
+    def _on_bot_exit(self, task: asyncio.Task):
+        if task.cancelled() or not self._running:
+            return
+        error = task.exception()
+        self.set_state(ServiceState.FAILED, f"bot stopped: {error}" if error else "bot stopped")
 
     async def stop(self):
         if not self._running:
             return
         self._running = False
+        self.playback.detach()
         if self.voice_client:
             self.voice_client.stop_listening()
             await self.voice_client.disconnect()
         if self._task:
             self._task.cancel()
         await self.bot.close()
+        self.set_state(ServiceState.STOPPED)
 
     async def join_voice_channel(self, channel: disnake.VoiceChannel):
         try:
             self.voice_client = await channel.connect(cls=voice_recv.VoiceRecvClient)
-            self.sink = AudioSink(self.event_bus)
+            self._loop = asyncio.get_running_loop()
+            self.playback.attach(self.voice_client)
+            for member in channel.members:
+                self._update_ignored(member, member.voice)
+            self.sink = AudioSink(self.event_bus, self.settings, self._on_utterance, self._on_partial,
+                                  ignored_users=self._ignored_users)
+            sink = self.sink
+            segmenter = sink.segmenter
+            SINK_SPEAKERS.set_function(lambda: segmenter.stats()["speakers"])
+            SINK_BUFFER_BYTES.set_function(lambda: segmenter.stats()["buffer_bytes_allocated"])
+            SINK_DROPPED_BYTES.set_function(lambda: segmenter.dropped_bytes)
+            SINK_OVERWRITTEN_BYTES.set_function(lambda: segmenter.overwritten_bytes)
+            SINK_EVICTED_SPEAKERS.set_function(lambda: segmenter.evicted_speakers)
+            SINK_SKIPPED_PACKETS.labels("ignored_user").set_function(lambda: sink.ignored_packets)
+            SINK_SKIPPED_PACKETS.labels("silence").set_function(lambda: sink.silence_packets)
+            if sink.opus:
+                SINK_OPUS_DECODE_ERRORS.set_function(lambda: segmenter.decode_errors)
             self.voice_client.listen(self.sink)
             await self.event_bus.publish(LogEvent(f"Connected to VC: {channel.name} and listening."))
         except Exception as e:
             logger.error(f"Error connecting to voice channel: {e}", exc_info=True)
+            self.set_state(ServiceState.FAILED, f"could not join voice channel: {e}")
 
-    async def handle_user_finished_speaking(self, user_id: int, username: str):
-        audio_buffer = self.sink.user_audio_data.get(user_id)
-        if not audio_buffer or audio_buffer.tell() == 0:
+    def _on_utterance(self, user_id: int, utterance_id: int, pcm: bytes, started_at: float, ended_at: float):
+        # Called on the segmenter thread as soon as a speaker stops.
+        asyncio.run_coroutine_threadsafe(
+            self.handle_user_finished_speaking(user_id, pcm, utterance_id, started_at, ended_at), self._loop)
+
+    def _on_partial(self, user_id: int, utterance_id: int, pcm: bytes, truncated: bool):
+        # Called on the segmenter thread at the partial cadence; skip if the last one is still decoding.
+        if utterance_id in self._partials_in_flight:
             return
+        asyncio.run_coroutine_threadsafe(
+            self.handle_partial_utterance(user_id, utterance_id, pcm, truncated), self._loop)
 
-        audio_buffer.seek(0)
-        wav_bytes = io.BytesIO()
-        with wave.open(wav_bytes, 'wb') as wf:
-            wf.setnchannels(2)
-            wf.setsampwidth(2)
-            wf.setframerate(48000)
-            wf.writeframes(audio_buffer.read())
+    def _display_name(self, user_id: int) -> str:
+        user = self.bot.get_user(user_id)
+        return user.display_name if user else str(user_id)
 
-        self.sink.user_audio_data[user_id] = io.BytesIO()
+    async def handle_partial_utterance(self, user_id: int, utterance_id: int, pcm: bytes, truncated: bool):
+        if utterance_id in self._partials_in_flight:
+            return
+        entry = self._partial_trackers.get(user_id)
+        if entry is not None and entry[0] > utterance_id:
+            return  # the speaker has moved on to a newer utterance
+        self._partials_in_flight.add(utterance_id)
+        if entry is None or entry[0] != utterance_id:
+            entry = self._partial_trackers[user_id] = (utterance_id, StablePrefixTracker())
+        tracker = entry[1]
+        try:
+            loop = asyncio.get_running_loop()
+            audio_data = await loop.run_in_executor(None, pcm_to_whisper, pcm)
+            future = loop.create_future()
+            await self.event_bus.publish(TranscriptionRequest(audio_data=audio_data, response_future=future, partial=True))
+            text = await asyncio.wait_for(future, timeout=5.0)
+            # The final result may have landed while this was decoding.
+            if text and self._partial_trackers.get(user_id) is entry:
+                stable, unstable = tracker.update(text, truncated)
+                await self.event_bus.publish(BroadcastPartialTranscriptionEvent(
+                    username=self._display_name(user_id), utterance_id=utterance_id, stable=stable, unstable=unstable))
+        except (ServiceOverloadedError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.warning(f"Partial transcription failed for {user_id}: {e}")
+        finally:
+            self._partials_in_flight.discard(utterance_id)
 
+    async def handle_user_finished_speaking(self, user_id: int, pcm: bytes, utterance_id: Optional[int] = None,
+                                            started_at: Optional[float] = None, ended_at: Optional[float] = None):
+        """Transcribe a finished utterance and broadcast it. `started_at`/`ended_at` are the
+        segmenter's time.monotonic() readings, used to trace the buffering stage."""
+        received_at = now()
+        entry = self._partial_trackers.get(user_id)
+        if entry is not None and entry[0] == utterance_id:
+            del self._partial_trackers[user_id]
+        if not pcm:
+            return
+        username = self._display_name(user_id)
+        # Latency is measured from the end of speech.
+        trace = TRACER.start("utterance", from_monotonic(ended_at) if ended_at is not None else received_at,
+                             user_id=user_id, utterance_id=utterance_id,
+                             audio_ms=len(pcm) * 1000 // (DISCORD_SAMPLE_RATE * DISCORD_CHANNELS * 2))
+        handed_off = False
+        if started_at is not None and ended_at is not None:
+            trace.add_span("sink.buffering", from_monotonic(started_at), from_monotonic(ended_at))
+            trace.add_span("sink.handoff", from_monotonic(ended_at), received_at)
         try:
-            wav_bytes.seek(0)
-            audio_data = wav_bytes.read()
+            # Downmix/resample straight from the utterance's PCM, off the event loop.
+            loop = asyncio.get_running_loop()
+            with trace.span("audio.assemble"):
+                audio_data = await loop.run_in_executor(None, pcm_to_whisper, pcm)
             future = asyncio.get_event_loop().create_future()
-            await self.event_bus.publish(TranscriptionRequest(audio_data=audio_data, response_future=future))
-            text = await asyncio.wait_for(future, timeout=60.0)
+            with trace.span("transcription.request"):
+                await self.event_bus.publish(TranscriptionRequest(audio_data=audio_data, response_future=future,
+                                                                  trace_id=trace.trace_id))
+                text = await asyncio.wait_for(future, timeout=60.0)
             if text:
-                await self.event_bus.publish(BroadcastTranscriptionEvent(username=username, text=text))
+                # The WebSocket fan-out closes this stage and finishes the trace once every client has it.
+                trace.mark("broadcast.published")
+                await self.event_bus.publish(BroadcastTranscriptionEvent(username=username, text=text,
+                                                                         utterance_id=utterance_id,
+                                                                         trace_id=trace.trace_id))
+                handed_off = True
+        except ServiceOverloadedError as e:
+            logger.warning(f"Dropped utterance from {username}: {e}")
         except Exception as e:
             logger.error(f"Failed to process audio for {username}: {e}", exc_info=True)
+        finally:
+            if not handed_off:
+                TRACER.finish(trace)
 
     async def handle_play_audio_request(self, event: PlayAudioInDiscordEvent):
         if not self.voice_client or not self.voice_client.is_connected():
             event.response_future.set_exception(Exception("Not connected to a voice channel."))
             return
         try:
-            if self.voice_client.is_playing():
-                self.voice_client.stop()
-            audio_source = io.BytesIO(event.audio_data)
-            source = disnake.FFmpegPCMAudio(audio_source, pipe=True)
-            self.voice_client.play(source)
+            await self.playback.play(event.audio_data, interrupt=event.interrupt, overlay=event.overlay)
             event.response_future.set_result(True)
         except Exception as e:
             event.response_future.set_exception(e)
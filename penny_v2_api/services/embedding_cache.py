@@ -0,0 +1,128 @@
+# ==============================================================================
+# penny_v2_api/services/embedding_cache.py
+# SQLite-backed embedding cache and a caching wrapper for Chroma embedding
+# functions, so repeated texts are embedded once.
+# ==============================================================================
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from penny_v2_api.core.metrics import Counter, Gauge
+
+logger_embedding_cache = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = Counter("penny_embedding_cache_lookups_total", "Embedding cache lookups by outcome.", ["outcome"])
+CACHE_ENTRIES = Gauge("penny_embedding_cache_entries", "Embeddings held in the on-disk cache.")
+
+class EmbeddingCache:
+    """Content-hash keyed embedding store with least-recently-used eviction.
+
+    Keys hash the embedding model id together with the text, so switching models never
+    serves stale vectors. Vectors are stored as float32 blobs.
+    """
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                           "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        CACHE_ENTRIES.set_function(lambda: self._count)
+
+    @staticmethod
+    def make_key(model_id: str, text: str) -> str:
+        return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit.
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()])
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                # Trim to 90% so eviction isn't paid on every insert.
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute("DELETE FROM embeddings WHERE key IN "
+                                   "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                self._count -= excess
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """Wraps a Chroma embedding function; only texts missing from the cache reach it, in one call."""
+    def __init__(self, inner: EmbeddingFunction, cache: EmbeddingCache, model_id: str):
+        self.inner = inner
+        self.cache = cache
+        self.model_id = model_id
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self.cache.make_key(self.model_id, text) for text in input]
+        found = self.cache.get_many(keys)
+        missing: List[int] = []
+        pending = set()
+        for i, key in enumerate(keys):
+            # Only embed the first occurrence of a repeated text.
+            if key not in found and key not in pending:
+                pending.add(key)
+                missing.append(i)
+        CACHE_LOOKUPS.labels("hit").inc(len(keys) - len(missing))
+        CACHE_LOOKUPS.labels("miss").inc(len(missing))
+        if missing:
+            computed = self.inner([input[i] for i in missing])
+            fresh = {keys[i]: np.asarray(vector, dtype=np.float32) for i, vector in zip(missing, computed)}
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        # Plain lists: older Chroma releases reject ndarray embeddings.
+        return [found[key].tolist() for key in keys]
+
+def build_embedding_function(backend: str, model: Optional[str] = None, openai_api_key: Optional[str] = None):
+    """Returns (embedding function, model id). Heavy imports and model loads happen here."""
+    from chromadb.utils import embedding_functions
+    if backend == "auto":
+        backend = "openai" if openai_api_key else "default"
+    if backend == "openai":
+        model = model or "text-embedding-ada-002"
+        return embedding_functions.OpenAIEmbeddingFunction(api_key=openai_api_key, model_name=model), f"openai:{model}"
+    if backend == "sentence_transformers":
+        model = model or "all-MiniLM-L6-v2"
+        fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model, device="cpu")
+        return fn, f"sentence_transformers:{model}"
+    if backend == "default":
+        # Chroma's bundled ONNX all-MiniLM-L6-v2, runs on CPU.
+        return embedding_functions.DefaultEmbeddingFunction(), "onnx:all-MiniLM-L6-v2"
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}")
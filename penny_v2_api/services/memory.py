@@ -1,73 +1,260 @@
 import asyncio
+import logging
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
 import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
 from penny_v2_api.config import AppConfig
 from penny_v2_api.core.event_bus import EventBus
-from penny_v2_api.core.events import AddMemoryRequest, QueryMemoryRequest, DeleteMemoryRequest
+from penny_v2_api.core.events import (
+    AddMemoryRequest,
+    QueryMemoryRequest,
+    DeleteMemoryRequest,
+    BulkAddMemoryRequest,
+    BulkQueryMemoryRequest,
+    BulkDeleteMemoryRequest,
+    BroadcastTranscriptionEvent,
+)
+from penny_v2_api.core.lifecycle import ServiceState, ServiceStatus
+from penny_v2_api.core.metrics import Gauge, Histogram
+from penny_v2_api.services.embedding_cache import CachedEmbeddingFunction, EmbeddingCache, build_embedding_function
 
-class MemoryService:
-    def __init__(self, event_bus: EventBus, settings: AppConfig):
+logger_memory = logging.getLogger(__name__)
+
+OPERATION_SECONDS = Histogram("penny_memory_operation_seconds", "Chroma call time, including embedding.", ["op"])
+EXECUTOR_WAIT_SECONDS = Histogram("penny_memory_executor_wait_seconds",
+                                  "Time an operation waits for the Chroma thread.", ["op"])
+FLUSH_BATCH_SIZE = Histogram("penny_memory_flush_batch_size", "Memories written per write-behind flush.",
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+PENDING_WRITES = Gauge("penny_memory_pending_writes", "Memories buffered for the next flush.")
+
+# (id, text, metadata, future)
+_PendingAdd = Tuple[str, str, dict, asyncio.Future]
+
+class MemoryService(ServiceStatus):
+    """Chroma-backed memory store.
+
+    Chroma calls (and the embedding work they do) run on a single dedicated thread, which also
+    keeps them ordered. Adds are buffered and written as one `collection.add` per flush, every
+    MEMORY_FLUSH_INTERVAL_S or as soon as MEMORY_BATCH_SIZE are waiting; an add's future resolves
+    once its batch is written. Queries and deletes flush first, so they see every earlier add.
+    """
+    def __init__(self, event_bus: EventBus, settings: AppConfig,
+                 embedding_factory: Optional[Callable[[], Tuple[object, str]]] = None):
         self.event_bus = event_bus
         self.settings = settings
+        # Returns (embedding function, model id); defaults to EMBEDDING_BACKEND (benchmarks pass stubs).
+        self.embedding_factory = embedding_factory or (lambda: build_embedding_function(
+            settings.EMBEDDING_BACKEND, settings.EMBEDDING_MODEL, settings.OPENAI_API_KEY))
         self.client = None
         self.collection = None
+        self.embedding_cache: Optional[EmbeddingCache] = None
+        self._embed = None  # uncached embedding function, for warm-up
+        self._executor: ThreadPoolExecutor = None
+        self._pending: List[_PendingAdd] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_wanted = asyncio.Event()
+        self._flush_task: asyncio.Task = None
+        self._stopping = False
+        PENDING_WRITES.set_function(lambda: len(self._pending))
 
     async def start(self):
-        persist_dir = getattr(self.settings, "CHROMA_DB_DIR", "./chroma_memory")
-        self.client = chromadb.Client(Settings(persist_directory=persist_dir))
+        self.set_state(ServiceState.STARTING)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+        # Opening an existing store reuses its index; loading the embedding model can take a while.
+        try:
+            self.collection = await self._run("open", self._open_collection)
+        except Exception as e:
+            self.set_state(ServiceState.FAILED, f"could not open memory store: {e}")
+            raise
+        if self.settings.WARMUP_MODELS and self._embed is not None:
+            self.set_state(ServiceState.WARMING_UP)
+            try:
+                await self._run("warmup", lambda: self._embed(["warm up"]))
+            except Exception as e:
+                logger_memory.warning(f"Embedding warm-up failed: {e}")
+        self._stopping = False
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="memory-flush")
+
+        self.event_bus.subscribe_async(AddMemoryRequest, self.handle_add_memory)
+        self.event_bus.subscribe_async(QueryMemoryRequest, self.handle_query_memory)
+        self.event_bus.subscribe_async(DeleteMemoryRequest, self.handle_delete_memory)
+        self.event_bus.subscribe_async(BulkAddMemoryRequest, self.handle_bulk_add_memory)
+        self.event_bus.subscribe_async(BulkQueryMemoryRequest, self.handle_bulk_query_memory)
+        self.event_bus.subscribe_async(BulkDeleteMemoryRequest, self.handle_bulk_delete_memory)
+        if self.settings.MEMORY_STORE_TRANSCRIPTS:
+            self.event_bus.subscribe_queued(BroadcastTranscriptionEvent, self.handle_transcription, maxsize=1000)
+        self.set_state(ServiceState.READY)
 
-        embedding_fn = None
-        if getattr(self.settings, "OPENAI_API_KEY", None):
-            embedding_fn = embedding_functions.OpenAIEmbeddingFunction(
-                api_key=self.settings.OPENAI_API_KEY,
-                model_name="text-embedding-ada-002"
-            )
+    async def stop(self):
+        if self._flush_task:
+            # Not cancelled: that could abandon a batch mid-write with its futures unresolved.
+            self._stopping = True
+            self._flush_wanted.set()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self.collection is not None:
+            await self.flush()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        if self.embedding_cache:
+            self.embedding_cache.close()
+        self.set_state(ServiceState.STOPPED)
 
-        self.collection = self.client.get_or_create_collection(
+    def _open_collection(self):
+        if self.settings.MEMORY_PERSISTENT:
+            self.client = chromadb.PersistentClient(path=self.settings.CHROMA_DB_DIR)
+        else:
+            self.client = chromadb.EphemeralClient()
+
+        embedding_fn, model_id = self.embedding_factory()
+        # Warming a remote API only costs money.
+        self._embed = None if model_id.startswith("openai:") else embedding_fn
+        if self.settings.EMBEDDING_CACHE_MAX_ENTRIES > 0:
+            self.embedding_cache = EmbeddingCache(self.settings.EMBEDDING_CACHE_PATH,
+                                                  self.settings.EMBEDDING_CACHE_MAX_ENTRIES)
+            embedding_fn = CachedEmbeddingFunction(embedding_fn, self.embedding_cache, model_id)
+        logger_memory.info(f"Memory store: {'persistent' if self.settings.MEMORY_PERSISTENT else 'in-memory'}, "
+                           f"embeddings: {model_id}")
+
+        return self.client.get_or_create_collection(
             name="penny_memory",
             embedding_function=embedding_fn
         )
 
-        self.event_bus.subscribe_async(AddMemoryRequest, self.handle_add_memory)
-        self.event_bus.subscribe_async(QueryMemoryRequest, self.handle_query_memory)
-        self.event_bus.subscribe_async(DeleteMemoryRequest, self.handle_delete_memory)
+    async def _run(self, op: str, fn):
+        submitted_at = time.perf_counter()
+
+        def timed():
+            start = time.perf_counter()
+            EXECUTOR_WAIT_SECONDS.labels(op).observe(start - submitted_at)
+            try:
+                return fn()
+            finally:
+                OPERATION_SECONDS.labels(op).observe(time.perf_counter() - start)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+
+    # --- write-behind buffer ---------------------------------------------------
+
+    def _enqueue_add(self, text: str, metadata: Optional[dict]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Chroma rejects empty metadata dicts, and a timestamp is useful for recall anyway.
+        metadata = dict(metadata or {})
+        metadata.setdefault("added_at", time.time())
+        self._pending.append((str(uuid.uuid4()), text, metadata, future))
+        if len(self._pending) >= self.settings.MEMORY_BATCH_SIZE:
+            self._flush_wanted.set()
+        return future
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_wanted.wait(), self.settings.MEMORY_FLUSH_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wanted.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered add in one batch."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.settings.MEMORY_BATCH_SIZE]
+                del self._pending[:len(batch)]
+                ids = [item[0] for item in batch]
+                FLUSH_BATCH_SIZE.observe(len(batch))
+                try:
+                    await self._run("add", lambda: self.collection.add(
+                        documents=[item[1] for item in batch],
+                        metadatas=[item[2] for item in batch],
+                        ids=ids))
+                except Exception as ex:
+                    logger_memory.error(f"Failed to write {len(batch)} memories: {ex}")
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(ex)
+                    continue
+                for mem_id, _, _, future in batch:
+                    if not future.done():
+                        future.set_result(mem_id)
+
+    # --- handlers --------------------------------------------------------------
 
     async def handle_add_memory(self, event: AddMemoryRequest):
+        _chain(self._enqueue_add(event.text, event.metadata), event.response_future)
+
+    async def handle_bulk_add_memory(self, event: BulkAddMemoryRequest):
+        futures = [self._enqueue_add(item["text"], item.get("metadata")) for item in event.items]
+        _chain(asyncio.gather(*futures), event.response_future)
+
+    async def handle_transcription(self, event: BroadcastTranscriptionEvent):
+        future = self._enqueue_add(event.text, {"type": "transcript", "username": event.username})
+        # Fire and forget; failures are already logged by flush().
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def handle_query_memory(self, event: QueryMemoryRequest):
         try:
-            text = event.text
-            metadata = event.metadata or {}
-            mem_id = str(uuid.uuid4())
-            self.collection.add(documents=[text], metadatas=[metadata], ids=[mem_id])
-            event.response_future.set_result(mem_id)
+            results = await self._query([event.query_text], event.n_results)
+            event.response_future.set_result(results[0])
         except Exception as ex:
             event.response_future.set_exception(ex)
 
-    async def handle_query_memory(self, event: QueryMemoryRequest):
+    async def handle_bulk_query_memory(self, event: BulkQueryMemoryRequest):
         try:
-            results = self.collection.query(
-                query_texts=[event.query_text],
-                n_results=event.n_results,
-                include=["documents", "metadatas", "distances", "ids"]
-            )
-            memories = []
-            if results.get("ids"):
-                for idx, mem_id in enumerate(results["ids"][0]):
-                    memory_entry = {
-                        "id": mem_id,
-                        "text": results["documents"][0][idx] if results.get("documents") else None,
-                        "metadata": results["metadatas"][0][idx] if results.get("metadatas") else None,
-                        "distance": results["distances"][0][idx] if results.get("distances") else None
-                    }
-                    memories.append(memory_entry)
-            event.response_future.set_result(memories)
+            event.response_future.set_result(await self._query(event.query_texts, event.n_results))
         except Exception as ex:
             event.response_future.set_exception(ex)
 
+    async def _query(self, query_texts: List[str], n_results: int) -> List[List[dict]]:
+        await self.flush()
+        # ids are always returned; Chroma rejects them in `include`.
+        results = await self._run("query", lambda: self.collection.query(
+            query_texts=query_texts,
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"]
+        ))
+        all_memories = []
+        for q, ids in enumerate(results.get("ids") or []):
+            memories = []
+            for idx, mem_id in enumerate(ids):
+                memory_entry = {
+                    "id": mem_id,
+                    "text": results["documents"][q][idx] if results.get("documents") else None,
+                    "metadata": results["metadatas"][q][idx] if results.get("metadatas") else None,
+                    "distance": results["distances"][q][idx] if results.get("distances") else None
+                }
+                memories.append(memory_entry)
+            all_memories.append(memories)
+        return all_memories
+
     async def handle_delete_memory(self, event: DeleteMemoryRequest):
         try:
-            self.collection.delete(ids=[event.memory_id])
+            await self._delete([event.memory_id])
             event.response_future.set_result(True)
         except Exception as ex:
             event.response_future.set_exception(ex)
+
+    async def handle_bulk_delete_memory(self, event: BulkDeleteMemoryRequest):
+        try:
+            await self._delete(event.memory_ids)
+            event.response_future.set_result(len(event.memory_ids))
+        except Exception as ex:
+            event.response_future.set_exception(ex)
+
+    async def _delete(self, memory_ids: List[str]):
+        await self.flush()
+        await self._run("delete", lambda: self.collection.delete(ids=memory_ids))
+
+def _chain(source: asyncio.Future, target: asyncio.Future):
+    """Resolve `target` with the outcome of `source`."""
+    def copy(done: asyncio.Future):
+        if target.done():
+            return
+        if done.cancelled():
+            target.cancel()
+        elif done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
@@ -1,67 +1,373 @@
 import logging
 import asyncio
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional
 import torch
 from audiocraft.models import MusicGen
-from audiocraft.data.audio import audio_write
 from penny_v2_api.config import settings
+from penny_v2_api.core.audio import float_to_pcm16, wav_header
 from penny_v2_api.core.event_bus import EventBus
-from penny_v2_api.core.events import MusicGenerationRequest, LogEvent
+from penny_v2_api.core.events import (
+    MusicGenerationRequest,
+    MusicJobLookupRequest,
+    MusicJobProgressEvent,
+    MusicJobSubmitRequest,
+    LogEvent,
+    PlayAudioInDiscordEvent,
+)
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.lifecycle import ServiceState, ServiceStatus
+from penny_v2_api.core.metrics import Gauge, Histogram
+from penny_v2_api.services.music_cache import MusicResultCache
 
 logger_music = logging.getLogger(__name__)
 
-class MusicGenerationService:
-    def __init__(self, event_bus: EventBus):
+GENERATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+IN_FLIGHT = Gauge("penny_music_requests_in_flight", "Music generation jobs being generated.")
+STREAM_CHUNK_SIZE = 256 * 1024
+
+QUEUE_DEPTH = Gauge("penny_music_queue_depth", "Music generation jobs waiting for the model.")
+EXECUTOR_WAIT_SECONDS = Histogram("penny_music_executor_wait_seconds", "Time a segment waits for the model thread.")
+INFERENCE_SECONDS = Histogram("penny_music_inference_seconds", "MusicGen time per generated segment.", buckets=GENERATION_BUCKETS)
+
+class MusicJob:
+    """One MusicGen run. Audio is kept as 16-bit PCM segments so it can be streamed while it is generated;
+    once the result file is written the segments are released and streams read the file instead."""
+    def __init__(self, prompt: str, duration: float, params: Optional[dict], play_in_discord: bool, segment_s: float):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.duration = duration
+        self.params = params or {}
+        self.play_in_discord = play_in_discord
+        self.key = MusicResultCache.make_key(settings.MUSIC_MODEL_SIZE, prompt, duration, params,
+                                             segment_s, settings.MUSIC_CONTEXT_S)
+        self.status = "queued"  # queued | running | done | failed
+        self.segment_s = segment_s
+        self.segments_total = max(1, math.ceil(duration / segment_s))
+        self.segments: Optional[List[bytes]] = []
+        self.segments_done = 0
+        self.sample_rate: Optional[int] = None
+        self.channels: Optional[int] = None
+        self.error: Optional[str] = None
+        self.result_path: Optional[Path] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.reserved = False  # holds one of the service's queue slots until it is queued or resolved
+        loop = asyncio.get_running_loop()
+        self.generated: asyncio.Future = loop.create_future()  # all segments available
+        self.finished: asyncio.Future = loop.create_future()   # result file in the cache
+        self._changed = asyncio.Event()
+
+    def add_segment(self, pcm: bytes):
+        self.segments.append(pcm)
+        self.segments_done += 1
+        self._notify()
+
+    def complete(self, path: Path):
+        self.status = "done"
+        self.result_path = path
+        self.finished_at = time.time()
+        self.segments_done = self.segments_total
+        self.segments = None  # streams still iterating keep their own reference
+        for future in (self.generated, self.finished):
+            if not future.done():
+                future.set_result(path)
+        self._notify()
+
+    def fail(self, exc: BaseException):
+        self.status = "failed"
+        self.error = str(exc) or type(exc).__name__
+        self.finished_at = time.time()
+        self.segments = None
+        for future in (self.generated, self.finished):
+            if not future.done():
+                future.set_exception(exc)
+                # Job API callers poll instead of awaiting; don't warn about unretrieved errors.
+                future.exception()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def wav_stream(self) -> AsyncIterator[bytes]:
+        """The job's audio as one WAV: segments as they are generated, or the result file once it
+        exists. Ends early (possibly empty) if the job fails."""
+        # Taken now: complete() may release the list before the stream is first iterated.
+        return self._stream_wav(self.segments)
+
+    async def _stream_wav(self, segments: Optional[List[bytes]]) -> AsyncIterator[bytes]:
+        sent = 0
+        while segments is not None:
+            while sent < len(segments):
+                if not sent:
+                    yield wav_header(self.sample_rate, self.channels)
+                yield segments[sent]
+                sent += 1
+            if self.generated.done():
+                break
+            await self._changed.wait()
+        if not sent and self.result_path is not None:
+            # Cache hit, coalesced with an identical job, or already done: nothing to stream from memory.
+            loop = asyncio.get_running_loop()
+            with open(self.result_path, "rb") as file:
+                while chunk := await loop.run_in_executor(None, file.read, STREAM_CHUNK_SIZE):
+                    yield chunk
+
+    def to_dict(self) -> dict:
+        return {"job_id": self.id, "status": self.status, "prompt": self.prompt, "duration": self.duration,
+                "params": self.params, "segments_done": self.segments_done, "segments_total": self.segments_total,
+                "error": self.error, "created_at": self.created_at, "finished_at": self.finished_at}
+
+class MusicGenerationService(ServiceStatus):
+    """Runs MusicGen jobs one at a time.
+
+    Every generation, including the synchronous /generate_music/ path, goes through a single
+    worker and a single model thread, so per-job `set_generation_params` calls can't race.
+    Long jobs are produced as continuation segments that can be streamed and played as they land.
+    """
+    def __init__(self, event_bus: EventBus, model_factory: Optional[Callable[[], MusicGen]] = None):
         self.event_bus = event_bus
+        # Builds the model on the model thread; defaults to MusicGen from settings (benchmarks pass stubs).
+        self.model_factory = model_factory or self._build_model
         self.model = None
         self._running = False
+        self.cache: MusicResultCache = None
+        self.jobs: Dict[str, MusicJob] = {}
+        self._queue: asyncio.Queue = None
+        # Queue slots promised by submit() to jobs whose _persist task has not queued them yet.
+        self._reserved = 0
+        self._worker: asyncio.Task = None
+        self._executor: ThreadPoolExecutor = None
+        QUEUE_DEPTH.set_function(lambda: self._queue.qsize() if self._queue else 0)
 
     async def start(self):
         if self._running:
             return
+        self.set_state(ServiceState.STARTING)
+        self.cache = MusicResultCache(settings.MUSIC_CACHE_DIR,
+                                      max_bytes=settings.MUSIC_CACHE_MAX_MB * 1024 * 1024,
+                                      max_entries=settings.MUSIC_CACHE_MAX_ENTRIES)
+        self._queue = asyncio.Queue(maxsize=settings.MUSIC_JOB_QUEUE_SIZE)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="musicgen")
         self.event_bus.subscribe_async(MusicGenerationRequest, self.handle_music_request)
+        self.event_bus.subscribe_async(MusicJobSubmitRequest, self.handle_job_submit)
+        self.event_bus.subscribe_async(MusicJobLookupRequest, self.handle_job_lookup)
         await self._load_model()
+        if self.model and settings.WARMUP_MODELS:
+            await self._warm_up()
+        self._worker = asyncio.create_task(self._run_worker(), name="musicgen-worker")
         self._running = True
+        if self.model:
+            self.set_state(ServiceState.READY)
 
     async def stop(self):
         self._running = False
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for job in self.jobs.values():
+            if not job.generated.done():
+                job.fail(Exception("Music service stopped."))
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
         self.model = None
+        self.set_state(ServiceState.STOPPED)
 
     async def _load_model(self):
         try:
-            self.model = MusicGen.get_pretrained(settings.MUSIC_MODEL_SIZE)
-            self.model.set_generation_params(duration=30)
-
-            if settings.MUSIC_GEN_DEVICE == "cuda" and torch.cuda.is_available():
-                logger_music.info(f"Moving MusicGen model to CUDA with float16 on {torch.cuda.get_device_name(0)}")
-                self.model.lm = self.model.lm.cuda().half()
-                self.model.compression_model = self.model.compression_model.cuda().half()
-            else:
-                logger_music.warning("CUDA not available or disabled — using CPU (will be slow).")
-
+            loop = asyncio.get_running_loop()
+            self.model = await loop.run_in_executor(self._executor, self.model_factory)
             await self.event_bus.publish(LogEvent(f"MusicGen model '{settings.MUSIC_MODEL_SIZE}' loaded."))
         except Exception as e:
             logger_music.error(f"Fatal: Could not load MusicGen model. {e}", exc_info=True)
+            self.set_state(ServiceState.FAILED, f"model load failed: {e}")
+
+    @staticmethod
+    def _build_model() -> MusicGen:
+        model = MusicGen.get_pretrained(settings.MUSIC_MODEL_SIZE)
+        model.set_generation_params(duration=30)
+
+        if settings.MUSIC_GEN_DEVICE == "cuda" and torch.cuda.is_available():
+            logger_music.info(f"Moving MusicGen model to CUDA with float16 on {torch.cuda.get_device_name(0)}")
+            model.lm = model.lm.cuda().half()
+            model.compression_model = model.compression_model.cuda().half()
+        else:
+            logger_music.warning("CUDA not available or disabled — using CPU (will be slow).")
+        return model
+
+    async def _warm_up(self):
+        """Generate a moment of audio so the first job doesn't pay for CUDA kernel setup."""
+        self.set_state(ServiceState.WARMING_UP)
+        started = time.perf_counter()
+
+        def generate():
+            self.model.set_generation_params(duration=1)
+            self.model.generate(["warm up"])
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, generate)
+            logger_music.info(f"MusicGen warm-up took {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger_music.warning(f"MusicGen warm-up failed: {e}")
+
+    def submit(self, prompt: str, duration: float, params: Optional[dict] = None,
+               play_in_discord: bool = False) -> MusicJob:
+        if self._queue is None:
+            raise ServiceOverloadedError("music", retry_after=max(settings.MUSIC_SEGMENT_S, 1.0))
+        if not 0 < duration <= settings.MUSIC_MAX_DURATION_S:
+            # The API validates this too; events can also arrive from other nodes.
+            raise ValueError(f"duration must be between 0 and {settings.MUSIC_MAX_DURATION_S} seconds")
+        job = MusicJob(prompt, duration, params, play_in_discord, settings.MUSIC_SEGMENT_S)
+        # Cached or already generating takes need no model time, so they are served even when full.
+        if self.cache.get(job.key) is None and not self.cache.generating(job.key):
+            # Reserved now, not when _persist queues the job: a burst in one tick must not overbook.
+            if self._queue.qsize() + self._reserved >= self._queue.maxsize:
+                raise ServiceOverloadedError("music", retry_after=max(settings.MUSIC_SEGMENT_S, 1.0))
+            self._reserved += 1
+            job.reserved = True
+        self._prune_jobs()
+        self.jobs[job.id] = job
+        asyncio.create_task(self._persist(job), name=f"music-job:{job.id}")
+        return job
 
     async def handle_music_request(self, event: MusicGenerationRequest):
-        if not self.model:
-            event.response_future.set_exception(Exception("MusicGen model not available."))
-            return
         try:
-            self.model.set_generation_params(duration=event.duration)
+            job = self.submit(event.prompt, event.duration, event.params)
+            event.response_future.set_result(str(await asyncio.shield(job.finished)))
+        except Exception as e:
+            event.response_future.set_exception(e)
 
-            # Use executor to run sync model generation without blocking event loop
-            loop = asyncio.get_running_loop()
-            wav = await loop.run_in_executor(None, self.model.generate, [event.prompt])
-
-            file_path = f"temp_music_{torch.randint(10000, (1,)).item()}.wav"
-            audio_write(
-                file_path,
-                wav.cpu().squeeze(0),
-                self.model.sample_rate,
-                strategy="loudness",
-                loudness_compressor=True
-            )
-
-            event.response_future.set_result(file_path)
+    async def handle_job_submit(self, event: MusicJobSubmitRequest):
+        try:
+            job = self.submit(event.prompt, event.duration, event.params, event.play_in_discord)
+            event.response_future.set_result(job)
         except Exception as e:
             event.response_future.set_exception(e)
+
+    async def handle_job_lookup(self, event: MusicJobLookupRequest):
+        event.response_future.set_result(self.jobs.get(event.job_id))
+
+    def _prune_jobs(self):
+        cutoff = time.time() - settings.MUSIC_JOB_RETENTION_S
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+        # Past the cap, forget the oldest finished jobs (the dict is in submission order).
+        excess = len(self.jobs) - settings.MUSIC_JOB_MAX_RETAINED + 1
+        if excess > 0:
+            for job_id in [j.id for j in self.jobs.values() if j.finished_at][:excess]:
+                del self.jobs[job_id]
+
+    async def _persist(self, job: MusicJob):
+        """Resolve a job through the cache: generate on a miss, otherwise serve the stored take."""
+        try:
+            # A cache hit or a job coalesced with an identical one completes without segments.
+            path = await self.cache.get_or_create(job.key, lambda stem: self._produce(job, stem))
+            job.complete(path)
+        except Exception as e:
+            logger_music.error(f"Music job {job.id} failed: {e}")
+            job.fail(e)
+        finally:
+            self._release_slot(job)
+        await self._publish_progress(job)
+
+    def _release_slot(self, job: MusicJob):
+        if job.reserved:
+            job.reserved = False
+            self._reserved -= 1
+
+    async def _produce(self, job: MusicJob, stem: Path) -> Path:
+        if job.reserved:
+            self._release_slot(job)  # the slot becomes the queue entry
+        elif self._queue.qsize() + self._reserved >= self._queue.maxsize:
+            # Was a cache hit at submit, but the file has been evicted since.
+            raise ServiceOverloadedError("music", retry_after=max(settings.MUSIC_SEGMENT_S, 1.0))
+        self._queue.put_nowait(job)
+        await self._publish_progress(job)
+        await job.generated
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._write_result, job.segments, job.sample_rate, job.channels, stem)
+
+    async def _run_worker(self):
+        while True:
+            job = await self._queue.get()
+            IN_FLIGHT.inc()
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                job.fail(e)
+            finally:
+                IN_FLIGHT.dec()
+                self._queue.task_done()
+
+    async def _run_job(self, job: MusicJob):
+        if not self.model:
+            raise Exception("MusicGen model not available.")
+        job.status = "running"
+        job.sample_rate = self.model.sample_rate
+        await self._publish_progress(job)
+        loop = asyncio.get_running_loop()
+        takes: List[torch.Tensor] = []
+        context = None
+        for index in range(job.segments_total):
+            seconds = min(job.segment_s, job.duration - index * job.segment_s)
+            wav = await loop.run_in_executor(self._executor, self._generate_segment, job, seconds, context,
+                                             time.perf_counter())
+            takes.append(wav)
+            job.channels = wav.shape[0]
+            # Condition the next segment on the tail of everything generated so far.
+            context_samples = int(settings.MUSIC_CONTEXT_S * job.sample_rate)
+            context = torch.cat(takes, dim=-1)[:, -context_samples:] if context_samples > 0 else None
+            pcm = float_to_pcm16(wav.numpy().T)
+            job.add_segment(pcm)
+            if job.play_in_discord:
+                await self._play_segment(job, pcm)
+            await self._publish_progress(job)
+        if not job.generated.done():
+            job.generated.set_result(None)
+
+    def _generate_segment(self, job: MusicJob, seconds: float, context: Optional[torch.Tensor],
+                          submitted_at: float) -> torch.Tensor:
+        start = time.perf_counter()
+        EXECUTOR_WAIT_SECONDS.observe(start - submitted_at)
+        with INFERENCE_SECONDS.time():
+            if context is None:
+                self.model.set_generation_params(duration=seconds, **job.params)
+                wav = self.model.generate([job.prompt])
+            else:
+                # generate_continuation returns the prompt followed by the new audio.
+                self.model.set_generation_params(duration=context.shape[-1] / job.sample_rate + seconds, **job.params)
+                dtype = next(self.model.compression_model.parameters()).dtype
+                wav = self.model.generate_continuation(context[None].to(self.model.device, dtype),
+                                                       job.sample_rate, [job.prompt])
+                wav = wav[..., context.shape[-1]:]
+        return wav[0].float().cpu()
+
+    def _write_result(self, segments: List[bytes], sample_rate: int, channels: int, stem: Path) -> Path:
+        # Exactly the PCM that was streamed and played, so every route serves the same audio
+        # (loudness normalisation needs the whole take, which a live stream never has).
+        path = stem.with_name(f"{stem.name}.wav")
+        with open(path, "wb") as file:
+            file.write(wav_header(sample_rate, channels, data_size=sum(len(pcm) for pcm in segments)))
+            for pcm in segments:
+                file.write(pcm)
+        return path
+
+    async def _play_segment(self, job: MusicJob, pcm: bytes):
+        future = asyncio.get_running_loop().create_future()
+        audio = wav_header(job.sample_rate, job.channels, data_size=len(pcm)) + pcm
+        await self.event_bus.publish(PlayAudioInDiscordEvent(audio_data=audio, response_future=future))
+        try:
+            await future
+        except Exception as e:
+            logger_music.warning(f"Could not play segment of music job {job.id} in Discord: {e}")
+
+    async def _publish_progress(self, job: MusicJob):
+        await self.event_bus.publish(MusicJobProgressEvent(job_id=job.id, status=job.status,
+                                                           segments_done=job.segments_done,
+                                                           segments_total=job.segments_total, error=job.error))
@@ -0,0 +1,159 @@
+# ==============================================================================
+# penny_v2_api/services/music_cache.py
+# Content-addressed on-disk cache for generated music.
+# ==============================================================================
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+from penny_v2_api.core.metrics import Counter, Gauge
+
+logger_music_cache = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter("penny_music_cache_requests_total", "Music cache lookups by outcome.", ["outcome"])
+CACHE_BYTES = Gauge("penny_music_cache_bytes", "Bytes of generated music held in the cache.")
+CACHE_SUFFIX = ".wav"
+
+class MusicResultCache:
+    """LRU cache of rendered WAV files, keyed by a hash of everything that shapes the output.
+
+    Entries are `<key>.wav` files in `directory`; recency is the file mtime, so the index
+    survives restarts. Concurrent misses for the same key share a single generation.
+
+    An evicted file leaves the index at once but stays on disk for `unlink_delay_s`: a path handed
+    out just before (to a FileResponse, a stream or the event bridge) is opened by its reader a
+    moment later, and once open it survives the unlink.
+    """
+    def __init__(self, directory: str, max_bytes: int, max_entries: int, unlink_delay_s: float = 60.0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.unlink_delay_s = unlink_delay_s
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total_bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._unlinking: Dict[str, asyncio.TimerHandle] = {}  # evicted key -> pending unlink
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+        CACHE_BYTES.set_function(lambda: self._total_bytes)
+
+    @staticmethod
+    def make_key(model: str, prompt: str, duration: float, params: Optional[dict] = None,
+                 segment_s: float = 0.0, context_s: float = 0.0) -> str:
+        """`segment_s` / `context_s` are the continuation settings: changing them changes longer takes."""
+        material = json.dumps([model, prompt, float(duration), params or {}, float(segment_s), float(context_s)],
+                              sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, key: str) -> Optional[Path]:
+        if key not in self._entries:
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    def generating(self, key: str) -> bool:
+        """Whether a miss for `key` is being produced right now (a new request would coalesce)."""
+        return key in self._in_flight
+
+    async def get_or_create(self, key: str, produce: Callable[[Path], Awaitable[Path]]) -> Path:
+        """Return the cached file for `key`, running `produce(stem)` once on a miss.
+
+        `produce` must write the audio somewhere under the given stem and return that path;
+        the file is moved into place atomically once complete.
+        """
+        path = self.get(key)
+        if path is not None:
+            CACHE_REQUESTS.labels("hit").inc()
+            return path
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            CACHE_REQUESTS.labels("coalesced").inc()
+            return await asyncio.shield(pending)
+        CACHE_REQUESTS.labels("miss").inc()
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            produced = await produce(self.directory / f".{key}.{uuid.uuid4().hex}.tmp")
+            path = self.path_for(key)
+            os.replace(produced, path)
+            self._add(key, path.stat().st_size)
+            future.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't warn about an unretrieved exception.
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def _load_index(self):
+        # Temp files from generations interrupted by a restart.
+        for leftover in self.directory.glob(".*.tmp*"):
+            leftover.unlink(missing_ok=True)
+        files = []
+        for path in self.directory.glob(f"*{CACHE_SUFFIX}"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _add(self, key: str, size: int):
+        # The file now at the path is the new one; an unlink still pending for the old one must not hit it.
+        pending = self._unlinking.pop(key, None)
+        if pending is not None:
+            pending.cancel()
+        self._forget(key)
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        # Never evict the newest entry: it is about to be served.
+        while len(self._entries) > 1 and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            key = next(iter(self._entries))
+            self._forget(key)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None  # loading the index: nothing has been handed out yet
+            if loop is None or self.unlink_delay_s <= 0:
+                self._unlink(key)
+            elif key not in self._unlinking:
+                self._unlinking[key] = loop.call_later(self.unlink_delay_s, self._unlink, key)
+
+    def _unlink(self, key: str):
+        self._unlinking.pop(key, None)
+        try:
+            self.path_for(key).unlink(missing_ok=True)
+        except OSError as e:
+            logger_music_cache.warning(f"Could not evict cached music {key}: {e}")
@@ -0,0 +1,206 @@
+# ==============================================================================
+# penny_v2_api/services/opus_receive.py
+# Compressed voice receive: endpointing on raw Opus packets, buffering them
+# compressed, and decoding finished utterances in batches on a thread pool.
+# ==============================================================================
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from disnake import opus
+from penny_v2_api.core.metrics import Histogram
+from penny_v2_api.services.voice_activity import UtteranceCallback, UtteranceSegmenter
+
+logger = logging.getLogger(__name__)
+
+# Discord's end-of-speech comfort-noise frame (b"\xf8\xff\xfe") and empty DTX frames carry no audio.
+OPUS_SILENCE_MAX_BYTES = 3
+
+OPUS_DECODE_SECONDS = Histogram("penny_voice_opus_decode_seconds", "Time to decode one batch of Opus packets.",
+                                ["kind"])
+
+class _OpusSpeakerState:
+    __slots__ = ("speaking", "voiced_run", "silent_frames", "voiced_frames", "packets", "held_bytes",
+                 "started_at", "last_packet_at", "utterance_id", "partial_mark", "partial_job",
+                 "final_job")
+    def __init__(self):
+        self.speaking = False
+        self.voiced_run = 0
+        self.silent_frames = 0
+        self.voiced_frames = 0
+        # While idle: the pre-roll; while speaking: every packet of the utterance so far.
+        self.packets: List[bytes] = []
+        self.held_bytes = 0
+        self.started_at = 0.0
+        self.last_packet_at = 0.0
+        self.utterance_id = 0
+        self.partial_mark = 0
+        self.partial_job: Optional[Future] = None
+        self.final_job: Optional[Future] = None
+
+class OpusUtteranceSegmenter(UtteranceSegmenter):
+    """UtteranceSegmenter over raw Opus packets (one 20 ms frame each) instead of PCM.
+
+    Endpointing uses packet size in place of frame energy: at Discord's variable bitrate,
+    frames under `voiced_min_bytes` are (near-)silence. Packets stay compressed per speaker
+    (roughly a tenth of the PCM) under `memory_budget_bytes`; nothing is decoded until a
+    finished utterance or a partial window is handed out. Those batches are decoded on
+    `decode_workers` threads with a fresh decoder each (libopus runs without the GIL), and the
+    callbacks then fire from the pool with the usual 48 kHz stereo PCM.
+    """
+    def __init__(self, on_utterance: UtteranceCallback, voiced_min_bytes: int = 16, decode_workers: int = 2,
+                 memory_budget_bytes: int = 64 * 1024 * 1024, **kwargs):
+        super().__init__(on_utterance, memory_budget_bytes=memory_budget_bytes, **kwargs)
+        self.voiced_min_bytes = voiced_min_bytes
+        self.decode_workers = max(1, decode_workers)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.preroll_frames = self.preroll_bytes // self.frame_bytes
+        self.max_utterance_frames = max(1, self.max_utterance_bytes // self.frame_bytes)
+        self.partial_interval_frames = max(1, self.partial_interval_bytes // self.frame_bytes)
+        self.partial_window_frames = max(1, self.partial_window_bytes // self.frame_bytes)
+        self.held_bytes = 0
+        self.decoded_packets = 0
+        self.decode_errors = 0
+        self._stats_lock = threading.Lock()
+        self._speakers: Dict[int, _OpusSpeakerState] = {}
+        self._decoders: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        if self._decoders is None:
+            self._decoders = ThreadPoolExecutor(self.decode_workers, thread_name_prefix="opus-decode")
+        super().start()
+
+    def stop(self):
+        super().stop()
+        if self._decoders is not None:
+            # Utterances flushed by stop() still decode and get delivered.
+            self._decoders.shutdown(wait=False)
+            self._decoders = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "speakers": len(self._speakers),
+            "buffer_bytes_allocated": self.held_bytes,
+            "dropped_bytes": self.dropped_bytes,
+            "overwritten_bytes": self.overwritten_bytes,
+            "evicted_speakers": self.evicted_speakers,
+            "decoded_packets": self.decoded_packets,
+            "decode_errors": self.decode_errors,
+        }
+
+    def _process(self, user_id: int, packet: bytes, received_at: float):
+        state = self._speakers.get(user_id)
+        if state is None:
+            state = self._speakers[user_id] = _OpusSpeakerState()
+        state.last_packet_at = received_at
+        if self.held_bytes + len(packet) > self.memory_budget_bytes:
+            self.dropped_bytes += len(packet)
+            return
+        state.packets.append(packet)
+        state.held_bytes += len(packet)
+        self.held_bytes += len(packet)
+        voiced = len(packet) >= self.voiced_min_bytes
+        if not state.speaking:
+            state.voiced_run = state.voiced_run + 1 if voiced else 0
+            if state.voiced_run >= self.onset_frames:
+                state.speaking = True
+                state.utterance_id = next(self._utterance_ids)
+                state.started_at = received_at - (len(state.packets) - 1) * self.frame_ms / 1000
+                state.voiced_frames = state.voiced_run
+                state.silent_frames = 0
+            elif len(state.packets) > self.preroll_frames + 1:
+                self._release(state, len(state.packets) - self.preroll_frames - 1)
+            return
+        if voiced:
+            state.voiced_frames += 1
+            state.silent_frames = 0
+        else:
+            state.silent_frames += 1
+        if state.silent_frames >= self.hangover_frames or len(state.packets) >= self.max_utterance_frames:
+            self._finish(user_id, received_at + self.frame_ms / 1000)
+        elif (self.on_partial and voiced and len(state.packets) - state.partial_mark >= self.partial_interval_frames
+              and (state.partial_job is None or state.partial_job.done())):
+            # Skipped while the previous partial is still decoding, so partials never queue up.
+            state.partial_mark = len(state.packets)
+            truncated = len(state.packets) > self.partial_window_frames
+            state.partial_job = self._submit(self._deliver_partial, user_id, state.utterance_id,
+                                             state.packets[-self.partial_window_frames:], truncated)
+
+    def _release(self, state: _OpusSpeakerState, count: Optional[int] = None):
+        dropped = state.packets if count is None else state.packets[:count]
+        freed = sum(len(packet) for packet in dropped)
+        state.packets = [] if count is None else state.packets[count:]
+        state.held_bytes -= freed
+        self.held_bytes -= freed
+
+    def _evict(self, user_id: int):
+        state = self._speakers.pop(user_id, None)
+        if state is not None:
+            self._release(state)
+            self.evicted_speakers += 1
+
+    def _finish(self, user_id: int, ended_at: float):
+        state = self._speakers.get(user_id)
+        if state is None or not state.speaking:
+            return
+        # Keep a short tail of the trailing silence, Whisper does better with some context.
+        trailing = max(0, state.silent_frames - 5)
+        packets = state.packets[:len(state.packets) - trailing]
+        enough = state.voiced_frames >= self.min_voiced_frames
+        started_at = state.started_at
+        partial_job = state.partial_job
+        state.speaking = False
+        state.voiced_run = 0
+        state.voiced_frames = 0
+        state.silent_frames = 0
+        state.partial_mark = 0
+        state.partial_job = None
+        self._release(state)
+        if enough:
+            # Finals of one speaker are delivered in order even when they decode in parallel.
+            state.final_job = self._submit(self._deliver_utterance, user_id, state.utterance_id, packets,
+                                           started_at, ended_at, [job for job in (partial_job, state.final_job) if job])
+
+    def _submit(self, fn, *args) -> Optional[Future]:
+        decoders = self._decoders
+        try:
+            if decoders is not None:
+                return decoders.submit(fn, *args)
+        except RuntimeError:
+            pass
+        logger.warning("Opus decode pool is shut down; dropping buffered audio.")
+        return None
+
+    def _decode(self, packets: List[bytes], kind: str) -> bytes:
+        decoder = opus.Decoder()
+        pcm = bytearray()
+        errors = 0
+        with OPUS_DECODE_SECONDS.labels(kind).time():
+            for packet in packets:
+                try:
+                    pcm += decoder.decode(packet)
+                except opus.OpusError:
+                    errors += 1
+        with self._stats_lock:
+            self.decoded_packets += len(packets) - errors
+            self.decode_errors += errors
+        return bytes(pcm)
+
+    def _deliver_partial(self, user_id: int, utterance_id: int, packets: List[bytes], truncated: bool):
+        try:
+            self.on_partial(user_id, utterance_id, self._decode(packets, "partial"), truncated)
+        except Exception as e:
+            logger.error(f"Partial callback failed for {user_id}: {e}", exc_info=True)
+
+    def _deliver_utterance(self, user_id: int, utterance_id: int, packets: List[bytes], started_at: float,
+                           ended_at: float, after: List[Future]):
+        try:
+            pcm = self._decode(packets, "utterance")
+            for job in after:
+                # The speaker's last partial and previous final were submitted earlier to the same
+                # FIFO pool, so they are already running or done: waiting cannot deadlock, and keeps
+                # a stale partial or an earlier utterance from landing after this one.
+                job.result()
+            self.on_utterance(user_id, utterance_id, pcm, started_at, ended_at)
+        except Exception as e:
+            logger.error(f"Utterance callback failed for {user_id}: {e}", exc_info=True)
@@ -0,0 +1,37 @@
+# ==============================================================================
+# penny_v2_api/services/partials.py
+# ==============================================================================
+from typing import List, Tuple
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+class StablePrefixTracker:
+    """Splits successive interim hypotheses of one utterance into stable and unstable text.
+
+    A word becomes stable once two consecutive hypotheses agree on it (local agreement),
+    and stable text never shrinks, so overlay clients can render it without flicker.
+    """
+    def __init__(self):
+        self.stable: List[str] = []
+        self._previous: List[str] = []
+
+    def update(self, hypothesis: str, truncated: bool = False) -> Tuple[str, str]:
+        words = hypothesis.split()
+        if truncated and self.stable:
+            # The decode window slid past the utterance start: splice the hypothesis onto
+            # the stable words at their longest overlap.
+            overlap = next((k for k in range(min(len(self.stable), len(words)), 0, -1)
+                            if self.stable[-k:] == words[:k]), 0)
+            words = self.stable + words[overlap:]
+        if words[:len(self.stable)] == self.stable:
+            agreed = _common_prefix(words, self._previous)
+            if agreed > len(self.stable):
+                self.stable = words[:agreed]
+        self._previous = words
+        return " ".join(self.stable), " ".join(words[len(self.stable):])
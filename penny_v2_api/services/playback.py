@@ -0,0 +1,210 @@
+# ==============================================================================
+# penny_v2_api/services/playback.py
+# In-process playback for the Discord voice client: clips are decoded once to
+# 48 kHz stereo PCM, cached, and fed through a single mixing AudioSource.
+# ==============================================================================
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+import disnake
+import numpy as np
+from penny_v2_api.core.audio import BytesLike, DISCORD_CHANNELS, DISCORD_SAMPLE_RATE, parse_wav, wav_to_discord_pcm
+from penny_v2_api.core.metrics import Counter, Gauge, Histogram
+
+logger_playback = logging.getLogger(__name__)
+
+# One 20 ms Opus frame of 48 kHz stereo s16, the unit disnake reads from a source.
+FRAME_BYTES = DISCORD_SAMPLE_RATE // 50 * DISCORD_CHANNELS * 2
+
+DECODE_SECONDS = Histogram("penny_playback_decode_seconds", "Time to decode a clip to Discord PCM.", ["path"])
+CACHE_REQUESTS = Counter("penny_playback_cache_requests_total", "Decoded-clip cache lookups by outcome.", ["outcome"])
+CACHE_BYTES = Gauge("penny_playback_cache_bytes", "Decoded PCM held by the playback cache.")
+QUEUED_CLIPS = Gauge("penny_playback_queued_clips", "Clips queued or overlaid in the mixer.")
+
+class PcmCache:
+    """LRU of decoded PCM keyed by a hash of the encoded clip, bounded by total bytes.
+
+    Used from decode threads as well as the event loop.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        CACHE_BYTES.set_function(lambda: self._total_bytes)
+
+    @staticmethod
+    def make_key(data: BytesLike) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            pcm = self._entries.get(key)
+            if pcm is not None:
+                self._entries.move_to_end(key)
+            return pcm
+
+    def put(self, key: bytes, pcm: bytes):
+        if len(pcm) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old)
+            self._entries[key] = pcm
+            self._total_bytes += len(pcm)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+class _Clip:
+    __slots__ = ("pcm", "position")
+    def __init__(self, pcm: bytes):
+        self.pcm = memoryview(pcm)
+        self.position = 0
+
+    def take(self) -> Optional[bytes]:
+        """Next frame, zero-padded at the end of the clip; None once exhausted."""
+        if self.position >= len(self.pcm):
+            return None
+        chunk = self.pcm[self.position:self.position + FRAME_BYTES]
+        self.position += FRAME_BYTES
+        if len(chunk) < FRAME_BYTES:
+            return bytes(chunk) + bytes(FRAME_BYTES - len(chunk))
+        return chunk.tobytes()
+
+class MixerAudioSource(disnake.AudioSource):
+    """Plays a queue of clips back to back and mixes overlay clips (sound effects) on top.
+
+    `read` runs on the voice player thread; everything else is called from the event loop.
+    Returns b"" once nothing is left so the player stops sending until the next clip.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: Deque[_Clip] = deque()
+        self._overlays: List[_Clip] = []
+        QUEUED_CLIPS.set_function(lambda: len(self._queue) + len(self._overlays))
+
+    def enqueue(self, pcm: bytes, interrupt: bool = False):
+        with self._lock:
+            if interrupt:
+                self._queue.clear()
+            self._queue.append(_Clip(pcm))
+
+    def overlay(self, pcm: bytes):
+        with self._lock:
+            self._overlays.append(_Clip(pcm))
+
+    def clear(self):
+        with self._lock:
+            self._queue.clear()
+            self._overlays.clear()
+
+    def is_active(self) -> bool:
+        return bool(self._queue or self._overlays)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def read(self) -> bytes:
+        with self._lock:
+            frame = None
+            while self._queue and frame is None:
+                frame = self._queue[0].take()
+                if frame is None:
+                    self._queue.popleft()
+            if not self._overlays:
+                return frame or b""
+            mix = np.zeros(FRAME_BYTES // 2, dtype=np.int32)
+            if frame is not None:
+                mix += np.frombuffer(frame, dtype=np.int16)
+            for clip in list(self._overlays):
+                chunk = clip.take()
+                if chunk is None:
+                    self._overlays.remove(clip)
+                else:
+                    mix += np.frombuffer(chunk, dtype=np.int16)
+            if frame is None and not self._overlays and not mix.any():
+                return b""
+            return np.clip(mix, -32768, 32767).astype(np.int16).tobytes()
+
+    def cleanup(self):
+        # The player calls this whenever it stops; the mixer outlives individual play() calls.
+        pass
+
+class PlaybackEngine:
+    """Decodes clips (cached) and keeps the voice client playing the shared mixer."""
+    def __init__(self, cache_bytes: int):
+        self.cache = PcmCache(cache_bytes)
+        self.mixer = MixerAudioSource()
+        self.voice_client: Optional[disnake.VoiceClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, voice_client: disnake.VoiceClient):
+        self.voice_client = voice_client
+        self._loop = asyncio.get_running_loop()
+
+    def detach(self):
+        self.mixer.clear()
+        self.voice_client = None
+
+    async def play(self, audio_data: BytesLike, interrupt: bool = False, overlay: bool = False):
+        pcm = await self.decode(audio_data)
+        if overlay:
+            self.mixer.overlay(pcm)
+        else:
+            self.mixer.enqueue(pcm, interrupt=interrupt)
+        self._ensure_playing()
+
+    async def decode(self, audio_data: BytesLike) -> bytes:
+        # Hashing and parsing a clip of up to UPLOAD_MAX_MB is too slow for the event loop.
+        key, pcm = await asyncio.get_running_loop().run_in_executor(None, self._decode_cached, audio_data)
+        if pcm is None:
+            with DECODE_SECONDS.labels("ffmpeg").time():
+                pcm = await _ffmpeg_decode(audio_data)
+            self.cache.put(key, pcm)
+        return pcm
+
+    def _decode_cached(self, audio_data: BytesLike) -> Tuple[bytes, Optional[bytes]]:
+        """Runs on the executor: cache key and PCM, or no PCM if the clip needs FFmpeg."""
+        key = self.cache.make_key(audio_data)
+        pcm = self.cache.get(key)
+        if pcm is not None:
+            CACHE_REQUESTS.labels("hit").inc()
+            return key, pcm
+        CACHE_REQUESTS.labels("miss").inc()
+        info = parse_wav(audio_data)
+        if info is None:
+            return key, None
+        with DECODE_SECONDS.labels("wav").time():
+            pcm = wav_to_discord_pcm(info)
+        self.cache.put(key, pcm)
+        return key, pcm
+
+    def _ensure_playing(self):
+        vc = self.voice_client
+        if vc is None or not vc.is_connected() or not self.mixer.is_active():
+            return
+        if not vc.is_playing():
+            vc.play(self.mixer, after=self._after_play)
+
+    def _after_play(self, error: Optional[Exception]):
+        # Runs on the voice player thread once the mixer ran dry (or the player was stopped).
+        if error:
+            logger_playback.warning(f"Discord playback failed: {error}")
+        if self._loop and self.mixer.is_active():
+            self._loop.call_soon_threadsafe(self._ensure_playing)
+
+async def _ffmpeg_decode(audio_data: BytesLike) -> bytes:
+    """Fallback for compressed formats: one FFmpeg run per distinct clip, output cached by the caller."""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+        "-f", "s16le", "-ar", str(DISCORD_SAMPLE_RATE), "-ac", str(DISCORD_CHANNELS), "pipe:1",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    pcm, stderr = await process.communicate(audio_data)
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg could not decode audio: {stderr.decode(errors='replace').strip()}")
+    return pcm
@@ -1,70 +1,365 @@
-import logging, asyncio, os, tempfile
-from faster_whisper import WhisperModel
+import logging, asyncio, io, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, List, Optional, Union
+import numpy as np
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
 from penny_v2_api.config import settings
+from penny_v2_api.core.audio import WHISPER_SAMPLE_RATE, decode_wav_to_whisper
 from penny_v2_api.core.event_bus import EventBus
 from penny_v2_api.core.events import TranscriptionRequest, LogEvent
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.lifecycle import ServiceState, ServiceStatus
+from penny_v2_api.core.metrics import Counter, Gauge, Histogram
+from penny_v2_api.core.tracing import TRACER
+from penny_v2_api.services.transcription_pool import TranscriptionProcessPool
 
 logger = logging.getLogger(__name__)
 
-class TranscriptionService:
-    def __init__(self, event_bus: EventBus):
+NO_SPEECH_THRESHOLD = 0.6
+
+QUEUE_DEPTH = Gauge("penny_transcription_queue_depth", "Transcription jobs waiting for a worker.")
+QUEUE_WAIT_SECONDS = Histogram("penny_transcription_queue_wait_seconds", "Time jobs spend queued.", ["kind"])
+EXECUTOR_WAIT_SECONDS = Histogram("penny_transcription_executor_wait_seconds",
+                                  "Time a batch waits for a transcription thread.")
+INFERENCE_SECONDS = Histogram("penny_transcription_inference_seconds", "Decode + model time per batch.", ["kind"])
+BATCH_SIZE = Histogram("penny_transcription_batch_size", "Clips per scheduler batch.",
+                       buckets=(1, 2, 4, 8, 16, 32))
+JOBS_SHED = Counter("penny_transcription_shed_total", "Jobs rejected because the queue was full.", ["kind"])
+
+@dataclass
+class _TranscriptionJob:
+    audio_data: Union[bytes, memoryview, np.ndarray, BinaryIO]
+    future: asyncio.Future
+    partial: bool = False
+    trace_id: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def kind(self) -> str:
+        return "partial" if self.partial else "final"
+
+class TranscriptionService(ServiceStatus):
+    def __init__(self, event_bus: EventBus, model_factory: Optional[Callable[[], WhisperModel]] = None):
         self.event_bus = event_bus
+        # Builds the model on the executor; defaults to WhisperModel from settings (benchmarks pass stubs).
+        self.model_factory = model_factory or self._build_model
+        self._custom_model = model_factory is not None
         self.model: WhisperModel = None
+        # Set instead of `model` when transcription runs in worker processes.
+        self.pool: Optional[TranscriptionProcessPool] = None
         self._running = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._bulk_slots: Optional[asyncio.Semaphore] = None
+        self._workers: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tokenizers: Dict[str, Tokenizer] = {}
 
     async def start(self):
-        """Load the Whisper model and subscribe to transcription events."""
+        """Load the Whisper model, start the scheduler workers and subscribe to transcription events."""
         if self._running:
             return
+        self.set_state(ServiceState.STARTING)
+        self._queue = asyncio.Queue(maxsize=settings.TRANSCRIPTION_QUEUE_SIZE)
+        self._bulk_slots = asyncio.Semaphore(max(1, settings.TRANSCRIPTION_QUEUE_SIZE // 2))
+        QUEUE_DEPTH.set_function(self._queue.qsize)
         # Subscribe to TranscriptionRequest events
         self.event_bus.subscribe_async(TranscriptionRequest, self.handle_transcription_request)
-        # Load the Whisper model (could be large, do in background)
-        await self._load_model()
+        if self._use_process_pool():
+            await self._start_pool()
+            schedulers = settings.TRANSCRIPTION_PROCESS_WORKERS
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=settings.TRANSCRIPTION_WORKERS,
+                                                thread_name_prefix="transcription")
+            # Load the Whisper model (could be large, do it on the executor)
+            await self._load_model()
+            if self.model and settings.WARMUP_MODELS:
+                await self._warm_up()
+            schedulers = settings.TRANSCRIPTION_WORKERS
+        self._workers = [asyncio.create_task(self._worker_loop()) for _ in range(schedulers)]
         self._running = True
+        if self.model or self.pool:
+            self.set_state(ServiceState.READY)
+
+    def _use_process_pool(self) -> bool:
+        if settings.TRANSCRIPTION_PROCESS_WORKERS <= 0 or self._custom_model:
+            return False
+        if settings.TRANSCRIPTION_DEVICE != "cpu":
+            logger.warning("TRANSCRIPTION_PROCESS_WORKERS only applies to TRANSCRIPTION_DEVICE=cpu; using threads.")
+            return False
+        return True
+
+    async def _start_pool(self):
+        pool = TranscriptionProcessPool(settings.TRANSCRIPTION_PROCESS_WORKERS,
+                                        settings.TRANSCRIPTION_PROCESS_THREADS, settings.WARMUP_MODELS)
+        try:
+            # Workers load and warm up their own models; this waits for all of them.
+            await pool.start()
+            self.pool = pool
+            await self.event_bus.publish(LogEvent(f"Whisper model '{settings.WHISPER_MODEL_SIZE}' loaded in "
+                                                  f"{pool.size} worker processes ({pool.cpu_threads} threads each)."))
+        except Exception as e:
+            logger.error(f"Could not start transcription workers: {e}", exc_info=True)
+            await pool.stop()
+            self.set_state(ServiceState.FAILED, f"worker start failed: {e}")
 
     async def _load_model(self):
         try:
-            # Load the model (e.g., tiny, base, or a path to model files)
-            self.model = WhisperModel(settings.WHISPER_MODEL_SIZE, 
-                                      device=settings.TRANSCRIPTION_DEVICE, 
-                                      compute_type=settings.WHISPER_COMPUTE_TYPE)
+            # Load the model (e.g., tiny, base, or a path to model files).
+            # num_workers lets CTranslate2 run that many transcriptions in parallel.
+            loop = asyncio.get_running_loop()
+            self.model = await loop.run_in_executor(self._executor, self.model_factory)
             await self.event_bus.publish(LogEvent(f"Whisper model '{settings.WHISPER_MODEL_SIZE}' loaded."))
         except Exception as e:
             logger.error(f"Could not load Whisper model: {e}", exc_info=True)
+            self.set_state(ServiceState.FAILED, f"model load failed: {e}")
+
+    @staticmethod
+    def _build_model() -> WhisperModel:
+        return WhisperModel(settings.WHISPER_MODEL_SIZE,
+                            device=settings.TRANSCRIPTION_DEVICE,
+                            compute_type=settings.WHISPER_COMPUTE_TYPE,
+                            num_workers=settings.TRANSCRIPTION_WORKERS)
+
+    async def _warm_up(self):
+        """Run the batched and sequential paths once on silence so the first utterance doesn't pay
+        for CTranslate2 allocations and tokenizer setup."""
+        self.set_state(ServiceState.WARMING_UP)
+        loop = asyncio.get_running_loop()
+        silence = np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32)
+        jobs = [_TranscriptionJob(audio_data=silence, future=None), _TranscriptionJob(audio_data=silence, future=None)]
+        started = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._executor, self._transcribe_batch, jobs)
+            await loop.run_in_executor(self._executor, self._transcribe_batch, jobs[:1])
+            logger.info(f"Whisper warm-up took {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"Whisper warm-up failed: {e}")
 
     async def stop(self):
-        """Unload the model if needed."""
+        """Stop the workers, fail anything still queued and unload the model."""
         self._running = False
+        for worker in self._workers:
+            worker.cancel()
+        # Each worker fails the batch it was collecting or running as it is cancelled.
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._drain_queue()
+        if self.pool:
+            await self.pool.stop()
+            self.pool = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
         self.model = None
+        self.set_state(ServiceState.STOPPED)
 
     async def handle_transcription_request(self, event: TranscriptionRequest):
-        """Handle incoming audio and produce a transcription."""
-        if not self.model:
+        """Queue incoming audio for the scheduler, shedding it if the queue is full.
+
+        Interim (partial) requests may only fill half the queue so they never crowd out finals.
+        Bulk requests (file uploads) wait for room instead of being shed, and together hold at
+        most half the queue, so a long upload cannot starve live speech either.
+        """
+        if not self.model and not self.pool:
             event.response_future.set_exception(Exception("Transcription model not loaded"))
             return
+        if event.bulk:
+            await self._enqueue_bulk(event)
+            return
         try:
-            # Offload heavy transcription to a thread to avoid blocking
-            loop = asyncio.get_running_loop()
-            def transcribe_audio_bytes(audio_bytes: bytes) -> str:
-                # Write bytes to a temp WAV file
-                tmp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-                try:
-                    tmp_file.write(audio_bytes)
-                    tmp_file.flush()
-                    tmp_path = tmp_file.name
-                finally:
-                    tmp_file.close()
-                try:
-                    segments, _ = self.model.transcribe(tmp_path)
-                    # Combine segment texts
-                    text = "".join([s.text for s in segments]).strip()
-                finally:
-                    # Clean up temp file
-                    os.remove(tmp_path)
-                return text
-
-            result_text = await loop.run_in_executor(None, transcribe_audio_bytes, event.audio_data)
-            event.response_future.set_result(result_text)
+            if event.partial and self._queue.qsize() >= self._queue.maxsize // 2:
+                raise asyncio.QueueFull
+            self._queue.put_nowait(_TranscriptionJob(audio_data=event.audio_data, future=event.response_future,
+                                                     partial=event.partial, trace_id=event.trace_id))
+        except asyncio.QueueFull:
+            logger.warning(f"Transcription queue full ({self._queue.maxsize} pending), shedding request.")
+            JOBS_SHED.labels("partial" if event.partial else "final").inc()
+            event.response_future.set_exception(ServiceOverloadedError("transcription"))
+
+    async def _enqueue_bulk(self, event: TranscriptionRequest):
+        # Awaited in the publisher's task, so the upload stops being read while it waits here.
+        await self._bulk_slots.acquire()
+        try:
+            await self._queue.put(_TranscriptionJob(audio_data=event.audio_data, future=event.response_future,
+                                                    trace_id=event.trace_id))
+        except BaseException:
+            self._bulk_slots.release()
+            raise
+        event.response_future.add_done_callback(lambda _: self._bulk_slots.release())
+        if not self._running:
+            # Stopped while this upload waited for room: nothing will take the job off the queue.
+            self._drain_queue()
+
+    @staticmethod
+    def _fail_jobs(jobs: List[_TranscriptionJob]):
+        for job in jobs:
+            if job.future is not None and not job.future.done():
+                job.future.set_exception(ServiceOverloadedError("transcription (shutting down)"))
+
+    def _drain_queue(self):
+        jobs = []
+        while self._queue is not None and not self._queue.empty():
+            jobs.append(self._queue.get_nowait())
+        self._fail_jobs(jobs)
+
+    async def _worker_loop(self):
+        # Jobs taken off the queue by this worker and not yet answered, failed if it is cancelled.
+        batch: List[_TranscriptionJob] = []
+        try:
+            while True:
+                batch = []
+                await self._next_batch(batch)
+                if batch:
+                    await self._run_jobs(batch)
+        except asyncio.CancelledError:
+            self._fail_jobs(batch)
+            raise
+
+    async def _run_jobs(self, batch: List[_TranscriptionJob]):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        for job in batch:
+            QUEUE_WAIT_SECONDS.labels(job.kind).observe(started - job.enqueued_at)
+            TRACER.get(job.trace_id).add_span("transcription.queue_wait", job.enqueued_at, started)
+        BATCH_SIZE.observe(len(batch))
+        try:
+            if self.pool:
+                results = await self._run_pool_batch(batch, started)
+            else:
+                # Offload heavy transcription to the dedicated pool to avoid blocking
+                results = await loop.run_in_executor(self._executor, self._run_batch, batch, started)
         except Exception as e:
-            logger.error(f"Transcription failed: {e}", exc_info=True)
-            event.response_future.set_exception(e)
+            logger.error(f"Transcription batch failed: {e}", exc_info=True)
+            results = [e] * len(batch)
+        for job, result in zip(batch, results):
+            if job.future.done():
+                continue
+            if isinstance(result, Exception):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+    async def _next_batch(self, batch: List[_TranscriptionJob]):
+        """Wait for one job, then collect more into `batch` for up to the batching window."""
+        batch.append(await self._queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TRANSCRIPTION_BATCH_WINDOW_MS / 1000
+        while len(batch) < settings.TRANSCRIPTION_BATCH_SIZE:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that already gave up (timeout, disconnect) are not worth a model run.
+        batch[:] = [job for job in batch if not job.future.done()]
+
+    async def _run_pool_batch(self, jobs: List[_TranscriptionJob], submitted_at: float) -> List[Union[str, Exception]]:
+        try:
+            return await self.pool.transcribe([(job.audio_data, job.partial) for job in jobs])
+        finally:
+            end = time.perf_counter()
+            for job in jobs:
+                TRACER.get(job.trace_id).add_span("transcription.worker", submitted_at, end, batch_size=len(jobs))
+
+    def _run_batch(self, jobs: List[_TranscriptionJob], submitted_at: float) -> List[Union[str, Exception]]:
+        start = time.perf_counter()
+        EXECUTOR_WAIT_SECONDS.observe(start - submitted_at)
+        try:
+            return self._transcribe_batch(jobs)
+        finally:
+            end = time.perf_counter()
+            INFERENCE_SECONDS.labels(jobs[0].kind if len({job.kind for job in jobs}) == 1 else "mixed") \
+                .observe(end - start)
+            for job in jobs:
+                trace = TRACER.get(job.trace_id)
+                trace.add_span("transcription.executor_wait", submitted_at, start)
+                trace.add_span("transcription.inference", start, end, batch_size=len(jobs))
+
+    def _transcribe_batch(self, jobs: List[_TranscriptionJob]) -> List[Union[str, Exception]]:
+        """Runs in the executor. Clips that fit one Whisper window are decoded together.
+
+        Partial jobs use greedy decoding; they only need to be fast, the final pass fixes them up.
+        """
+        results: List[Union[str, Exception]] = [None] * len(jobs)
+        audios: Dict[int, np.ndarray] = {}
+        for i, job in enumerate(jobs):
+            try:
+                audios[i] = self._decode(job.audio_data)
+            except Exception as e:
+                results[i] = e
+        for partial in (False, True):
+            short = [i for i, audio in audios.items()
+                     if jobs[i].partial == partial and len(audio) <= self.model.feature_extractor.n_samples]
+            if len(short) < 2:
+                continue
+            try:
+                texts = self._generate_batched([audios[i] for i in short], beam_size=1 if partial else 5)
+                for i, text in zip(short, texts):
+                    results[i] = text
+            except Exception as e:
+                logger.warning(f"Batched transcription failed, falling back to sequential: {e}", exc_info=True)
+        for i, audio in audios.items():
+            if results[i] is not None:
+                continue
+            try:
+                options = dict(beam_size=1, without_timestamps=True, condition_on_previous_text=False) \
+                    if jobs[i].partial else {}
+                segments, _ = self.model.transcribe(audio, language=settings.WHISPER_LANGUAGE, **options)
+                # Combine segment texts
+                results[i] = "".join([s.text for s in segments]).strip()
+            except Exception as e:
+                results[i] = e
+        return results
+
+    def _decode(self, audio_data: Union[bytes, memoryview, np.ndarray, BinaryIO]) -> np.ndarray:
+        """16 kHz mono float32 for the model, decoded from memory or a spooled upload (no temp copies)."""
+        if isinstance(audio_data, np.ndarray):
+            return audio_data.astype(np.float32, copy=False)
+        if hasattr(audio_data, "read"):
+            # Spooled uploads that are not PCM WAV: PyAV reads the file object directly.
+            return decode_audio(audio_data, sampling_rate=WHISPER_SAMPLE_RATE)
+        audio = decode_wav_to_whisper(audio_data)
+        if audio is None:
+            # Compressed uploads (mp3, ogg, ...) go through PyAV, reading straight from memory.
+            audio = decode_audio(io.BytesIO(audio_data), sampling_rate=WHISPER_SAMPLE_RATE)
+        return audio
+
+    def _generate_batched(self, audios: List[np.ndarray], beam_size: int = 5) -> List[str]:
+        """Single encoder/decoder pass over several <=30s clips, one Whisper window each."""
+        extractor = self.model.feature_extractor
+        features = np.stack([pad_or_trim(extractor(audio), extractor.nb_max_frames) for audio in audios])
+        encoder_output = self.model.encode(features)
+        if settings.WHISPER_LANGUAGE or not self.model.model.is_multilingual:
+            languages = [settings.WHISPER_LANGUAGE or "en"] * len(audios)
+        else:
+            languages = [langs[0][0][2:-2] for langs in self.model.model.detect_language(encoder_output)]
+        prompts = [self.model.get_prompt(self._tokenizer(lang), [], without_timestamps=True) for lang in languages]
+        results = self.model.model.generate(encoder_output, prompts,
+                                            beam_size=beam_size,
+                                            max_length=self.model.max_length,
+                                            suppress_blank=True,
+                                            suppress_tokens=[-1],
+                                            return_no_speech_prob=True)
+        texts = []
+        for lang, result in zip(languages, results):
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+                texts.append("")
+            else:
+                texts.append(self._tokenizer(lang).decode(result.sequences_ids[0]).strip())
+        return texts
+
+    def _tokenizer(self, language: str) -> Tokenizer:
+        tokenizer = self._tokenizers.get(language)
+        if tokenizer is None:
+            tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual,
+                                  task="transcribe", language=language)
+            self._tokenizers[language] = tokenizer
+        return tokenizer
@@ -0,0 +1,306 @@
+# ==============================================================================
+# penny_v2_api/services/transcription_pool.py
+# Transcription in worker processes, for CPU-only hosts: each process has its own
+# WhisperModel and thread budget, so decoding and model work stay off the API
+# process's GIL. Audio is handed over in shared memory, not pickled.
+# ==============================================================================
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+import numpy as np
+from penny_v2_api.config import settings
+from penny_v2_api.core.metrics import Counter, Gauge, Histogram
+
+logger_pool = logging.getLogger(__name__)
+
+POOL_WORKERS_ALIVE = Gauge("penny_transcription_pool_workers_alive", "Transcription worker processes running.")
+POOL_IN_FLIGHT_BYTES = Gauge("penny_transcription_pool_in_flight_bytes", "Audio bytes handed to a worker, per worker.",
+                             ["worker"])
+POOL_RESTARTS = Counter("penny_transcription_pool_restarts_total", "Transcription worker processes restarted.")
+POOL_WORKER_SECONDS = Histogram("penny_transcription_pool_worker_seconds",
+                                "Decode + model time per batch inside a worker process.")
+
+READY_TIMEOUT_S = 600.0  # model download + load on first start
+MAX_RESTART_DELAY_S = 30.0
+
+# (shared memory name, payload size, "f32" for 16 kHz float32 samples or "bytes" for an encoded file, partial)
+ClipSpec = Tuple[str, int, str, bool]
+AudioData = Union[bytes, memoryview, np.ndarray, BinaryIO]
+
+class WorkerCrashedError(Exception):
+    """The worker process died while it held the batch."""
+
+# --- worker process --------------------------------------------------------------
+
+def _worker_main(conn: Connection, cpu_threads: int, warm_up: bool):
+    """Entry point of a worker process: load the model, then transcribe batches until told to stop."""
+    from faster_whisper import WhisperModel
+    from penny_v2_api.services.transcription import TranscriptionService, _TranscriptionJob
+
+    logging.basicConfig(level=settings.LOG_LEVEL, format=f"%(asctime)s [worker {os.getpid()}] %(levelname)s %(name)s: %(message)s")
+    # Reuses the service's batching/decoding code; it only needs a model, not an event bus.
+    transcriber = TranscriptionService(None, model_factory=lambda: WhisperModel(
+        settings.WHISPER_MODEL_SIZE, device="cpu", compute_type=settings.WHISPER_COMPUTE_TYPE,
+        cpu_threads=cpu_threads, num_workers=1))
+    transcriber.model = transcriber.model_factory()
+    if warm_up:
+        silence = np.zeros(16000, dtype=np.float32)
+        transcriber._transcribe_batch([_TranscriptionJob(audio_data=silence, future=None)] * 2)
+        transcriber._transcribe_batch([_TranscriptionJob(audio_data=silence, future=None)])
+    conn.send(("ready", os.getpid()))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        job_id, clips = message
+        started = time.perf_counter()
+        results: List[Union[str, Exception]] = [None] * len(clips)
+        jobs, positions = [], []
+        for i, (name, size, kind, partial) in enumerate(clips):
+            try:
+                jobs.append(_TranscriptionJob(audio_data=_load_clip(transcriber, name, size, kind),
+                                              future=None, partial=partial))
+                positions.append(i)
+            except Exception as e:
+                results[i] = e
+        if jobs:
+            for i, result in zip(positions, transcriber._transcribe_batch(jobs)):
+                results[i] = result
+        # Exceptions cross the pipe as plain messages; arbitrary exception types may not unpickle.
+        conn.send((job_id, [RuntimeError(str(r)) if isinstance(r, Exception) else r for r in results],
+                   time.perf_counter() - started))
+
+def _load_clip(transcriber, name: str, size: int, kind: str) -> np.ndarray:
+    """Decode one clip out of shared memory into process-local samples, then detach."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        with shm.buf[:size] as view:
+            if kind == "f32":
+                return np.frombuffer(view, dtype=np.float32).copy()
+            audio = transcriber._decode(view)
+            # A 16 kHz mono float WAV decodes to a view of the block itself.
+            return audio.copy() if audio.base is not None else audio
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # a traceback still references the block; it is unmapped when that is collected
+
+# --- API process -----------------------------------------------------------------
+
+def _to_shared(audio_data: AudioData) -> Tuple[shared_memory.SharedMemory, int, str]:
+    """Copy one clip into a new shared memory block; the caller unlinks it."""
+    if hasattr(audio_data, "read"):
+        audio_data.seek(0, os.SEEK_END)
+        size = audio_data.tell()
+        audio_data.seek(0)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        filled = 0
+        while filled < size:
+            with shm.buf[filled:size] as target:
+                count = audio_data.readinto(target)
+            if not count:
+                break
+            filled += count
+        return shm, filled, "bytes"
+    if isinstance(audio_data, np.ndarray):
+        source, kind = np.ascontiguousarray(audio_data, dtype=np.float32), "f32"
+    else:
+        source, kind = audio_data, "bytes"
+    with memoryview(source).cast("B") as view:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, view.nbytes))
+        shm.buf[:view.nbytes] = view
+        return shm, view.nbytes, kind
+
+def _release(blocks: List[shared_memory.SharedMemory]):
+    for shm in blocks:
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class _Worker:
+    __slots__ = ("index", "process", "conn", "alive", "in_flight", "load", "failures")
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.alive = False
+        self.in_flight: Dict[int, asyncio.Future] = {}
+        self.load = 0  # audio bytes in flight, the routing key
+        self.failures = 0  # consecutive crashes, for restart back-off
+
+class TranscriptionProcessPool:
+    """N worker processes behind least-loaded routing, restarted when they die.
+
+    A batch whose worker crashes is retried once on another worker, so a single crash
+    costs latency, not transcripts; a batch that kills two workers is failed.
+    """
+    def __init__(self, size: int, cpu_threads: Optional[int] = None, warm_up: bool = True):
+        self.size = size
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // size)
+        self.warm_up = warm_up
+        self._context = multiprocessing.get_context("spawn")  # CTranslate2/OpenMP threads don't survive fork
+        self._workers = [_Worker(i) for i in range(size)]
+        self._job_ids = itertools.count()
+        self._available: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+        POOL_WORKERS_ALIVE.set_function(lambda: sum(w.alive for w in self._workers))
+
+    async def start(self):
+        """Spawn every worker and wait until each has loaded (and warmed up) its model."""
+        self._loop = asyncio.get_running_loop()
+        self._available = asyncio.Event()
+        self._stopping = False
+        results = await asyncio.gather(*(self._spawn(worker) for worker in self._workers), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Every spawn has settled, so this reaches each worker that did come up.
+            await self.stop()
+            raise errors[0]
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self._workers:
+            self._fail_in_flight(worker, Exception("Transcription pool stopped"))
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        await asyncio.gather(*(self._loop.run_in_executor(None, self._join, worker) for worker in self._workers))
+
+    def _join(self, worker: _Worker):
+        if worker.process is None:
+            return
+        worker.process.join(5)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(5)
+        worker.alive = False
+
+    async def _spawn(self, worker: _Worker):
+        worker.conn, worker.process = await self._loop.run_in_executor(None, self._start_process, worker.index)
+        worker.alive = True
+        self._available.set()
+        threading.Thread(target=self._read_results, args=(worker, worker.conn),
+                         name=f"transcription-pool-{worker.index}", daemon=True).start()
+
+    def _start_process(self, index: int) -> Tuple[Connection, multiprocessing.Process]:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.cpu_threads, self.warm_up),
+                                        name=f"penny-transcription-{index}", daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            if not parent_conn.poll(READY_TIMEOUT_S):
+                raise TimeoutError(f"no ready signal within {READY_TIMEOUT_S:.0f}s")
+            parent_conn.recv()
+        except BaseException as e:
+            process.kill()
+            parent_conn.close()
+            raise RuntimeError(f"Transcription worker {index} failed to start: {e}") from e
+        logger_pool.info(f"Transcription worker {index} ready (pid {process.pid}, {self.cpu_threads} threads).")
+        return parent_conn, process
+
+    def _read_results(self, worker: _Worker, conn: Connection):
+        # One thread per worker: blocks on the pipe and hands results to the event loop.
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._complete, worker, *message)
+        if not self._stopping:
+            self._loop.call_soon_threadsafe(self._on_worker_exit, worker, conn)
+
+    def _complete(self, worker: _Worker, job_id: int, results: list, seconds: float):
+        worker.failures = 0
+        POOL_WORKER_SECONDS.observe(seconds)
+        future = worker.in_flight.pop(job_id, None)
+        if future is not None and not future.done():
+            future.set_result(results)
+
+    def _fail_in_flight(self, worker: _Worker, error: Exception):
+        for future in worker.in_flight.values():
+            if not future.done():
+                future.set_exception(error)
+        worker.in_flight.clear()
+
+    def _on_worker_exit(self, worker: _Worker, conn: Connection):
+        if worker.conn is not conn or self._stopping:
+            return
+        worker.process.join(0.1)  # reap it
+        exitcode = worker.process.exitcode
+        logger_pool.error(f"Transcription worker {worker.index} died (exit code {exitcode}), restarting.")
+        worker.alive = False
+        conn.close()
+        if not any(w.alive for w in self._workers):
+            self._available.clear()
+        self._fail_in_flight(worker, WorkerCrashedError(f"transcription worker {worker.index} died"))
+        POOL_RESTARTS.inc()
+        worker.failures += 1
+        asyncio.create_task(self._restart(worker, min(MAX_RESTART_DELAY_S, 2 ** (worker.failures - 1))))
+
+    async def _restart(self, worker: _Worker, delay: float):
+        await asyncio.sleep(delay)
+        if self._stopping:
+            return
+        try:
+            await self._spawn(worker)
+        except Exception as e:
+            logger_pool.error(f"{e}; retrying.")
+            worker.failures += 1
+            asyncio.create_task(self._restart(worker, min(MAX_RESTART_DELAY_S, 2 ** (worker.failures - 1))))
+
+    async def _pick(self) -> _Worker:
+        while True:
+            alive = [w for w in self._workers if w.alive]
+            if alive:
+                return min(alive, key=lambda w: (w.load, len(w.in_flight)))
+            await self._available.wait()
+
+    async def transcribe(self, clips: List[Tuple[AudioData, bool]]) -> List[Union[str, Exception]]:
+        """Transcribe `(audio, partial)` clips as one batch on the least-loaded worker."""
+        blocks = await self._loop.run_in_executor(None, lambda: [_to_shared(audio) for audio, _ in clips])
+        try:
+            specs = [(shm.name, size, kind, partial) for (shm, size, kind), (_, partial) in zip(blocks, clips)]
+            load = sum(size for _, size, _ in blocks)
+            for attempt in range(2):
+                worker = await self._pick()
+                try:
+                    return await self._submit(worker, specs, load)
+                except WorkerCrashedError:
+                    if attempt or self._stopping:
+                        raise
+                    logger_pool.warning(f"Retrying batch of {len(specs)} after worker {worker.index} died.")
+        finally:
+            _release([shm for shm, _, _ in blocks])
+
+    async def _submit(self, worker: _Worker, specs: List[ClipSpec], load: int) -> List[Union[str, Exception]]:
+        job_id = next(self._job_ids)
+        future = self._loop.create_future()
+        worker.in_flight[job_id] = future
+        worker.load += load
+        POOL_IN_FLIGHT_BYTES.labels(str(worker.index)).set(worker.load)
+        try:
+            worker.conn.send((job_id, specs))
+            return await future
+        except OSError as e:
+            raise WorkerCrashedError(f"transcription worker {worker.index} unreachable: {e}") from e
+        finally:
+            worker.in_flight.pop(job_id, None)
+            worker.load -= load
+            POOL_IN_FLIGHT_BYTES.labels(str(worker.index)).set(worker.load)
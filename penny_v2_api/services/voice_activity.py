@@ -0,0 +1,305 @@
+# ==============================================================================
+# penny_v2_api/services/voice_activity.py
+# Streaming energy-based endpointing for the Discord voice sink.
+# ==============================================================================
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from penny_v2_api.core.audio import DISCORD_CHANNELS, DISCORD_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SECOND = DISCORD_SAMPLE_RATE * DISCORD_CHANNELS * 2
+
+# (user_id, utterance_id, pcm, utterance start, utterance end) -- times are time.monotonic()
+UtteranceCallback = Callable[[int, int, bytes, float, float], None]
+# (user_id, utterance_id, trailing window of the utterance so far, window truncated the start)
+PartialCallback = Callable[[int, int, bytes, bool], None]
+
+class PcmRingBuffer:
+    """Fixed-capacity byte ring over a preallocated bytearray."""
+    __slots__ = ("_buf", "_end", "size")
+    def __init__(self, storage: bytearray):
+        self._buf = storage
+        self._end = 0
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf)
+
+    def write(self, data: bytes) -> int:
+        """Append data, returning how many older bytes were overwritten."""
+        n = len(data)
+        cap = len(self._buf)
+        if n >= cap:
+            data = data[n - cap:]
+            self._buf[:] = data
+            self._end = 0
+        else:
+            first = min(n, cap - self._end)
+            self._buf[self._end:self._end + first] = data[:first]
+            self._buf[:n - first] = data[first:]
+            self._end = (self._end + n) % cap
+        overwritten = max(0, self.size + n - cap)
+        self.size = min(cap, self.size + n)
+        return overwritten
+
+    def tail(self, n: int, skip_end: int = 0) -> bytes:
+        """The n bytes that end `skip_end` bytes before the write position."""
+        n = max(0, min(n, self.size - skip_end))
+        cap = len(self._buf)
+        stop = (self._end - skip_end) % cap
+        start = (stop - n) % cap
+        if n == 0:
+            return b""
+        if start < stop:
+            return bytes(self._buf[start:stop])
+        return bytes(self._buf[start:]) + bytes(self._buf[:stop])
+
+    def clear(self):
+        self._end = 0
+        self.size = 0
+
+class SpeakerBufferPool:
+    """Hands out equally sized ring storage under a global byte budget and recycles it."""
+    def __init__(self, capacity: int, budget_bytes: int):
+        self.capacity = capacity
+        self.max_buffers = max(1, budget_bytes // capacity)
+        self.allocated = 0
+        self._free: List[bytearray] = []
+
+    def acquire(self) -> Optional[PcmRingBuffer]:
+        if self._free:
+            return PcmRingBuffer(self._free.pop())
+        if self.allocated >= self.max_buffers:
+            return None
+        self.allocated += 1
+        return PcmRingBuffer(bytearray(self.capacity))
+
+    def release(self, ring: PcmRingBuffer):
+        ring.clear()
+        self._free.append(ring._buf)
+
+class _SpeakerState:
+    __slots__ = ("speaking", "voiced_run", "silent_frames", "voiced_frames", "ring", "utterance_bytes",
+                 "started_at", "last_packet_at", "pending", "utterance_id", "partial_mark")
+    def __init__(self, ring: Optional[PcmRingBuffer]):
+        self.speaking = False
+        self.voiced_run = 0
+        self.silent_frames = 0
+        self.voiced_frames = 0
+        self.ring = ring
+        self.utterance_bytes = 0
+        self.started_at = 0.0
+        self.last_packet_at = 0.0
+        self.pending = b""
+        self.utterance_id = 0
+        self.partial_mark = 0
+
+class UtteranceSegmenter:
+    """Cuts each speaker's PCM stream into utterances.
+
+    `feed` is called from the voice-receive thread and only enqueues; framing, energy
+    detection and endpointing run on the segmenter's own thread. A speaker's utterance
+    ends after `hangover_ms` of silence, when their packets stop arriving for as long
+    (Discord clients stop transmitting when the user stops talking), or when it reaches
+    `max_utterance_s`.
+
+    Each speaker records into a fixed ring (by default one maximum-length utterance plus
+    pre-roll; a shorter `ring_s` keeps only the end of long utterances and counts the
+    overwritten start), drawn from a pool capped at `memory_budget_bytes`. Speakers idle for
+    `idle_evict_s` give their ring back; when the pool is exhausted the longest-idle
+    speaker is evicted, and if everyone is talking the newcomer's audio is dropped and
+    counted rather than allocated.
+
+    With `on_partial` set, every `partial_interval_ms` of an ongoing utterance the trailing
+    `partial_window_s` of it is handed out for interim decoding.
+    """
+    def __init__(self, on_utterance: UtteranceCallback, frame_ms: int = 20, threshold_db: float = -45.0,
+                 onset_frames: int = 2, hangover_ms: int = 300, preroll_ms: int = 200,
+                 max_utterance_s: float = 15.0, min_utterance_ms: int = 250,
+                 on_partial: Optional[PartialCallback] = None, partial_interval_ms: int = 500,
+                 partial_window_s: float = 10.0, memory_budget_bytes: int = 64 * 1024 * 1024,
+                 idle_evict_s: float = 30.0, ring_s: Optional[float] = None):
+        self.on_utterance = on_utterance
+        self.on_partial = on_partial
+        self.partial_interval_bytes = BYTES_PER_SECOND * partial_interval_ms // 1000
+        self.partial_window_bytes = int(partial_window_s * BYTES_PER_SECOND)
+        self.frame_ms = frame_ms
+        self.frame_bytes = BYTES_PER_SECOND * frame_ms // 1000
+        self.threshold = 10 ** (threshold_db / 20)
+        self.onset_frames = onset_frames
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.hangover_s = hangover_ms / 1000
+        self.preroll_bytes = preroll_ms // frame_ms * self.frame_bytes
+        self.max_utterance_bytes = int(max_utterance_s * BYTES_PER_SECOND) // self.frame_bytes * self.frame_bytes
+        self.min_voiced_frames = max(1, min_utterance_ms // frame_ms)
+        self.idle_evict_s = idle_evict_s
+        ring_bytes = int(ring_s * BYTES_PER_SECOND) if ring_s else self.max_utterance_bytes + self.preroll_bytes
+        self.pool = SpeakerBufferPool(ring_bytes // self.frame_bytes * self.frame_bytes, memory_budget_bytes)
+        self.dropped_bytes = 0
+        self.overwritten_bytes = 0
+        self.evicted_speakers = 0
+        self._speakers: Dict[int, _SpeakerState] = {}
+        self._utterance_ids = itertools.count(1)
+        self._inbox: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="voice-segmenter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._inbox.put(None)
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def feed(self, user_id: int, pcm: bytes):
+        self._inbox.put((user_id, pcm, time.monotonic()))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "speakers": len(self._speakers),
+            "buffers_allocated": self.pool.allocated,
+            "buffer_bytes_allocated": self.pool.allocated * self.pool.capacity,
+            "dropped_bytes": self.dropped_bytes,
+            "overwritten_bytes": self.overwritten_bytes,
+            "evicted_speakers": self.evicted_speakers,
+        }
+
+    def _run(self):
+        sweep_interval = self.frame_ms / 1000
+        next_sweep = time.monotonic() + sweep_interval
+        while self._running:
+            try:
+                item = self._inbox.get(timeout=sweep_interval)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    self._process(*item)
+                now = time.monotonic()
+                if now >= next_sweep:
+                    self._sweep(now)
+                    next_sweep = now + sweep_interval
+            except Exception as e:
+                logger.error(f"Voice segmenter error: {e}", exc_info=True)
+        for user_id in list(self._speakers):
+            self._finish(user_id, time.monotonic())
+
+    def _process(self, user_id: int, pcm: bytes, received_at: float):
+        state = self._speakers.get(user_id)
+        if state is None:
+            state = self._speakers[user_id] = _SpeakerState(self._acquire_ring())
+        elif state.ring is None:
+            state.ring = self._acquire_ring()
+        state.last_packet_at = received_at
+        if state.ring is None:
+            self.dropped_bytes += len(pcm)
+            return
+        data = state.pending + pcm if state.pending else pcm
+        n_frames = len(data) // self.frame_bytes
+        state.pending = data[n_frames * self.frame_bytes:]
+        if not n_frames:
+            return
+        # Per-frame RMS for the whole chunk in one vectorized pass.
+        samples = np.frombuffer(data, dtype=np.int16, count=n_frames * self.frame_bytes // 2)
+        frames = samples.reshape(n_frames, -1).astype(np.float32) * (1 / 32768)
+        voiced = np.sqrt(np.mean(frames * frames, axis=1)) >= self.threshold
+        frame_start = received_at - n_frames * self.frame_ms / 1000
+        for i in range(n_frames):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            self._step(user_id, state, frame, bool(voiced[i]), frame_start + i * self.frame_ms / 1000)
+
+    def _step(self, user_id: int, state: _SpeakerState, frame: bytes, voiced: bool, frame_at: float):
+        overwritten = state.ring.write(frame)
+        if not state.speaking:
+            # While idle the ring doubles as the pre-roll history; overwriting it is expected.
+            state.voiced_run = state.voiced_run + 1 if voiced else 0
+            if state.voiced_run >= self.onset_frames:
+                state.speaking = True
+                state.utterance_id = next(self._utterance_ids)
+                state.utterance_bytes = min(state.ring.size, self.preroll_bytes + self.frame_bytes)
+                state.started_at = frame_at - (state.utterance_bytes // self.frame_bytes - 1) * self.frame_ms / 1000
+                state.voiced_frames = state.voiced_run
+                state.silent_frames = 0
+            return
+        state.utterance_bytes += len(frame)
+        if state.utterance_bytes > state.ring.capacity:
+            # Ring shorter than the utterance: its start is gone (tail() clamps to what is left).
+            self.overwritten_bytes += overwritten
+        if voiced:
+            state.voiced_frames += 1
+            state.silent_frames = 0
+        else:
+            state.silent_frames += 1
+        if state.silent_frames >= self.hangover_frames or state.utterance_bytes >= self.max_utterance_bytes:
+            self._finish(user_id, frame_at + self.frame_ms / 1000)
+        elif self.on_partial and voiced and state.utterance_bytes - state.partial_mark >= self.partial_interval_bytes:
+            state.partial_mark = state.utterance_bytes
+            truncated = state.utterance_bytes > self.partial_window_bytes
+            try:
+                self.on_partial(user_id, state.utterance_id,
+                                state.ring.tail(min(state.utterance_bytes, self.partial_window_bytes)), truncated)
+            except Exception as e:
+                logger.error(f"Partial callback failed for {user_id}: {e}", exc_info=True)
+
+    def _acquire_ring(self) -> Optional[PcmRingBuffer]:
+        ring = self.pool.acquire()
+        if ring is None:
+            # Out of budget: take the ring of whoever has been quiet the longest.
+            cutoff = time.monotonic() - self.hangover_s
+            idle = [(state.last_packet_at, user_id) for user_id, state in self._speakers.items()
+                    if not state.speaking and state.ring is not None and state.last_packet_at < cutoff]
+            if idle:
+                self._evict(min(idle)[1])
+                ring = self.pool.acquire()
+        return ring
+
+    def _evict(self, user_id: int):
+        state = self._speakers.pop(user_id, None)
+        if state is not None and state.ring is not None:
+            self.pool.release(state.ring)
+            self.evicted_speakers += 1
+
+    def _sweep(self, now: float):
+        for user_id, state in list(self._speakers.items()):
+            if state.speaking and now - state.last_packet_at >= self.hangover_s:
+                self._finish(user_id, state.last_packet_at)
+            elif not state.speaking and now - state.last_packet_at >= self.idle_evict_s:
+                self._evict(user_id)
+
+    def _finish(self, user_id: int, ended_at: float):
+        state = self._speakers.get(user_id)
+        if state is None or not state.speaking:
+            return
+        # Keep a short tail of the trailing silence, Whisper does better with some context.
+        trailing = max(0, state.silent_frames - 5) * self.frame_bytes
+        pcm = state.ring.tail(state.utterance_bytes - trailing, skip_end=trailing)
+        enough = state.voiced_frames >= self.min_voiced_frames
+        started_at = state.started_at
+        state.speaking = False
+        state.voiced_run = 0
+        state.voiced_frames = 0
+        state.silent_frames = 0
+        state.utterance_bytes = 0
+        state.partial_mark = 0
+        state.ring.clear()
+        if enough:
+            try:
+                self.on_utterance(user_id, state.utterance_id, pcm, started_at, ended_at)
+            except Exception as e:
+                logger.error(f"Utterance callback failed for {user_id}: {e}", exc_info=True)
@@ -0,0 +1,190 @@
+# ==============================================================================
+# penny_v2_api/uploads.py
+# Chunked, size-capped ingestion of audio uploads for the API routes.
+# ==============================================================================
+import asyncio
+import io
+import mmap
+import tempfile
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Optional
+import numpy as np
+from fastapi import HTTPException, Request
+from starlette.datastructures import FormData, UploadFile
+from penny_v2_api.core.audio import WavStreamDecoder
+from penny_v2_api.core.metrics import Counter, Histogram
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+UPLOAD_BYTES = Histogram("penny_upload_bytes", "Size of accepted audio uploads.",
+                         buckets=(2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22, 2 ** 24, 2 ** 26, 2 ** 28))
+UPLOADS_REJECTED = Counter("penny_uploads_rejected_total", "Audio uploads refused.", ["reason"])
+
+class UploadTooLargeError(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit.")
+
+def check_audio_content_type(content_type: Optional[str]):
+    """Missing or generic types are left for the decoder to sniff; anything else must be audio/*."""
+    if content_type and content_type != "application/octet-stream" and not content_type.startswith("audio/"):
+        UPLOADS_REJECTED.labels("content_type").inc()
+        raise HTTPException(status_code=400, detail="Invalid audio file.")
+
+def _limit_body(request: Request, max_bytes: int) -> Request:
+    """The same request with a receive channel that refuses bodies over `max_bytes`."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        UPLOADS_REJECTED.labels("too_large").inc()
+        raise UploadTooLargeError(max_bytes)
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                UPLOADS_REJECTED.labels("too_large").inc()
+                raise UploadTooLargeError(max_bytes)
+        return message
+
+    return Request(request.scope, receive)
+
+class AudioUpload:
+    """One uploaded audio file, read chunk by chunk.
+
+    Accepts the multipart `file` field (as before) or a raw request body with an audio
+    Content-Type; the raw form is streamed straight off the socket. Use as an async context.
+    """
+    def __init__(self, request: Request, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.content_type: Optional[str] = None
+        self.size = 0
+        self._request = _limit_body(request, max_bytes)
+        self._form: Optional[FormData] = None
+        self._file: Optional[UploadFile] = None
+
+    async def __aenter__(self) -> "AudioUpload":
+        content_type = self._request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            # Starlette spools file parts to disk past 1 MB, so the form itself is bounded in RAM.
+            self._form = await self._request.form(max_files=1, max_fields=8)
+            file = self._form.get("file")
+            if not isinstance(file, UploadFile):
+                raise HTTPException(status_code=400, detail="Expected an audio file in the 'file' form field.")
+            self._file = file
+            self.content_type = file.content_type
+        else:
+            self.content_type = content_type.split(";")[0].strip() or None
+        check_audio_content_type(self.content_type)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._form is not None:
+            await self._form.close()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        if self._file is not None:
+            while chunk := await self._file.read(UPLOAD_CHUNK_SIZE):
+                self.size += len(chunk)
+                yield chunk
+        else:
+            async for chunk in self._request.stream():
+                if chunk:
+                    self.size += len(chunk)
+                    yield chunk
+        if not self.size:
+            UPLOADS_REJECTED.labels("empty").inc()
+            raise HTTPException(status_code=400, detail="Empty audio upload.")
+        UPLOAD_BYTES.observe(self.size)
+
+class SpooledUpload:
+    """Upload body kept in memory up to `memory_limit` bytes, then in an anonymous temp file.
+
+    `view()` exposes the body without copying it (memory-mapped once on disk), `reader()` as a
+    seekable file. Close it once the consumers are done.
+    """
+    def __init__(self, memory_limit: int):
+        self.memory_limit = memory_limit
+        self.size = 0
+        self._buffer = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._buffer += chunk
+        if len(self._buffer) > self.memory_limit:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def view(self) -> memoryview:
+        if self._file is None:
+            return memoryview(self._buffer)
+        self._file.flush()
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def reader(self) -> BinaryIO:
+        if self._file is None:
+            return io.BytesIO(self._buffer)  # at most memory_limit bytes
+        self._file.flush()
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # a consumer still holds a view; unmapped once it is collected
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+
+async def spool_upload(upload: AudioUpload, memory_limit: int) -> SpooledUpload:
+    spool = SpooledUpload(memory_limit)
+    try:
+        async for chunk in upload.chunks():
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+async def read_audio(upload: AudioUpload, window_s: float, on_window: Callable[[np.ndarray], Awaitable[None]],
+                     memory_limit: int) -> Optional[SpooledUpload]:
+    """Decode a PCM WAV upload while it arrives, handing each window of 16 kHz audio (up to
+    `window_s`, cut at a pause) to `on_window` as soon as it is complete. `on_window` is awaited
+    before the next chunk is read, so it can hold the upload back.
+
+    Returns None when the upload was a PCM WAV (everything went to `on_window`); otherwise the
+    spooled body, for a decoder that needs the whole file.
+    """
+    loop = asyncio.get_running_loop()
+    decoder = WavStreamDecoder(window_s)
+    spool: Optional[SpooledUpload] = SpooledUpload(memory_limit)
+    try:
+        async for chunk in upload.chunks():
+            if decoder.is_wav is not True:
+                spool.write(chunk)
+            for window in await loop.run_in_executor(None, decoder.feed, chunk):
+                await on_window(window)
+            if decoder.is_wav and spool is not None:
+                spool.close()  # only needed if the header had turned out not to be WAV
+                spool = None
+        if decoder.is_wav:
+            tail = decoder.finish()
+            if tail is not None:
+                await on_window(tail)
+        return spool
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
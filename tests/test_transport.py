@@ -0,0 +1,99 @@
+import asyncio
+from pathlib import Path
+import pytest
+from penny_v2_api.core.event_bus import EventBus
+from penny_v2_api.core.events import MusicGenerationRequest, TranscriptionRequest
+from penny_v2_api.core.exceptions import ServiceOverloadedError
+from penny_v2_api.core.transport import CHUNK_BYTES, EventBridge, LocalBroker, local_pair
+from penny_v2_api.services.music_cache import MusicResultCache
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+async def start_nodes(tmp_path: Path, over: str):
+    """A frontend bus and a worker bus joined through a LocalBroker, over a local pair or a Unix socket."""
+    broker = LocalBroker()
+    if over == "unix":
+        url = f"unix://{tmp_path / 'broker.sock'}"
+        await broker.listen(url)
+        connect_frontend = connect_worker = url
+    else:
+        def via_pair():
+            async def connect():
+                node_end, broker_end = local_pair()
+                broker.attach(broker_end)
+                return node_end
+            return connect
+        connect_frontend, connect_worker = via_pair(), via_pair()
+
+    worker_bus, frontend_bus = EventBus(), EventBus()
+    results = tmp_path / "worker"
+    results.mkdir()
+
+    async def transcribe(event: TranscriptionRequest):
+        if event.audio_data == b"busy":
+            event.response_future.set_exception(ServiceOverloadedError("transcription", retry_after=3.0))
+        else:
+            event.response_future.set_result(f"{len(event.audio_data)} bytes")
+
+    async def generate(event: MusicGenerationRequest):
+        path = results / f"{event.prompt}.wav"
+        path.write_bytes(bytes(range(256)) * (event.duration // 256))
+        event.response_future.set_result(str(path))
+
+    worker_bus.subscribe_async(TranscriptionRequest, transcribe)
+    worker_bus.subscribe_async(MusicGenerationRequest, generate)
+    worker = EventBridge(worker_bus, connect_worker, name="worker", serve=[TranscriptionRequest, MusicGenerationRequest],
+                         file_results=[MusicGenerationRequest])
+    store = MusicResultCache(str(tmp_path / "frontend"), max_bytes=1 << 30, max_entries=10)
+    frontend = EventBridge(frontend_bus, connect_frontend, name="frontend",
+                           remote=[TranscriptionRequest, MusicGenerationRequest], file_store=store)
+    await worker.start()
+    await frontend.start()
+    # The broker routes requests only once it has the worker's hello.
+    while not any("TranscriptionRequest" in node.serves for node in broker._nodes.values()):
+        await asyncio.sleep(0.01)
+    return broker, frontend_bus, [frontend, worker]
+
+async def request(bus: EventBus, event_cls, **fields):
+    future = asyncio.get_running_loop().create_future()
+    await bus.publish(event_cls(response_future=future, **fields))
+    return await future
+
+@pytest.mark.parametrize("over", ["pair", "unix"])
+def test_round_trip(tmp_path, over):
+    async def scenario():
+        broker, bus, bridges = await start_nodes(tmp_path, over)
+        try:
+            assert await request(bus, TranscriptionRequest, audio_data=b"\x00" * 1000) == "1000 bytes"
+
+            with pytest.raises(ServiceOverloadedError) as overloaded:
+                await request(bus, TranscriptionRequest, audio_data=b"busy")
+            assert overloaded.value.retry_after == 3.0
+
+            # Large enough to be streamed in several chunks.
+            size = 3 * CHUNK_BYTES + 256
+            shipped = Path(await request(bus, MusicGenerationRequest, prompt="abc123", duration=size))
+            assert shipped.parent == tmp_path / "frontend" and shipped.stem == "abc123"
+            assert shipped.read_bytes() == (tmp_path / "worker" / "abc123.wav").read_bytes()
+        finally:
+            for bridge in bridges:
+                await bridge.stop()
+            await broker.close()
+
+    run(scenario())
+
+def test_spooled_upload_is_sent_from_its_file(tmp_path):
+    async def scenario():
+        broker, bus, bridges = await start_nodes(tmp_path, "unix")
+        try:
+            upload = tmp_path / "upload.bin"
+            upload.write_bytes(b"\x01" * (2 * CHUNK_BYTES + 7))
+            with open(upload, "rb") as spool:
+                assert await request(bus, TranscriptionRequest, audio_data=spool) == f"{2 * CHUNK_BYTES + 7} bytes"
+        finally:
+            for bridge in bridges:
+                await bridge.stop()
+            await broker.close()
+
+    run(scenario())